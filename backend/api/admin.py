@@ -16,6 +16,7 @@ from .models import (
     Question,
     Choice,
     QuizAttempt,
+    QuizAttemptAnswer,
     Resource,
     LearningObjective,
     Requirement,
@@ -24,7 +25,9 @@ from .models import (
     Message,
     Grade,
     CodeChallenge,      # <-- ¡IMPORTA ESTE!
-    LiveCodeChallenge
+    LiveCodeChallenge,
+    ChallengeTestCase,
+    CodeSubmission
 )
 
 # ====================================================================
@@ -86,6 +89,29 @@ class SubmissionAdmin(admin.ModelAdmin):
     
     # Hacemos que los campos de la entrega sean de solo lectura para el admin
     readonly_fields = ('assignment', 'user', 'content', 'file_submission', 'submitted_at')
+
+class CodeChallengeTestCaseInline(admin.TabularInline):
+    model = ChallengeTestCase
+    fk_name = 'challenge'
+    exclude = ('live_challenge',)
+    extra = 1
+
+class LiveCodeChallengeTestCaseInline(admin.TabularInline):
+    model = ChallengeTestCase
+    fk_name = 'live_challenge'
+    exclude = ('challenge',)
+    extra = 1
+
+class CodeChallengeAdmin(admin.ModelAdmin):
+    inlines = [CodeChallengeTestCaseInline]
+
+class LiveCodeChallengeAdmin(admin.ModelAdmin):
+    inlines = [LiveCodeChallengeTestCaseInline]
+
+class CodeSubmissionAdmin(admin.ModelAdmin):
+    list_display = ('user', 'challenge', 'live_challenge', 'is_correct', 'created_at')
+    list_filter = ('is_correct',)
+    exclude = ('minhash',)
 # ====================================================================
 # 3. Registro de Modelos
 # ====================================================================
@@ -114,6 +140,7 @@ admin.site.register(Quiz)
 admin.site.register(Question)
 admin.site.register(Choice)
 admin.site.register(QuizAttempt)
+admin.site.register(QuizAttemptAnswer)
 admin.site.register(Resource)
 
 # (Opcional) Registra los nuevos modelos individualmente
@@ -125,5 +152,6 @@ admin.site.register(Conversation, ConversationAdmin)
 admin.site.register(Message)
 admin.site.unregister(Submission) # <-- Des-registra la versión simple
 admin.site.register(Submission, SubmissionAdmin)
-admin.site.register(CodeChallenge)
-admin.site.register(LiveCodeChallenge)
\ No newline at end of file
+admin.site.register(CodeChallenge, CodeChallengeAdmin)
+admin.site.register(LiveCodeChallenge, LiveCodeChallengeAdmin)
+admin.site.register(CodeSubmission, CodeSubmissionAdmin)
@@ -0,0 +1,330 @@
+# backend/api/ai_evaluator.py
+import json
+import time
+import queue
+import asyncio
+import threading
+from django.conf import settings
+from .code_runner import get_pool, outputs_match
+from .evaluation_cache import normalize_code
+
+# ====================================================================
+# --- CLIENTE ASÍNCRONO DE EVALUACIÓN CON IA (Gemini) ---
+# ====================================================================
+# Las llamadas a Gemini corren en un event loop propio (un hilo dedicado),
+# así que nunca ocupan el executor de la base de datos de Django: una
+# evaluación lenta ya no frena los mensajes del chat de toda la sala.
+# En ese loop vive el cliente gRPC (una conexión compartida), un semáforo
+# que limita las llamadas simultáneas y el timeout de cada llamada.
+# google.generativeai (y con él grpc/protobuf) se importa recién al crear
+# el cliente, en la primera evaluación: los workers, los comandos y el
+# chat que nunca evalúan no pagan ese costo de arranque ni de memoria.
+#
+# Quien evalúa no habla con Gemini directamente: usa un backend
+# (settings.AI_EVAL_BACKEND) con la misma interfaz para Gemini, para el
+# sandbox local (sin IA) y para uno falso y determinista (pruebas/benchmarks).
+
+DEFAULT_MODEL = 'gemini-2.5-flash'
+
+
+class AIEvaluationError(Exception):
+    """ La IA no respondió a tiempo o su respuesta no es un JSON válido. """
+
+
+def parse_json_response(text):
+    """ Quita los ```json ... ``` que a veces agrega Gemini y parsea. """
+    clean_text = text.strip().replace("```json", "").replace("```", "").strip()
+    try:
+        return json.loads(clean_text)
+    except ValueError as e:
+        raise AIEvaluationError(f"Respuesta no es JSON: {clean_text[:200]}") from e
+
+
+# Marca de fin de un stream (ver stream_sync)
+_END_OF_STREAM = object()
+
+
+class GeminiClient:
+
+    def __init__(self, max_concurrency=8, timeout=20):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        import google.generativeai as genai  # Carga diferida (ver arriba)
+        self._genai = genai
+        self._loop = asyncio.new_event_loop()
+        self._semaphore = None
+        self._thread = threading.Thread(target=self._run_loop, name='ai-evaluator', daemon=True)
+        self._thread.start()
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        try:
+            self._genai.configure(api_key=settings.GEMINI_API_KEY)
+        except Exception as e:
+            print(f"ADVERTENCIA (Evaluador IA): No se pudo configurar la API de Gemini. {e}")
+        self._loop.run_forever()
+
+    async def _generate(self, prompt, model_name):
+        async with self._semaphore:
+            model = self._genai.GenerativeModel(model_name)
+            try:
+                response = await asyncio.wait_for(
+                    model.generate_content_async(prompt), timeout=self.timeout
+                )
+            except asyncio.TimeoutError as e:
+                raise AIEvaluationError(f"Gemini no respondió en {self.timeout}s") from e
+            return response.text
+
+    async def _stream(self, prompt, model_name, sink):
+        """ Pone cada trozo de texto en 'sink' (una queue.Queue) a medida que llega. """
+        try:
+            async with self._semaphore:
+                model = self._genai.GenerativeModel(model_name)
+                response = await asyncio.wait_for(
+                    model.generate_content_async(prompt, stream=True), timeout=self.timeout
+                )
+                async for chunk in response:
+                    sink.put(chunk.text)
+        except Exception as e:
+            sink.put(e)
+        finally:
+            sink.put(_END_OF_STREAM)
+
+    def _submit(self, prompt, model_name):
+        return asyncio.run_coroutine_threadsafe(
+            self._generate(prompt, model_name or DEFAULT_MODEL), self._loop
+        )
+
+    async def generate(self, prompt, model_name=None):
+        """
+        Texto de la respuesta. Se puede esperar desde cualquier event loop;
+        si quien espera se cancela, la llamada a Gemini también se cancela.
+        """
+        return await asyncio.wrap_future(self._submit(prompt, model_name))
+
+    async def evaluate(self, prompt, model_name=None):
+        """ Igual que generate(), pero parsea la respuesta como JSON. """
+        return parse_json_response(await self.generate(prompt, model_name))
+
+    def stream_sync(self, prompt, model_name=None):
+        """
+        Generador síncrono con los trozos de la respuesta según los genera
+        Gemini. Cada trozo debe llegar antes de 'timeout' segundos.
+        """
+        sink = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream(prompt, model_name or DEFAULT_MODEL, sink), self._loop
+        )
+        try:
+            while True:
+                try:
+                    item = sink.get(timeout=self.timeout)
+                except queue.Empty as e:
+                    raise AIEvaluationError(f"Gemini dejó de responder por {self.timeout}s") from e
+                if item is _END_OF_STREAM:
+                    return
+                if isinstance(item, Exception):
+                    raise AIEvaluationError(f"Error en el stream de Gemini: {item}") from item
+                yield item
+        finally:
+            future.cancel()
+
+
+# ====================================================================
+# --- BACKENDS DE EVALUACIÓN ---
+# ====================================================================
+# Todos cumplen la misma interfaz:
+#   - evaluate_batch(challenge, codes) (async): un veredicto {'is_correct': bool}
+#     por código, en el mismo orden (None si no hubo veredicto para ese código).
+#   - stream_review(challenge, code, test_summary=''): generador síncrono con los
+#     trozos de una revisión en texto plano (VEREDICTO / FEEDBACK / REVISIÓN).
+# 'challenge' es cualquier objeto con description y solution.
+
+BATCH_PROMPT = """
+Eres un tutor de programación experto. Evalúa cada una de estas {count} soluciones
+de alumnos para el MISMO problema, de forma independiente.
+PROBLEMA: {description}
+SOLUCIÓN ÓPTIMA: ```python {solution} ```
+
+{submissions}
+
+Responde SOLO con un JSON: una lista con un objeto por solución, en el mismo orden:
+[{{ "id": 0, "is_correct": true o false }}, ...]
+Si el código funciona y resuelve el problema, es true. Si tiene errores de sintaxis o lógica, false.
+"""
+
+VERDICT_LINE = 'VEREDICTO: [CORRECTO o INCORRECTO, según si el código resuelve el problema]\n    '
+
+REVIEW_PROMPT = """
+    Eres un tutor de programación experto. Un alumno ha enviado una solución
+    para un desafío de código.
+
+    EL PROBLEMA:
+    {description}
+
+    LA SOLUCIÓN DEL ALUMNO:
+    ```python
+    {code}
+    ```
+
+    LA SOLUCIÓN ÓPTIMA (para tu referencia):
+    ```python
+    {solution}
+    ```
+
+    {test_summary}
+    Por favor, evalúa la solución del alumno y responde en texto plano,
+    EXACTAMENTE con este formato (sin JSON):
+    {verdict_line}FEEDBACK: [Un comentario breve y amable sobre el código del alumno]
+    REVISIÓN:
+    ```python
+    [El código original del alumno, pero con comentarios inline
+     (ej. # ¡Buen trabajo!) explicando los errores o mejoras.
+     Si es perfecto, solo pon un comentario positivo.]
+    ```
+    """
+
+
+def format_review(is_correct, feedback, code):
+    """ Revisión con el mismo formato que pide REVIEW_PROMPT (para los backends locales). """
+    verdict = 'CORRECTO' if is_correct else 'INCORRECTO'
+    return f"VEREDICTO: {verdict}\nFEEDBACK: {feedback}\nREVISIÓN:\n```python\n{code.rstrip()}\n```"
+
+
+class EvaluatorBackend:
+    name = None
+
+    async def evaluate_batch(self, challenge, codes):
+        raise NotImplementedError
+
+    def stream_review(self, challenge, code, test_summary=''):
+        raise NotImplementedError
+
+
+class GeminiBackend(EvaluatorBackend):
+    """ La IA de verdad: un prompt por lote y la revisión en streaming. """
+    name = 'gemini'
+
+    def __init__(self, max_concurrency=8, timeout=20):
+        self.client = GeminiClient(max_concurrency=max_concurrency, timeout=timeout)
+
+    async def evaluate_batch(self, challenge, codes):
+        prompt = BATCH_PROMPT.format(
+            count=len(codes),
+            description=challenge.description,
+            solution=challenge.solution,
+            submissions="\n".join(f"SOLUCIÓN {i}: ```python {code} ```" for i, code in enumerate(codes)),
+        )
+        result = await self.client.evaluate(prompt, 'gemini-2.5-flash')
+        verdicts = [None] * len(codes)
+        for item in result if isinstance(result, list) else []:
+            index = item.get('id')
+            if isinstance(index, int) and 0 <= index < len(codes):
+                verdicts[index] = {'is_correct': bool(item.get('is_correct', False))}
+        return verdicts
+
+    def stream_review(self, challenge, code, test_summary=''):
+        prompt = REVIEW_PROMPT.format(
+            description=challenge.description,
+            code=code,
+            solution=challenge.solution,
+            test_summary=test_summary,
+            # Con casos de prueba la corrección ya está decidida: no pedimos veredicto
+            verdict_line='' if test_summary else VERDICT_LINE,
+        )
+        return self.client.stream_sync(prompt, 'gemini-pro')
+
+
+class SandboxBackend(EvaluatorBackend):
+    """
+    Sin IA: corre la solución de referencia y la del alumno en el sandbox
+    (stdin vacío) y compara las salidas. Sirve sin GEMINI_API_KEY.
+    """
+    name = 'sandbox'
+
+    def _run(self, code):
+        return get_pool().run(
+            code, '',
+            getattr(settings, 'CODE_RUNNER_TIME_LIMIT', 2),
+            getattr(settings, 'CODE_RUNNER_MEMORY_MB', 256),
+        )
+
+    def _verdict(self, code, expected):
+        actual = self._run(code)
+        if actual['status'] != 'ok':
+            return False, f"Tu programa terminó con un error: {actual['error'] or actual['status']}"
+        if expected['status'] == 'ok' and outputs_match(actual['stdout'], expected['stdout']):
+            return True, "Tu programa produce la misma salida que la solución de referencia."
+        return False, "La salida de tu programa no coincide con la de la solución de referencia."
+
+    async def evaluate_batch(self, challenge, codes):
+        expected = await asyncio.to_thread(self._run, challenge.solution)
+        verdicts = await asyncio.gather(*[
+            asyncio.to_thread(self._verdict, code, expected) for code in codes
+        ])
+        return [{'is_correct': is_correct} for is_correct, _ in verdicts]
+
+    def stream_review(self, challenge, code, test_summary=''):
+        is_correct, feedback = self._verdict(code, self._run(challenge.solution))
+        yield format_review(is_correct, feedback, code)
+
+
+class FakeBackend(EvaluatorBackend):
+    """
+    Determinista y sin red: es correcto si el código normalizado es igual al
+    de la solución. 'latency' (segundos) simula lo que tarda la IA.
+    """
+    name = 'fake'
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+
+    def _is_correct(self, challenge, code):
+        return normalize_code(code) == normalize_code(challenge.solution)
+
+    async def evaluate_batch(self, challenge, codes):
+        await asyncio.sleep(self.latency)
+        return [{'is_correct': self._is_correct(challenge, code)} for code in codes]
+
+    def stream_review(self, challenge, code, test_summary=''):
+        is_correct = self._is_correct(challenge, code)
+        feedback = "¡Igual a la solución de referencia!" if is_correct else "No coincide con la solución de referencia."
+        lines = format_review(is_correct, feedback, code).splitlines(keepends=True)
+        for line in lines:
+            time.sleep(self.latency / len(lines))
+            yield line
+
+
+def build_evaluator(name=None, latency=None):
+    """ Backend por nombre ('gemini' | 'sandbox' | 'fake'); por defecto settings.AI_EVAL_BACKEND. """
+    name = name or getattr(settings, 'AI_EVAL_BACKEND', 'gemini')
+    if name == 'gemini':
+        return GeminiBackend(
+            max_concurrency=getattr(settings, 'AI_EVAL_MAX_CONCURRENCY', 8),
+            timeout=getattr(settings, 'AI_EVAL_TIMEOUT', 20),
+        )
+    if name == 'sandbox':
+        return SandboxBackend()
+    if name == 'fake':
+        return FakeBackend(latency=getattr(settings, 'AI_EVAL_FAKE_LATENCY', 0.5) if latency is None else latency)
+    raise ValueError(f"Backend de evaluación desconocido: {name}")
+
+
+_evaluator = None
+_evaluator_lock = threading.Lock()
+
+
+def get_evaluator():
+    global _evaluator
+    with _evaluator_lock:
+        if _evaluator is None:
+            _evaluator = build_evaluator()
+    return _evaluator
+
+
+def set_evaluator(backend):
+    """ Reemplaza el backend del proceso (ej. el benchmark usa el falso). """
+    global _evaluator
+    with _evaluator_lock:
+        _evaluator = backend
@@ -0,0 +1,133 @@
+# backend/api/chat_writer.py
+import asyncio
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from .models import Message, Conversation
+from .game_runner import _spawn
+from .unread_counters import count_new_messages
+
+# ====================================================================
+# --- ESCRITURA DIFERIDA DE MENSAJES DEL CHAT (write-behind) ---
+# ====================================================================
+# El consumer transmite el mensaje apenas llega (con su id de message_ids.py)
+# y lo deja aquí. Cada pocos milisegundos (o al juntar un lote) se guardan
+# todos con UN bulk_create, y 'last_message' y los no leídos se actualizan
+# una vez por conversación y lote (bulk_create no dispara los signals).
+# Si el proceso muere, se pierden como mucho los mensajes de una ventana.
+
+MAX_RETRIES = 3
+
+
+class MessageIdCollision(Exception):
+    """
+    Un id ya es de OTRO mensaje. No debería pasar nunca: cada proceso tiene
+    su número de message_ids.py con un lease en Redis. El mensaje ya se
+    transmitió con ese id (los clientes lo usan para editar, leer y paginar),
+    así que no se guarda con otro: se descarta y se avisa.
+    """
+
+    def __init__(self, message_ids):
+        self.message_ids = message_ids
+        super().__init__(f"Ids de mensajes repetidos: {message_ids}")
+
+
+def _split_saved(messages):
+    """
+    Separa el lote en (por guardar, ids en colisión). Quita los que ya están
+    en la BD (reintento de un lote que sí llegó a guardarse) y aparta los
+    que tienen el id de OTRO mensaje.
+    """
+    saved = {
+        row['id']: row for row in Message.objects.filter(id__in=[m.id for m in messages])
+        .values('id', 'conversation_id', 'sender_id', 'content')
+    }
+    fresh, collisions = [], []
+    for message in messages:
+        row = saved.get(message.id)
+        if row is None:
+            fresh.append(message)
+        elif (row['conversation_id'], row['sender_id'], row['content']) != (
+            message.conversation_id, message.sender_id, message.content
+        ):
+            collisions.append(message.id)
+    return fresh, collisions
+
+
+def save_messages(messages):
+    """
+    Inserta el lote y avanza 'last_message' de cada conversación (solo hacia adelante).
+    Guarda el resto del lote y lanza MessageIdCollision si algún id ya era de otro mensaje.
+    """
+    with transaction.atomic():
+        messages, collisions = _split_saved(messages)
+        Message.objects.bulk_create(messages)
+        last_ids = {}
+        for message in messages:
+            last_ids[message.conversation_id] = max(message.id, last_ids.get(message.conversation_id, 0))
+        for conversation_id, message_id in last_ids.items():
+            Conversation.objects.filter(id=conversation_id).filter(
+                Q(last_message__isnull=True) | Q(last_message_id__lt=message_id)
+            ).update(last_message_id=message_id)
+    # No leídos de los demás participantes: una llamada a Redis por lote
+    # (solo los recién guardados: un reintento no vuelve a contarlos)
+    if messages:
+        try:
+            count_new_messages(messages)
+        except Exception as e:
+            print(f"[CHAT WRITER] ERROR actualizando no leídos: {e}")
+    if collisions:
+        raise MessageIdCollision(collisions)
+
+
+class MessageWriter:
+
+    def __init__(self, interval=0.05, max_batch=200):
+        self.interval = interval
+        self.max_batch = max_batch
+        self._buffer = []
+        self._timer = None
+
+    def add(self, message, attempt=0):
+        """ Encola un Message sin guardar (con id y timestamp ya puestos). """
+        self._buffer.append((message, attempt))
+        if len(self._buffer) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.interval, self._flush)
+
+    def _flush(self):
+        if self._timer: self._timer.cancel()
+        self._timer = None
+        batch, self._buffer = self._buffer, []
+        if batch:
+            _spawn(self._write(batch))
+
+    async def _write(self, batch):
+        try:
+            await database_sync_to_async(save_messages)([message for message, _ in batch])
+        except MessageIdCollision as e:
+            # El resto del lote ya se guardó; reintentar no arregla un id repetido
+            print(f"[CHAT WRITER] ERROR GRAVE: {len(e.message_ids)} mensajes descartados por id repetido: {e.message_ids}")
+        except Exception as e:
+            print(f"[CHAT WRITER] ERROR guardando {len(batch)} mensajes: {e}")
+            for message, attempt in batch:
+                if attempt + 1 < MAX_RETRIES:
+                    self.add(message, attempt + 1)
+                else:
+                    print(f"[CHAT WRITER] Mensaje {message.id} descartado tras {MAX_RETRIES} intentos.")
+
+    async def flush(self):
+        """ Guarda ya lo pendiente (pruebas y apagado). """
+        if self._timer: self._timer.cancel()
+        self._timer = None
+        batch, self._buffer = self._buffer, []
+        if batch:
+            await self._write(batch)
+
+
+message_writer = MessageWriter(
+    interval=getattr(settings, 'CHAT_WRITE_INTERVAL', 0.05),
+    max_batch=getattr(settings, 'CHAT_WRITE_BATCH', 200),
+)
@@ -0,0 +1,61 @@
+# backend/api/code_precheck.py
+import ast
+from django.conf import settings
+from .evaluation_cache import normalize_code
+
+# ====================================================================
+# --- PRE-CHEQUEOS ESTÁTICOS (antes del sandbox y de la IA) ---
+# ====================================================================
+# Lo que se puede rechazar sin ejecutar nada se responde aquí, en
+# microsegundos: código vacío o demasiado grande, errores de sintaxis,
+# funciones sin cuerpo o el código inicial sin cambios.
+
+
+def _is_trivial(stmt):
+    """ pass, ..., o un docstring suelto. """
+    if isinstance(stmt, ast.Pass):
+        return True
+    return isinstance(stmt, ast.Expr) and isinstance(stmt.value, ast.Constant) \
+        and (stmt.value.value is Ellipsis or isinstance(stmt.value.value, str))
+
+
+def _is_empty_body(body):
+    """ Un cuerpo vacío o con solo pass/.../docstrings (incluye defs anidados vacíos). """
+    for stmt in body:
+        if isinstance(stmt, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            if not _is_empty_body(stmt.body):
+                return False
+        elif not _is_trivial(stmt):
+            return False
+    return True
+
+
+def precheck_code(code, starter_code=None):
+    """
+    None si vale la pena evaluar el código; si no, el motivo del rechazo:
+    {'reason': 'empty' | 'too_large' | 'syntax_error' | 'empty_body' | 'unchanged', 'feedback': str}
+    """
+    max_chars = getattr(settings, 'CODE_MAX_CHARS', 20_000)
+    max_lines = getattr(settings, 'CODE_MAX_LINES', 500)
+
+    if not code or not code.strip():
+        return {'reason': 'empty', 'feedback': "No enviaste código."}
+    if len(code) > max_chars or len(code.splitlines()) > max_lines:
+        return {
+            'reason': 'too_large',
+            'feedback': f"Tu código es demasiado largo (máximo {max_lines} líneas y {max_chars} caracteres).",
+        }
+
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError) as e:  # ValueError: p. ej. bytes nulos en el código
+        where = f" en la línea {e.lineno}" if getattr(e, 'lineno', None) else ""
+        return {'reason': 'syntax_error', 'feedback': f"Error de sintaxis{where}: {getattr(e, 'msg', e)}."}
+
+    if _is_empty_body(tree.body):
+        return {'reason': 'empty_body', 'feedback': "Tu código todavía no hace nada: completa el cuerpo de las funciones."}
+
+    if starter_code and starter_code.strip() and normalize_code(code) == normalize_code(starter_code):
+        return {'reason': 'unchanged', 'feedback': "Enviaste el código inicial sin cambios. ¡Inténtalo!"}
+
+    return None
@@ -0,0 +1,285 @@
+# backend/api/code_runner.py
+import os
+import pwd
+import sys
+import json
+import secrets
+import atexit
+import signal
+import tempfile
+import threading
+import subprocess
+from collections import deque
+from django.conf import settings
+
+# ====================================================================
+# --- SANDBOX LOCAL PARA EL CÓDIGO DE LOS ALUMNOS ---
+# ====================================================================
+# Cada caso de prueba se ejecuta en un intérprete aparte que se arrancó
+# de antemano (pool "pre-forkeado"): al llegar un trabajo ya está listo,
+# así que una ejecución tarda milisegundos y no segundos como la IA.
+# Cada intérprete se usa UNA sola vez y muere: nada se comparte entre alumnos.
+
+# Máximo de caracteres de salida que devolvemos por caso
+MAX_OUTPUT = 10_000
+
+# Lo que corre dentro de cada intérprete del pool. Espera su trabajo por
+# stdin (una línea JSON), se pone los límites y recién entonces ejecuta
+# el código del alumno con su entrada. Devuelve una línea JSON por stdout,
+# firmada con el 'nonce' del trabajo (el alumno no lo conoce, así que no
+# puede escribir un resultado falso en el stdout real y salir con os._exit).
+SANDBOX_HARNESS = r'''
+def _sandbox():
+    import sys, io, os, json, types, resource, sysconfig, threading
+    job = json.loads(sys.stdin.readline())
+    code = job["code"]
+
+    # Límites del sistema operativo: CPU (s), memoria (bytes) y archivos
+    # (el de procesos va más abajo: los hilos también cuentan)
+    resource.setrlimit(resource.RLIMIT_CPU, (job["cpu"], job["cpu"] + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (job["memory"], job["memory"]))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (0, 0))
+
+    # Sin red, sin procesos, sin escribir y leyendo solo la librería estándar.
+    # Los audit hooks no se pueden quitar una vez instalados, pero el código
+    # del alumno puede modificar cualquier objeto de Python que alcance: por
+    # eso el hook no lee globales ni builtins (todo queda en su closure) y se
+    # bloquean las vías para llegar a él o al harness (gc, trazas).
+    _audit = _make_audit_hook(
+        readable=tuple({sysconfig.get_path("stdlib"), sysconfig.get_path("platstdlib")}),
+        cwd=os.getcwd(),
+    )
+    sys.addaudithook(_audit)
+    del _audit
+
+    # El alumno corre en un módulo __main__ nuevo (sys.modules no lleva al
+    # harness) y en otro hilo: recorriendo f_back desde sus frames no se
+    # llega a este, que tiene el nonce
+    student = types.ModuleType("__main__")
+    sys.modules["__main__"] = student
+    outcome = {"status": "ok", "error": ""}
+
+    start = threading.Event()
+
+    def run_student():
+        start.wait()
+        try:
+            exec(compile(code, "<alumno>", "exec"), student.__dict__)
+        except SystemExit:
+            pass
+        except MemoryError:
+            outcome.update(status="memory", error="Se superó el límite de memoria")
+        except BaseException as e:
+            outcome.update(status="error", error=f"{type(e).__name__}: {e}")
+
+    real_stdout = sys.stdout
+    out = io.StringIO()
+    sys.stdin, sys.stdout = io.StringIO(job["input"]), out
+    thread = threading.Thread(target=run_student)
+    thread.start()
+    # Con el hilo del alumno ya creado: ni procesos ni hilos nuevos
+    resource.setrlimit(resource.RLIMIT_NPROC, (0, 0))
+    start.set()
+    thread.join()
+    real_stdout.write(json.dumps({
+        "nonce": job["nonce"], "status": outcome["status"],
+        "stdout": out.getvalue()[:job["max_output"]], "error": outcome["error"],
+    }))
+    real_stdout.flush()
+
+
+def _make_audit_hook(readable, cwd):
+    import os
+    blocked = (
+        "socket.", "ctypes.", "subprocess.", "os.system", "os.exec", "os.fork", "os.posix_spawn",
+        "os.spawn", "os.kill", "os.remove", "os.rename", "os.rmdir", "os.mkdir", "os.chmod",
+        "os.chown", "os.truncate", "os.link", "os.symlink", "os.listdir", "os.scandir",
+        "os.chdir", "sys.addaudithook",
+        # Caminos hasta el hook o el harness (gc, frames de otros hilos, trazas)
+        "gc.get_", "sys._current_frames", "sys.settrace", "sys.setprofile",
+    )
+    blocked_modules = (
+        "_ctypes", "ctypes", "_posixsubprocess", "_xxsubinterpreters", "_interpreters",
+        "_testcapi", "_testinternalcapi",
+    )
+    write_flags = os.O_WRONLY | os.O_RDWR | os.O_CREAT | os.O_APPEND | os.O_TRUNC
+    denied, str_, bytes_, type_, any_, bool_ = PermissionError, str, bytes, type, any, bool
+
+    def normpath(path):
+        # Solo métodos de str: nada que el alumno pueda reemplazar
+        if not path.startswith("/"):
+            path = cwd + "/" + path
+        parts = []
+        for part in path.split("/"):
+            if part == "..":
+                if parts: parts.pop()
+            elif part and part != ".":
+                parts.append(part)
+        return "/" + "/".join(parts)
+
+    def audit(event, args):
+        if event.startswith(blocked):
+            raise denied(f"'{event}' no está permitido en el sandbox")
+        if event == "import" and args[0].startswith(blocked_modules):
+            raise denied(f"El módulo '{args[0]}' no está permitido en el sandbox")
+        if event == "open" and type_(args[0]) is not int:
+            path, mode, flags = args
+            if type_(path) is bytes_:
+                path = path.decode("utf-8", "surrogateescape")
+            # Solo str exacto: un PathLike podría devolver otra ruta al abrir
+            if type_(path) is not str_:
+                raise denied("El sandbox no permite abrir archivos")
+            writes = any_(c in mode for c in "wax+") if mode else bool_((flags or 0) & write_flags)
+            path = normpath(path)
+            if writes or not any_(path == r or path.startswith(r + "/") for r in readable):
+                raise denied("El sandbox no permite abrir archivos")
+
+    return audit
+
+
+_sandbox()
+'''
+
+def _sandbox_credentials():
+    """
+    Si el servidor corre como root (la imagen de Docker), los intérpretes
+    bajan a CODE_RUNNER_USER: así RLIMIT_NPROC sí aplica y no pueden leer
+    /proc/<pid>/environ de otros procesos.
+    """
+    user = getattr(settings, 'CODE_RUNNER_USER', 'nobody')
+    if not user or os.geteuid() != 0:
+        return {}
+    uid = pwd.getpwnam(user).pw_uid
+    return {'user': uid, 'group': uid, 'extra_groups': []}
+
+
+class SandboxPool:
+    """
+    Pool de intérpretes Python aislados (-I: sin variables de entorno ni
+    site-packages del usuario), arrancados por adelantado y esperando trabajo.
+    Al tomar uno, se arranca su reemplazo en paralelo.
+
+    Los bloqueos de red, procesos y archivos son audit hooks de Python; si
+    el servidor corre como root, además el intérprete baja a SANDBOX_USER.
+    En producción el worker debería correr además en un contenedor sin red.
+    """
+
+    def __init__(self, size=4):
+        self.size = size
+        self.workdir = tempfile.mkdtemp(prefix='sandbox_')
+        self._idle = deque()
+        self._lock = threading.Lock()
+        for _ in range(size):
+            self._idle.append(self._spawn())
+        atexit.register(self.close)
+
+    def _spawn(self):
+        return subprocess.Popen(
+            [sys.executable, '-I', '-c', SANDBOX_HARNESS],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            cwd=self.workdir,
+            env={},
+            start_new_session=True,
+            text=True,
+            **_sandbox_credentials(),
+        )
+
+    def _acquire(self):
+        with self._lock:
+            proc = self._idle.popleft() if self._idle else None
+            # Reponemos el pool: el nuevo intérprete arranca mientras este trabaja
+            if len(self._idle) < self.size:
+                self._idle.append(self._spawn())
+        if proc is None or proc.poll() is not None:
+            proc = self._spawn()
+        return proc
+
+    def run(self, code, input_data='', time_limit=2, memory_mb=256):
+        """
+        Ejecuta 'code' con 'input_data' como stdin.
+        Devuelve {'status': ok|error|timeout|memory, 'stdout': str, 'error': str}.
+        """
+        proc = self._acquire()
+        job = {
+            'code': code,
+            'input': input_data,
+            'cpu': max(1, int(time_limit)),
+            'memory': memory_mb * 1024 * 1024,
+            'max_output': MAX_OUTPUT,
+            'nonce': secrets.token_hex(16),
+        }
+        try:
+            # Tiempo real (no solo CPU): cubre sleep() y bucles bloqueados
+            raw, _ = proc.communicate(json.dumps(job) + '\n', timeout=time_limit + 1)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.communicate()
+            return {'status': 'timeout', 'stdout': '', 'error': 'Se superó el tiempo límite'}
+
+        try:
+            result = json.loads(raw)
+            if result.pop('nonce', None) != job['nonce']:
+                raise ValueError
+            return result
+        except ValueError:
+            # El proceso murió sin responder (señal del límite de CPU o de memoria)
+            if proc.returncode in (-signal.SIGXCPU, -signal.SIGKILL):
+                return {'status': 'timeout', 'stdout': '', 'error': 'Se superó el tiempo límite'}
+            return {'status': 'error', 'stdout': '', 'error': f'El programa terminó con código {proc.returncode}'}
+
+    def close(self):
+        with self._lock:
+            while self._idle:
+                self._idle.popleft().kill()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SandboxPool(getattr(settings, 'CODE_RUNNER_POOL_SIZE', 4))
+    return _pool
+
+
+def outputs_match(actual, expected):
+    """ Compara ignorando espacios al final de cada línea y líneas vacías al final. """
+    normalize = lambda text: [line.rstrip() for line in text.strip('\n').splitlines()]
+    return normalize(actual) == normalize(expected)
+
+
+def run_test_cases(code, test_cases):
+    """
+    Corre el código del alumno contra cada caso de prueba.
+    Devuelve {'is_correct', 'passed', 'total', 'results'}; los casos ocultos
+    solo informan si pasaron (nunca su entrada ni la salida esperada).
+    """
+    pool = get_pool()
+    time_limit = getattr(settings, 'CODE_RUNNER_TIME_LIMIT', 2)
+    memory_mb = getattr(settings, 'CODE_RUNNER_MEMORY_MB', 256)
+
+    results = []
+    for case in test_cases:
+        run = pool.run(code, case.input_data, time_limit, memory_mb)
+        passed = run['status'] == 'ok' and outputs_match(run['stdout'], case.expected_output)
+        result = {'passed': passed, 'status': run['status'], 'error': run['error']}
+        if not case.is_hidden:
+            result.update({
+                'input': case.input_data,
+                'expected_output': case.expected_output,
+                'output': run['stdout'],
+            })
+        results.append(result)
+
+    passed = sum(1 for r in results if r['passed'])
+    return {
+        'is_correct': bool(results) and passed == len(results),
+        'passed': passed,
+        'total': len(results),
+        'results': results,
+    }
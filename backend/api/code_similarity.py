@@ -0,0 +1,236 @@
+# backend/api/code_similarity.py
+import io
+import random
+import hashlib
+import tokenize
+from collections import defaultdict
+from django.db import transaction
+from .models import CodeSubmission, CodeSubmissionBand
+from .evaluation_cache import canonical_source
+from .live_game import get_redis
+
+# ====================================================================
+# --- SOLUCIONES CASI IGUALES (MinHash + LSH) ---
+# ====================================================================
+# Comparar cada entrega con todas las demás es O(n²). En cambio, cada
+# entrega guarda una firma MinHash de sus shingles de tokens (sobre el
+# código canónico: sin comentarios y con las variables renombradas), y
+# la firma se corta en bandas. Cada banda es una cubeta indexada en la BD:
+# los candidatos a casi-duplicado son los que comparten alguna cubeta, y
+# solo a esos se les estima la similitud con la firma completa.
+# La firma cuesta ~100-150 ms de CPU para una entrega larga: las entregas
+# en vivo se guardan sin ella y el worker de evaluaciones la calcula
+# (SIGNATURE_QUEUE_KEY solo lo despierta; pendiente = entrega sin cubetas).
+
+NUM_PERM = 64        # funciones de hash de la firma
+BANDS = 16           # BANDS * ROWS == NUM_PERM
+ROWS = NUM_PERM // BANDS
+SHINGLE_SIZE = 5     # tokens por shingle
+DEFAULT_THRESHOLD = 0.8
+SIGNATURE_QUEUE_KEY = "code_signature_queue"
+
+# Con 16 bandas de 4 filas, dos entregas con similitud s comparten alguna
+# cubeta con probabilidad 1 - (1 - s^4)^16: ~99.9% si s=0.8, ~1.6% si s=0.2.
+
+_PRIME = (1 << 61) - 1
+_rng = random.Random(20240601)  # Fija: las firmas guardadas deben seguir siendo comparables
+_PERMUTATIONS = [(_rng.randrange(1, _PRIME), _rng.randrange(0, _PRIME)) for _ in range(NUM_PERM)]
+
+_SKIPPED_TOKENS = {tokenize.COMMENT, tokenize.NL, tokenize.ENCODING, tokenize.ENDMARKER}
+
+
+def _hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode(), digest_size=8).digest(), 'big')
+
+
+def code_tokens(code):
+    """ Tokens del código canónico; si no se puede tokenizar, las palabras del texto. """
+    source = canonical_source(code)
+    try:
+        return [
+            tok.string or tokenize.tok_name[tok.type]
+            for tok in tokenize.generate_tokens(io.StringIO(source).readline)
+            if tok.type not in _SKIPPED_TOKENS
+        ]
+    except (tokenize.TokenError, SyntaxError):  # IndentationError es un SyntaxError
+        return source.split()
+
+
+def shingles(code):
+    tokens = code_tokens(code)
+    if len(tokens) <= SHINGLE_SIZE:
+        return {_hash64(' '.join(tokens))}
+    return {_hash64(' '.join(tokens[i:i + SHINGLE_SIZE])) for i in range(len(tokens) - SHINGLE_SIZE + 1)}
+
+
+def minhash(code):
+    """ Firma de NUM_PERM enteros: para cada permutación, el menor hash de los shingles. """
+    hashes = shingles(code)
+    return [min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMUTATIONS]
+
+
+def similarity(sig_a, sig_b):
+    """ Estimación de la similitud de Jaccard: fracción de posiciones iguales. """
+    return sum(1 for x, y in zip(sig_a, sig_b) if x == y) / NUM_PERM
+
+
+def _scope(challenge_id=None, live_challenge_id=None):
+    return f"practice:{challenge_id}" if challenge_id else f"live:{live_challenge_id}"
+
+
+def band_buckets(signature, scope):
+    """ Una cubeta por banda; el desafío entra en el hash para no mezclar desafíos. """
+    buckets = []
+    for band in range(BANDS):
+        values = ','.join(str(v) for v in signature[band * ROWS:(band + 1) * ROWS])
+        # BigIntegerField es con signo: 63 bits
+        buckets.append(_hash64(f"{scope}|{band}|{values}") >> 1)
+    return buckets
+
+
+def record_submission(user_id, code, is_correct, challenge_id=None, live_challenge_id=None, defer_signature=False):
+    """
+    Guarda la entrega con su firma y sus cubetas LSH. Con 'defer_signature'
+    la guarda sin firma y avisa al worker para que la calcule (sign_pending).
+    """
+    if defer_signature:
+        submission = CodeSubmission.objects.create(
+            user_id=user_id, challenge_id=challenge_id, live_challenge_id=live_challenge_id,
+            code=code, is_correct=is_correct,
+        )
+        try:
+            get_redis().rpush(SIGNATURE_QUEUE_KEY, submission.id)
+        except Exception as e:
+            # Queda pendiente igual: el worker la encuentra en su próxima pasada
+            print(f"ADVERTENCIA: No se pudo avisar al worker de firmas. {e}")
+        return submission
+
+    signature = minhash(code)
+    with transaction.atomic():
+        submission = CodeSubmission.objects.create(
+            user_id=user_id, challenge_id=challenge_id, live_challenge_id=live_challenge_id,
+            code=code, is_correct=is_correct, minhash=signature,
+        )
+        _save_bands(submission)
+    return submission
+
+
+def _save_bands(submission):
+    CodeSubmissionBand.objects.bulk_create([
+        CodeSubmissionBand(submission=submission, bucket=bucket)
+        for bucket in band_buckets(submission.minhash, _scope(submission.challenge_id, submission.live_challenge_id))
+    ])
+
+
+def sign_pending(limit=100):
+    """
+    Calcula la firma de las entregas guardadas sin ella (las más viejas
+    primero) y devuelve cuántas firmó. Varios workers a la vez no firman
+    dos veces la misma: la fila se bloquea y se vuelve a mirar.
+    """
+    pending = list(
+        CodeSubmission.objects.filter(bands__isnull=True)
+        .order_by('id').values_list('id', 'code')[:limit]
+    )
+    signed = 0
+    for submission_id, code in pending:
+        signature = minhash(code)  # Fuera de la transacción: es lo que tarda
+        with transaction.atomic():
+            submission = CodeSubmission.objects.select_for_update().filter(id=submission_id).first()
+            if not submission or submission.bands.exists():
+                continue
+            submission.minhash = signature
+            submission.save(update_fields=['minhash'])
+            _save_bands(submission)
+            signed += 1
+    return signed
+
+
+def find_similar(submission, threshold=DEFAULT_THRESHOLD):
+    """
+    Entregas del mismo desafío casi iguales a 'submission' (de otros alumnos):
+    [(entrega, similitud)] de mayor a menor. Solo lee las que comparten cubeta.
+    Sin firma todavía (el worker no la calculó) no hay con qué comparar.
+    """
+    if not submission.minhash:
+        return []
+    buckets = band_buckets(submission.minhash, _scope(submission.challenge_id, submission.live_challenge_id))
+    candidate_ids = (
+        CodeSubmissionBand.objects
+        .filter(bucket__in=buckets)
+        .exclude(submission__user_id=submission.user_id)
+        .values_list('submission_id', flat=True)
+        .distinct()
+    )
+    candidates = CodeSubmission.objects.filter(id__in=candidate_ids).select_related('user')
+    matches = [(other, similarity(submission.minhash, other.minhash)) for other in candidates]
+    return sorted([m for m in matches if m[1] >= threshold], key=lambda m: m[1], reverse=True)
+
+
+def cluster_report(challenge_id=None, live_challenge_id=None, threshold=DEFAULT_THRESHOLD):
+    """
+    Grupos de entregas casi iguales de un desafío, en una pasada por las
+    cubetas (union-find). Solo los grupos con al menos dos alumnos distintos.
+    """
+    submissions = {
+        s['id']: s for s in CodeSubmission.objects
+        .filter(challenge_id=challenge_id, live_challenge_id=live_challenge_id)
+        .values('id', 'user_id', 'user__username', 'is_correct', 'created_at', 'minhash')
+    }
+    rows = (
+        CodeSubmissionBand.objects
+        .filter(submission_id__in=submissions.keys())
+        .order_by('bucket')
+        .values_list('bucket', 'submission_id')
+    )
+
+    parent = {sid: sid for sid in submissions}
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    # Dentro de una cubeta se compara cada entrega con la primera: lineal,
+    # aunque medio curso haya enviado la misma solución.
+    best = defaultdict(float)
+    current_bucket, first = None, None
+    for bucket, sid in rows.iterator():
+        if bucket != current_bucket:
+            current_bucket, first = bucket, sid
+            continue
+        score = similarity(submissions[first]['minhash'], submissions[sid]['minhash'])
+        if score >= threshold:
+            root_a, root_b = find(first), find(sid)
+            if root_a != root_b:
+                parent[root_b] = root_a
+            best[first] = max(best[first], score)
+            best[sid] = max(best[sid], score)
+
+    groups = defaultdict(list)
+    for sid in submissions:
+        groups[find(sid)].append(submissions[sid])
+
+    clusters = []
+    for members in groups.values():
+        if len({m['user_id'] for m in members}) < 2:
+            continue
+        members.sort(key=lambda m: m['created_at'])
+        clusters.append({
+            'size': len(members),
+            'users': len({m['user_id'] for m in members}),
+            'max_similarity': round(max(best[m['id']] for m in members), 3),
+            'submissions': [
+                {
+                    'id': m['id'],
+                    'user_id': m['user_id'],
+                    'username': m['user__username'],
+                    'is_correct': m['is_correct'],
+                    'created_at': m['created_at'],
+                }
+                for m in members
+            ],
+        })
+    clusters.sort(key=lambda c: c['size'], reverse=True)
+    return {'total_submissions': len(submissions), 'threshold': threshold, 'clusters': clusters}
@@ -1,25 +1,27 @@
 import json
-from channels.generic.websocket import AsyncWebsocketConsumer
 import asyncio
+from channels.generic.websocket import AsyncWebsocketConsumer
+import time
 from channels.db import database_sync_to_async
-from .models import Lesson, Message, Conversation, User, Enrollment, Quiz, Question, Choice, LiveCodeChallenge
-from .serializers import MessageSerializer, UserSerializer, LiveCodeChallengeSerializer
-from django.db.models import F
+from .models import Lesson, Message, Conversation, User, Enrollment, Quiz, Question, Choice, LiveCodeChallenge, ChallengeTestCase
+from rest_framework import serializers
+from .serializers import UserSerializer, LiveCodeChallengeSerializer
+from .message_ids import new_message_id, message_id_datetime
+from .chat_writer import message_writer
+from .live_game import LiveGameStore
+from . import game_runner
+from .evaluation_batcher import evaluate_live_submission
+from .code_similarity import record_submission
+from django.conf import settings
 from django.core.cache import cache
 from asgiref.sync import async_to_sync
-import google.generativeai as genai
-from django.conf import settings
-
-# Configuración de Gemini
-try:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-except Exception as e:
-    print(f"ADVERTENCIA (Consumer): No se pudo configurar la API de Gemini. {e}")
 
 class ChatConsumer(AsyncWebsocketConsumer):
     """
     Maneja: Chat de Lección, Presencia, XP, Quiz en Vivo y Desafíos de Código.
     """
+    # Como tema de UserConsumer las notificaciones van por su propio tema
+    join_notifications = True
     
     async def connect(self):
         print("\n[CONSUMER LOG] connect() INICIADO.")
@@ -47,24 +49,44 @@ class ChatConsumer(AsyncWebsocketConsumer):
         self.conversation = await self.get_or_create_conversation()
         await self.add_user_to_conversation()
         self.room_group_name = f'chat_lesson_{self.lesson_id}'
-        self.game_cache_key = f"live_game_{self.room_group_name}" 
+        self.game = LiveGameStore(self.room_group_name)
+        self.ranking_version = None
+        self.game_over = False # Tras 'quiz_final_results' no se reenvían rankings parciales
 
         if self.user.role != 'PROFESSOR':
             self.connected_users_key = f"connected_users_{self.room_group_name}"
             cache.sadd(self.connected_users_key, self.user.id)
+        else:
+            # Grupo privado del profesor (histograma de respuestas en vivo)
+            await self.channel_layer.group_add(f"{self.room_group_name}_professor", self.channel_name)
 
         await self.channel_layer.group_add(
             self.room_group_name,
             self.channel_name
         )
+        # Grupo personal: resultados de evaluaciones encoladas y avisos de XP
+        if self.join_notifications:
+            await self.channel_layer.group_add(f"user_{self.user.id}_notifications", self.channel_name)
         
         print(f"[CONSUMER LOG] ACEPTADO: {self.user.username}.")
         await self.accept()
 
+        # Si hay un juego en curso, una sola foto del estado para retomarlo
+        # (sin esperar al próximo broadcast ni pedir nada por HTTP)
+        snapshot = self.game.snapshot(None if self.user.role == 'PROFESSOR' else self.user.id)
+        if snapshot:
+            snapshot['now'] = time.time()
+            snapshot['timer'] = {
+                'question': game_runner.QUESTION_TIME, 'code': game_runner.CODE_TIME
+            }.get(snapshot['phase'])
+            await self.send(text_data=json.dumps({'type': 'quiz_snapshot', 'data': snapshot}))
+
     async def disconnect(self, close_code):
         if hasattr(self, 'room_group_name') and hasattr(self, 'user') and self.user.is_authenticated:
             if self.user.role != 'PROFESSOR' and hasattr(self, 'connected_users_key'):
                 cache.srem(self.connected_users_key, self.user.id)
+            if self.user.role == 'PROFESSOR':
+                await self.channel_layer.group_discard(f"{self.room_group_name}_professor", self.channel_name)
             await self.channel_layer.group_send(
                 self.room_group_name,
                 {'type': 'user_left', 'user_id': self.user.id}
@@ -73,6 +95,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 self.room_group_name,
                 self.channel_name
             )
+            if self.join_notifications:
+                await self.channel_layer.group_discard(f"user_{self.user.id}_notifications", self.channel_name)
 
     async def receive(self, text_data):
         """ Router Principal de Mensajes """
@@ -84,28 +108,29 @@ class ChatConsumer(AsyncWebsocketConsumer):
             content = data.get('content')
             language = data.get('language')
             if content:
-                message = await self.create_message(message_type, content, language)
-                message_data = await self.serialize_message(message)
+                # Primero se transmite (id y hora generados aquí) y el INSERT va en
+                # el próximo lote de chat_writer: ni la BD ni DRF en el camino
+                message_id = new_message_id()
+                message = Message(
+                    id=message_id, timestamp=message_id_datetime(message_id),
+                    conversation_id=self.conversation.id, sender=self.user,
+                    message_type=message_type, content=content, language=language,
+                )
+                message_writer.add(message)
                 await self.channel_layer.group_send(
                     self.room_group_name,
-                    {'type': 'chat_message', 'message': message_data}
+                    {'type': 'chat_message', 'message': self.message_payload(message)}
                 )
             
         # 2. Dar XP
         elif message_type == 'GIVE_XP':
             if self.user.role == 'PROFESSOR':
-                target_user = await self.award_points(data.get('target_user_id'), data.get('points', 10))
-                if target_user:
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            'type': 'xp_notification',
-                            'user_id': target_user.id,
-                            'username': target_user.username,
-                            'points': data.get('points', 10),
-                            'total_xp': target_user.experience_points
-                        }
-                    )
+                # Uno ('target_user_id') o varios a la vez ('awards': [{user_id, points}])
+                awards = data.get('awards') or [{'user_id': data.get('target_user_id'), 'points': data.get('points', 10)}]
+                awarded = await game_runner.award_points(
+                    [(a['user_id'], a.get('points', 10)) for a in awards if a.get('user_id')]
+                )
+                await game_runner.notify_xp(self.channel_layer, self.room_group_name, awarded)
 
         # 3. Quiz (Inicio y Respuesta)
         elif message_type == 'START_QUIZ':
@@ -145,20 +170,57 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def xp_notification(self, event):
         await self.send(text_data=json.dumps(event))
 
+    async def challenge_review_chunk(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def challenge_evaluation_result(self, event):
+        await self.send(text_data=json.dumps(event))
+
+    async def xp_update_message(self, event):
+        await self.send(text_data=json.dumps(event))
+
     async def user_joined(self, event):
         await self.send(text_data=json.dumps(event))
 
     async def user_left(self, event):
         await self.send(text_data=json.dumps(event))
 
+    async def quiz_pack(self, event):
+        self.game_over = False
+        await self.send(text_data=json.dumps(event))
+
     async def quiz_question(self, event):
         await self.send(text_data=json.dumps(event))
 
     async def quiz_ranking_update(self, event):
-        await self.send(text_data=json.dumps(event))
+        # Un ranking que salió justo antes del cierre puede llegar después de los
+        # resultados finales (vienen de procesos distintos): ya no sirve
+        if self.game_over: return
+        data = event['data']
+        # Si este socket no tiene la versión base del delta (se conectó tarde
+        # o se perdió un mensaje), le mandamos el top completo.
+        if data.get('mode') == 'delta' and data.get('base_version') != self.ranking_version:
+            data = {
+                'mode': 'full', 'version': data['version'],
+                'ranking': event['top'], 'is_final': False,
+            }
+        self.ranking_version = data.get('version')
+        await self.send(text_data=json.dumps(self.with_my_rank(event, data)))
 
     async def quiz_final_results(self, event):
-        await self.send(text_data=json.dumps(event))
+        self.ranking_version = None # El próximo juego empieza con versiones nuevas
+        self.game_over = True
+        await self.send(text_data=json.dumps(self.with_my_rank(event, event['data'])))
+
+    def with_my_rank(self, event, data):
+        """
+        El runner manda el puesto de cada jugador ('ranks'); al cliente le
+        llega solo el suyo. Sin Redis: esto corre en cada socket de la sala.
+        """
+        message = {'type': event['type'], 'data': data}
+        if self.user.role != 'PROFESSOR':
+            message['data'] = {**data, 'me': event['ranks'].get(str(self.user.id))}
+        return message
     
     async def quiz_stats_update(self, event):
         await self.send(text_data=json.dumps(event))
@@ -166,7 +228,11 @@ class ChatConsumer(AsyncWebsocketConsumer):
     async def quiz_get_ready(self, event):
         await self.send(text_data=json.dumps(event))
 
+    async def quiz_answer_histogram(self, event):
+        await self.send(text_data=json.dumps(event))
+
     async def code_challenge_question(self, event):
+        self.game_over = False
         await self.send(text_data=json.dumps(event))
 
     # ====================================================================
@@ -174,149 +240,42 @@ class ChatConsumer(AsyncWebsocketConsumer):
     # ====================================================================
 
     async def start_game(self, quiz_id):
-        questions = await self.get_all_quiz_questions(quiz_id)
-        if not questions: return
-            
-        game_state = {
-            "quiz_id": quiz_id,
-            "current_question_index": 0,
-            "questions": questions,
-            "ranking": {},
-            "current_question_answers": {}
-        }
-        cache.set(self.game_cache_key, game_state, timeout=3600)
-        await self.send_next_question()
+        quiz_pack = await self.get_all_quiz_questions(quiz_id)
+        if not quiz_pack: return
+        questions, answer_key = quiz_pack
 
-    async def send_next_question(self):
-        game_state = cache.get(self.game_cache_key)
-        if not game_state: return
+        # El runner (python manage.py run_live_games) se encarga de los tiempos:
+        # revela la pregunta, las estadísticas, el ranking y el cierre.
+        self.game.start("quiz", quiz_id, questions, answer_key)
+        await game_runner.send_quiz_pack(self.channel_layer, self.game, questions)
+        game_runner.schedule(self.room_group_name, game_runner.GET_READY_TIME)
 
-        index = game_state["current_question_index"]
-        if index < len(game_state["questions"]):
-            question = game_state["questions"][index]
-            game_state["current_question_answers"] = {}
-            cache.set(self.game_cache_key, game_state, timeout=3600)
+    async def record_answer(self, question_id, choice_id, user):
+        meta = self.game.get_meta()
+        if not meta or choice_id is None: return
 
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {
-                    'type': 'quiz_question',
-                    'data': {
-                        'question': question,
-                        'question_number': index + 1,
-                        'total_questions': len(game_state["questions"]),
-                        'timer': 15
-                    }
-                }
-            )
-            await asyncio.sleep(15) 
-            await self.end_question_round() 
-        else:
-            await self.end_game()
+        index = meta["current_question_index"]
 
-    async def record_answer(self, question_id, choice_id, user):
-        game_state = cache.get(self.game_cache_key)
-        if not game_state: return
-        
-        if str(user.id) in game_state["current_question_answers"]: return # Evitar doble respuesta
+        # Clave de respuestas precompilada en start_game: cero consultas a la BD
+        is_correct = self.game.is_correct(index, choice_id)
+
+        # Registro atómico en Redis (SADD + ZINCRBY + contador de la opción en un script Lua).
+        # Si el usuario ya respondió (o lo registró otro proceso), o la respuesta
+        # llegó fuera de tiempo o para otra pregunta, no hacemos nada.
+        added, _, _ = self.game.record_answer(
+            index, user.id, user.username, is_correct, choice_id=choice_id,
+            phase='question', question_id=question_id,
+        )
+        if not added: return
 
-        index = game_state["current_question_index"]
-        question = game_state["questions"][index]
-        
-        is_correct = await self.check_answer_correct(choice_id)
-        
         # Feedback privado
         await self.send(text_data=json.dumps({
             'type': 'answer_result',
             'data': {'is_correct': is_correct, 'choice_id': choice_id}
         }))
-        
-        points = 0
-        if is_correct:
-            points = max(100, 1000 - (len(game_state["current_question_answers"]) * 50))
-            
-        user_id_str = str(user.id) # Usar string para claves JSON consistentes
-        if user_id_str not in game_state["ranking"]:
-            game_state["ranking"][user_id_str] = { "username": user.username, "score": 0 }
-        
-        if is_correct:
-            game_state["ranking"][user_id_str]["score"] += points
-
-        game_state["current_question_answers"][user_id_str] = True
-        cache.set(self.game_cache_key, game_state, timeout=3600)
-
-    async def end_question_round(self):
-        game_state = cache.get(self.game_cache_key)
-        if not game_state: return
-        
-        # Stats
-        stats = {'total': len(game_state["current_question_answers"])}
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {'type': 'quiz_stats_update', 'data': {'stats': stats}}
-        )
-        await asyncio.sleep(5)
-
-        # Ranking
-        sorted_ranking = sorted(game_state["ranking"].values(), key=lambda x: x['score'], reverse=True)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {'type': 'quiz_ranking_update', 'data': {'ranking': sorted_ranking, 'is_final': False}}
-        )
-        await asyncio.sleep(3)
-
-        # Next
-        game_state["current_question_index"] += 1
-        cache.set(self.game_cache_key, game_state, timeout=3600)
-        
-        if game_state["current_question_index"] < len(game_state["questions"]):
-            await self.channel_layer.group_send(self.room_group_name, {'type': 'quiz_get_ready'})
-            await asyncio.sleep(3)
-            await self.send_next_question()
-        else:
-            await self.end_game()
 
     async def end_game(self):
-        game_state = cache.get(self.game_cache_key)
-        if not game_state: return
-        
-        sorted_ranking = sorted(
-            game_state["ranking"].values(), 
-            key=lambda x: x['score'], 
-            reverse=True
-        )
-
-        # --- CÁLCULO DE ESTADÍSTICAS PARA EL PROFESOR ---
-        # En el desafío de código, quien está en el ranking es porque acertó.
-        total_correct = len(sorted_ranking)
-        # (Para saber los incorrectos necesitaríamos saber el total de conectados, 
-        #  por ahora enviaremos solo los correctos y el total de participantes activos)
-        
-        stats = {
-            "correct": total_correct,
-            "top_3": sorted_ranking[:3] # Enviamos el podio
-        }
-        # -----------------------------------------------
-        
-        # Dar XP a los ganadores (Código existente...)
-        for i, player in enumerate(sorted_ranking[:3]):
-            player_id = next((uid for uid, data in game_state["ranking"].items() if data["username"] == player["username"]), None)
-            if player_id:
-                await self.award_points(int(player_id), [15, 10, 5][i])
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'quiz_final_results',
-                'data': {
-                    'ranking': sorted_ranking,
-                    'stats': stats, # <--- ¡AÑADIMOS ESTO!
-                    'is_final': True
-                }
-            }
-        )
-        
-        cache.delete(self.game_cache_key)
+        await game_runner.end_game(self.channel_layer, self.game)
 
     # ====================================================================
     # --- LÓGICA DEL CODE CHALLENGE (Pilar 3) ---
@@ -326,17 +285,8 @@ class ChatConsumer(AsyncWebsocketConsumer):
         challenge_data = await self.get_live_code_challenge(challenge_id)
         if not challenge_data: return
 
-        game_state = {
-            "game_type": "code",
-            "quiz_id": f"code_{challenge_id}",
-            "current_question_index": 0,
-            "questions": [challenge_data],
-            "ranking": {},
-            "current_question_answers": {}
-        }
-        
-        self.game_cache_key = f"live_game_{self.room_group_name}" 
-        cache.set(self.game_cache_key, game_state, timeout=3600)
+        self.game.start("code", f"code_{challenge_id}", [challenge_data])
+        self.game.set_phase('code', time.time() + game_runner.CODE_TIME)
 
         # Enviar el desafío a los alumnos
         await self.channel_layer.group_send(
@@ -345,91 +295,70 @@ class ChatConsumer(AsyncWebsocketConsumer):
                 'type': 'code_challenge_question',
                 'data': {
                     'challenge': challenge_data, 
-                    'timer': 300, 
+                    'timer': game_runner.CODE_TIME, 
                     'language': 'python'
                 }
             }
         )
         
-        # --- CORRECCIÓN CRÍTICA: USAR create_task ---
-        # Esto lanza el temporizador en PARALELO y libera al servidor para escuchar el botón STOP
-        asyncio.create_task(self.run_game_timer(300, challenge_id))
-
-
-    async def run_game_timer(self, duration, challenge_id):
-        """
-        Cuenta el tiempo en segundo plano sin bloquear el WebSocket.
-        """
-        print(f"[TIMER] Iniciando cuenta atrás de {duration}s para desafío {challenge_id}")
-        
-        # Esperamos el tiempo definido (5 minutos)
-        await asyncio.sleep(duration)
-        
-        # Al despertar, verificamos si el juego SIGUE siendo el mismo
-        # (Por si el profesor ya lo detuvo manualmente antes)
-        final_state = cache.get(self.game_cache_key)
-        current_quiz_id = f"code_{challenge_id}"
-        
-        if final_state and final_state.get("quiz_id") == current_quiz_id:
-            print(f"[TIMER] Tiempo agotado. Cerrando juego automáticamente.")
-            await self.end_game()
-        else:
-            print("[TIMER] El temporizador expiró, pero el juego ya había terminado o cambiado.")
+        # El runner cierra el juego cuando vence el tiempo (aunque el profesor se desconecte)
+        game_runner.schedule(self.room_group_name, game_runner.CODE_TIME)
 
     
     async def handle_code_submission(self, challenge_id, user_code, user):
         print(f"[CONSUMER LOG] Evaluando entrega de {user.username}")
-        
-        game_state = cache.get(self.game_cache_key)
+        received_at = time.time()  # La fecha límite se compara con la llegada, no con el fin de la evaluación
+
+        meta = self.game.get_meta()
         # 1. Validar que el juego existe y es de código
-        if not game_state or game_state.get("game_type") != "code":
+        if not meta or meta.get("game_type") != "code":
             return 
 
-        user_id_str = str(user.id)
-        
         # 2. Validar "UNA SOLA OPORTUNIDAD"
         # Si el usuario ya está en la lista de respuestas, no le dejamos enviar más.
-        if user_id_str in game_state["current_question_answers"]: 
+        if self.game.has_answered(0, user.id): 
             print(f"[CONSUMER LOG] {user.username} ya gastó su oportunidad.")
             # Opcional: Avisarle que ya no puede intentar
             return
 
-        # 3. Evaluación IA
-        try:
-            ia_result = await self.run_ia_evaluation(challenge_id, user_code)
-            is_correct = ia_result.get('is_correct', False)
-        except Exception as e:
-            print(f"[ERROR IA] {e}")
-            is_correct = False 
+        challenge = await self.get_challenge_reference(challenge_id)
+        if not challenge: return
+
+        # 3. Pre-chequeos, casos de prueba en el sandbox y, si no hay casos,
+        # la IA (caché + micro-lotes). Ver evaluation_batcher.evaluate_live_submission
+        test_cases = await self.get_test_cases(challenge_id)
+        is_correct, test_result, rejection = await evaluate_live_submission(challenge, user_code, test_cases)
+
+        # 4. MARCAR COMO "YA RESPONDIÓ" (Sea correcto o incorrecto) de forma atómica.
+        # Solo los correctos entran al ranking; los puntos se calculan en Redis.
+        # La evaluación tarda: el script vuelve a comprobar que el juego sigue
+        # abierto (no terminó ni lo cerró el profesor) antes de escribir nada.
+        added, attempts_count, _ = self.game.record_answer(
+            0, user.id, user.username, is_correct, offset=0, always_register=False,
+            phase='code', now=received_at,
+        )
+        if not added: return
 
-        # 4. Enviar Feedback al Alumno ("Correcto" o "Incorrecto")
+        # 5. Enviar Feedback al Alumno ("Correcto" o "Incorrecto")
         await self.send(text_data=json.dumps({
             'type': 'answer_result',
-            'data': {'is_correct': is_correct, 'choice_id': None}
+            'data': {
+                'is_correct': is_correct,
+                'choice_id': None,
+                'passed': test_result['passed'] if test_result else None,
+                'total': test_result['total'] if test_result else None,
+                'feedback': rejection['feedback'] if rejection else None,
+            }
         }))
 
-        # 5. MARCAR COMO "YA RESPONDIÓ" (Sea correcto o incorrecto)
-        # Guardamos True/False para saber cómo le fue, pero lo importante es que la clave user_id ya existe.
-        game_state["current_question_answers"][user_id_str] = is_correct
-        
-        # Si es correcto, calculamos puntos y ranking
+        # Si es correcto, actualizamos ranking visual para todos
+        # (si el juego cerró entretanto, broadcast_ranking no envía nada)
         if is_correct:
-            points = max(100, 1000 - (len(game_state["current_question_answers"]) * 50))
-            
-            if user_id_str not in game_state["ranking"]:
-                game_state["ranking"][user_id_str] = { "username": user.username, "score": 0 }
-            
-            game_state["ranking"][user_id_str]["score"] += points
-            
-            # Actualizamos ranking visual para todos
-            sorted_ranking = sorted(game_state["ranking"].values(), key=lambda x: x['score'], reverse=True)
-            await self.channel_layer.group_send(
-                self.room_group_name,
-                {'type': 'quiz_ranking_update', 'data': {'ranking': sorted_ranking, 'is_final': False}}
-            )
+            await game_runner.broadcast_ranking(self.channel_layer, self.game)
 
-        # Guardamos el estado actualizado en Redis
-        cache.set(self.game_cache_key, game_state, timeout=3600)
+        # Se guarda con su firma MinHash (detección de soluciones casi iguales)
+        if not rejection:
+            await self.save_code_submission(user.id, challenge_id, user_code, is_correct)
 
         # ==========================================================
         # 6. LÓGICA DE CIERRE AUTOMÁTICO (TODOS TERMINARON)
@@ -439,99 +368,40 @@ class ChatConsumer(AsyncWebsocketConsumer):
         connected_key = f"connected_users_{self.room_group_name}"
         connected_count = cache.scard(connected_key) or 1
         
-        # B. Contamos cuántos han "gastado su turno" (correctos + incorrectos)
-        attempts_count = len(game_state["current_question_answers"])
-        
+        # B. 'attempts_count' viene del script: cuántos han "gastado su turno"
         print(f"[AUTO-END CHECK] Intentos: {attempts_count} / Conectados: {connected_count}")
 
         # C. Si Intentos >= Conectados -> CERRAMOS
         if attempts_count >= connected_count:
              print("[AUTO-END] Todos los alumnos han participado. Cerrando juego...")
-             # Esperamos 3 segundos para que el último alumno vea si acertó o falló
-             await asyncio.sleep(3) 
-             await self.end_game()
+             # Adelantamos el cierre: 3 segundos para que el último alumno vea si acertó o falló
+             game_runner.schedule(self.room_group_name, game_runner.AUTO_END_DELAY)
 
 
     @database_sync_to_async
-    def run_ia_evaluation(self, challenge_id, user_code):
-        try:
-            print(f"[IA LOG] Evaluando desafío {challenge_id}...")
-            challenge = LiveCodeChallenge.objects.get(id=challenge_id)
-            
-            prompt = f"""
-            Evalúa este código Python.
-            PROBLEMA: {challenge.description}
-            CÓDIGO ALUMNO:
-            {user_code}
-            SOLUCIÓN REFERENCIA:
-            {challenge.solution}
-            
-            IMPORTANTE: Responde SOLO un JSON válido. Estructura: {{ "is_correct": boolean }}
-            Si el código del alumno funciona y resuelve el problema, es true. Si tiene errores de sintaxis o lógica, false.
-            """
-            
-            # USAMOS EL MODELO CORRECTO (1.5-flash)
-            model = genai.GenerativeModel('gemini-1.5-flash')
-            response = model.generate_content(prompt)
-            
-            # Limpieza agresiva del JSON (Gemini a veces mete comillas extra)
-            clean_text = response.text.strip()
-            if clean_text.startswith("```json"):
-                clean_text = clean_text.replace("```json", "").replace("```", "")
-            elif clean_text.startswith("```"):
-                clean_text = clean_text.replace("```", "")
-            
-            print(f"[IA LOG] Respuesta cruda Gemini: {clean_text}")
-            return json.loads(clean_text)
-
-        except Exception as e:
-            print(f"!!! ERROR CRÍTICO EN IA: {e}")
-            # Devuelve False en lugar de romper, para que el flujo continúe
-            return {"is_correct": False}
-
-
+    def get_test_cases(self, challenge_id):
+        return list(ChallengeTestCase.objects.filter(live_challenge_id=challenge_id))
 
     @database_sync_to_async
-    def run_ia_evaluation(self, challenge_id, user_code):
+    def save_code_submission(self, user_id, challenge_id, user_code, is_correct):
         try:
-            challenge = LiveCodeChallenge.objects.get(id=challenge_id)
-            prompt = f"""
-            Eres un tutor de programación experto. Evalúa este código.
-            PROBLEMA: {challenge.description}
-            SOLUCIÓN DEL ALUMNO: ```python {user_code} ```
-            SOLUCIÓN ÓPTIMA: ```python {challenge.solution} ```
-            Responde SOLO con un JSON: {{ "is_correct": [true o false] }}
-            """
-            model = genai.GenerativeModel('gemini-2.5-flash')
-            response = model.generate_content(prompt)
-            clean_text = response.text.strip().replace("```json", "").replace("```", "")
-            return json.loads(clean_text)
+            # La firma MinHash la calcula el worker de evaluaciones, no este socket
+            record_submission(user_id, user_code, is_correct, live_challenge_id=challenge_id, defer_signature=True)
         except Exception as e:
-            print(f"ERROR IA: {e}")
-            return {"is_correct": False}
+            print(f"ADVERTENCIA: No se pudo guardar la entrega. {e}")
+
+    @database_sync_to_async
+    def get_challenge_reference(self, challenge_id):
+        return LiveCodeChallenge.objects.filter(id=challenge_id).only('description', 'solution', 'starter_code').first()
 
     async def update_code_ranking(self, user, challenge_id):
-        game_state = cache.get(self.game_cache_key)
-        if not game_state: return
-        
-        user_id_str = str(user.id)
-        if user_id_str in game_state["current_question_answers"]: return
+        meta = self.game.get_meta()
+        if not meta: return
 
-        points = max(100, 1000 - (len(game_state["current_question_answers"]) * 50))
-        
-        if user_id_str not in game_state["ranking"]:
-            game_state["ranking"][user_id_str] = { "username": user.username, "score": 0 }
-        
-        game_state["ranking"][user_id_str]["score"] += points
-        game_state["current_question_answers"][user_id_str] = True
-        
-        cache.set(self.game_cache_key, game_state, timeout=3600)
-        
-        sorted_ranking = sorted(game_state["ranking"].values(), key=lambda x: x['score'], reverse=True)
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {'type': 'quiz_ranking_update', 'data': {'ranking': sorted_ranking, 'is_final': False}}
-        )
+        added, _, _ = self.game.record_answer(0, user.id, user.username, True, phase='code')
+        if not added: return
+
+        await game_runner.broadcast_ranking(self.channel_layer, self.game)
 
     # ====================================================================
     # --- HELPERS DB ---
@@ -561,42 +431,43 @@ class ChatConsumer(AsyncWebsocketConsumer):
     def add_user_to_conversation(self):
         self.conversation.participants.add(self.user)
 
-    @database_sync_to_async
-    def create_message(self, msg_type, content, lang):
-        return Message.objects.create(conversation=self.conversation, sender=self.user, message_type=msg_type, content=content, language=lang)
-
-    @database_sync_to_async
-    def serialize_message(self, message):
-        return MessageSerializer(message, context={'user_serializer': UserSerializer}).data
+    def message_payload(self, message):
+        """ Lo mismo que MessageSerializer para un mensaje de texto/código, sin tocar la BD. """
+        if not hasattr(self, 'sender_data'):
+            self.sender_data = UserSerializer(self.user).data
+        return {
+            'id': message.id,
+            'conversation': message.conversation_id,
+            'sender': self.sender_data,
+            'message_type': message.message_type,
+            'content': message.content,
+            'language': message.language,
+            'file_upload_url': None,
+            'file_name': None,
+            'file_size': None,
+            'timestamp': serializers.DateTimeField().to_representation(message.timestamp),
+        }
         
-    @database_sync_to_async
-    def award_points(self, user_id, points):
-        try:
-            u = User.objects.get(id=user_id)
-            u.experience_points = F('experience_points') + points
-            u.save(update_fields=['experience_points'])
-            u.refresh_from_db()
-            return u
-        except User.DoesNotExist: return None
-
     @database_sync_to_async
     def get_all_quiz_questions(self, quiz_id):
+        """
+        Devuelve (preguntas, clave_de_respuestas). Las preguntas van sin
+        'is_correct'; la clave tiene los ids correctos de cada pregunta.
+        """
         try:
             quiz = Quiz.objects.get(id=quiz_id, quiz_type='LIVE')
             q_data = []
+            answer_key = []
             for q in quiz.questions.order_by('order').prefetch_related('choices'):
+                choices = list(q.choices.all())
                 q_data.append({
                     'id': q.id, 'text': q.text,
-                    'choices': list(q.choices.all().values('id', 'text'))
+                    'choices': [{'id': c.id, 'text': c.text} for c in choices]
                 })
-            return q_data
+                answer_key.append([c.id for c in choices if c.is_correct])
+            return q_data, answer_key
         except: return None
 
-    @database_sync_to_async
-    def check_answer_correct(self, choice_id):
-        try: return Choice.objects.get(id=int(choice_id)).is_correct
-        except: return False
-
     @database_sync_to_async
     def get_live_code_challenge(self, challenge_id):
         try:
@@ -655,4 +526,201 @@ class InboxConsumer(AsyncWebsocketConsumer):
     def check_participation(self):
         try:
             return Conversation.objects.get(id=self.conversation_id).participants.filter(id=self.user.id).exists()
-        except Conversation.DoesNotExist: return False
\ No newline at end of file
+        except Conversation.DoesNotExist: return False
+
+
+# ====================================================================
+# --- UN SOLO WEBSOCKET POR USUARIO (temas multiplexados) ---
+# ====================================================================
+# En vez de un socket por sala de lección y otro por conversación, el
+# frontend abre /ws/user/ una vez (un handshake, un decode del JWT) y se
+# suscribe a temas:
+#   'lesson:<id>'        -> la sala de la lección (ChatConsumer)
+#   'conversation:<id>'  -> un chat del inbox (InboxConsumer)
+#   'notifications'      -> XP y evaluaciones del usuario (user_<id>_notifications)
+# Cada tema de sala corre el consumer de siempre como aplicación ASGI
+# anidada, con su propio canal: los group_send no cambian y cada evento
+# sabe a qué tema pertenece. Esos canales son locales al proceso, así que
+# channels_redis los atiende a todos con una sola lectura de Redis.
+#
+# Cliente -> servidor:
+#   {"action": "subscribe" | "unsubscribe", "topic": "lesson:12"}
+#   {"action": "send", "topic": "lesson:12", "data": {...lo de siempre...}}
+# Servidor -> cliente:
+#   {"topic": "lesson:12", "event": {...lo de siempre...}}
+#   {"topic": "lesson:12", "status": "subscribed" | "unsubscribed" | "rejected" | "error", "detail": ...}
+# 'rejected' es cuando el consumer cierra al conectar (sin permiso, etc.).
+
+
+class LessonTopicConsumer(ChatConsumer):
+    """ La sala de la lección como tema de UserConsumer. """
+    join_notifications = False
+
+
+class TopicSession:
+    """ Un consumer existente corriendo dentro del socket del usuario. """
+
+    def __init__(self, owner, topic, app, scope):
+        self.owner = owner
+        self.topic = topic
+        self.accepted = False
+        self.stopped = False
+        self.queue = asyncio.Queue()
+        self.queue.put_nowait({'type': 'websocket.connect'})
+        self.task = asyncio.create_task(self.run(app, scope))
+
+    async def run(self, app, scope):
+        try:
+            await app(scope, self.queue.get, self.send)
+        except Exception as e:
+            print(f"[USER WS] ERROR en el tema {self.topic}: {e}")
+        finally:
+            await self.stop('error' if not self.stopped else None)
+
+    def receive(self, data):
+        self.queue.put_nowait({'type': 'websocket.receive', 'text': json.dumps(data)})
+
+    async def send(self, message):
+        # Lo que el consumer interno le manda a "su" socket
+        if self.stopped:
+            # Desuscrito: lo que llegue antes de que el consumer procese la
+            # desconexión (y deje sus grupos) ya no se reenvía
+            return
+        if message['type'] == 'websocket.accept':
+            self.accepted = True
+            await self.owner.send_status(self.topic, 'subscribed')
+        elif message['type'] == 'websocket.send' and message.get('text') is not None and not self.owner.closing:
+            # El texto ya es JSON: se envuelve sin volver a parsearlo
+            await self.owner.send(text_data=f'{{"topic": {json.dumps(self.topic)}, "event": {message["text"]}}}')
+        elif message['type'] == 'websocket.close':
+            await self.stop('unsubscribed' if self.accepted else 'rejected')
+
+    async def stop(self, status='unsubscribed'):
+        """ Desconecta el consumer interno (idempotente). """
+        if self.stopped:
+            return
+        self.stopped = True
+        # Lo que quedó en cola (p. ej. mensajes enviados antes de que el
+        # consumer rechazara la suscripción) ya no se procesa
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait({'type': 'websocket.disconnect', 'code': 1000})
+        if self.owner.topics.get(self.topic) is self:
+            del self.owner.topics[self.topic]
+        if status:
+            await self.owner.send_status(self.topic, status)
+
+
+class UserConsumer(AsyncWebsocketConsumer):
+    """
+    Socket único por usuario con suscripción a temas (ver arriba).
+    """
+    TOPIC_APPS = {
+        'lesson': (LessonTopicConsumer.as_asgi(), 'lesson_id'),
+        'conversation': (InboxConsumer.as_asgi(), 'conversation_id'),
+    }
+    NOTIFICATIONS = 'notifications'
+
+    async def connect(self):
+        self.user = self.scope['user']
+        self.topics = {}
+        self.notifications = False
+        self.closing = False
+        if not self.user.is_authenticated:
+            await self.close()
+            return
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if not hasattr(self, 'topics'):
+            return
+        self.closing = True
+        if self.notifications:
+            await self.channel_layer.group_discard(f"user_{self.user.id}_notifications", self.channel_name)
+        sessions = list(self.topics.values())
+        for session in sessions:
+            await session.stop(None)
+        if sessions:
+            await asyncio.wait([s.task for s in sessions], timeout=5)
+
+    async def receive(self, text_data):
+        try:
+            data = json.loads(text_data)
+        except json.JSONDecodeError:
+            return
+        action, topic = data.get('action'), data.get('topic')
+        if not isinstance(topic, str):
+            return await self.send_status(topic, 'error', 'Falta el tema.')
+
+        if action == 'subscribe':
+            await self.subscribe(topic)
+        elif action == 'unsubscribe':
+            await self.unsubscribe(topic)
+        elif action == 'send':
+            session = self.topics.get(topic)
+            if session:
+                session.receive(data.get('data') or {})
+            else:
+                await self.send_status(topic, 'error', 'No estás suscrito a este tema.')
+        else:
+            await self.send_status(topic, 'error', f"Acción desconocida: {action}")
+
+    async def subscribe(self, topic):
+        if topic == self.NOTIFICATIONS:
+            if not self.notifications:
+                self.notifications = True
+                await self.channel_layer.group_add(f"user_{self.user.id}_notifications", self.channel_name)
+            return await self.send_status(topic, 'subscribed')
+
+        if topic in self.topics:
+            # Ya suscrito (o esperando a que el consumer acepte)
+            if self.topics[topic].accepted:
+                await self.send_status(topic, 'subscribed')
+            return
+
+        kind, _, key = topic.partition(':')
+        if kind not in self.TOPIC_APPS or not key.isdigit():
+            return await self.send_status(topic, 'error', 'Tema desconocido.')
+        if len(self.topics) >= getattr(settings, 'WS_MAX_TOPICS', 50):
+            return await self.send_status(topic, 'error', 'Demasiadas suscripciones.')
+
+        app, kwarg = self.TOPIC_APPS[kind]
+        # Mismo usuario (el JWT ya se decodificó al conectar) y la ruta que
+        # el consumer espera
+        scope = {**self.scope, 'url_route': {'args': (), 'kwargs': {kwarg: key}}}
+        self.topics[topic] = TopicSession(self, topic, app, scope)
+
+    async def unsubscribe(self, topic):
+        if topic == self.NOTIFICATIONS:
+            if self.notifications:
+                self.notifications = False
+                await self.channel_layer.group_discard(f"user_{self.user.id}_notifications", self.channel_name)
+            return await self.send_status(topic, 'unsubscribed')
+        session = self.topics.get(topic)
+        if session:
+            await session.stop()
+        else:
+            await self.send_status(topic, 'unsubscribed')
+
+    async def send_status(self, topic, status, detail=None):
+        if self.closing:
+            return
+        message = {'topic': topic, 'status': status}
+        if detail:
+            message['detail'] = detail
+        await self.send(text_data=json.dumps(message))
+
+    async def send_event(self, topic, event):
+        if not self.closing:
+            await self.send(text_data=json.dumps({'topic': topic, 'event': event}))
+
+    # --- Eventos de user_<id>_notifications ---
+
+    async def xp_update_message(self, event):
+        await self.send_event(self.NOTIFICATIONS, event)
+
+    async def challenge_review_chunk(self, event):
+        await self.send_event(self.NOTIFICATIONS, event)
+
+    async def challenge_evaluation_result(self, event):
+        await self.send_event(self.NOTIFICATIONS, event)
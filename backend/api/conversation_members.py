@@ -0,0 +1,49 @@
+# backend/api/conversation_members.py
+from django.db.models import Case, Count, F, Value, When, Window
+from django.db.models.functions import RowNumber
+from .models import Conversation
+
+# ====================================================================
+# --- RESUMEN DE PARTICIPANTES PARA EL INBOX ---
+# ====================================================================
+# Un chat de curso o de lección tiene a todos los inscritos: el inbox no
+# necesita la lista entera, solo cuántos son y unos pocos para mostrar
+# (en un DM, el otro). Se calcula para toda la página en UNA consulta
+# sobre la tabla intermedia con funciones de ventana; la lista completa
+# está en 'inbox/conversations/<id>/participants/' (paginada).
+
+PREVIEW_SIZE = 3
+
+
+def participant_summaries(conversation_ids, user_id, size=PREVIEW_SIZE):
+    """
+    {conversation_id: (total de participantes, [hasta 'size' usuarios])}.
+    El usuario actual se ordena al final y no entra en la vista previa.
+    """
+    through = Conversation.participants.through
+    rows = (
+        through.objects
+        .filter(conversation_id__in=conversation_ids)
+        .annotate(
+            position=Window(
+                RowNumber(),
+                partition_by=[F('conversation_id')],
+                order_by=[
+                    Case(When(user_id=user_id, then=Value(1)), default=Value(0)).asc(),
+                    F('user_id').asc(),
+                ],
+            ),
+            total=Window(Count('id'), partition_by=[F('conversation_id')]),
+        )
+        # Con el usuario actual al final, size + 1 filas alcanzan siempre
+        .filter(position__lte=size + 1)
+        .select_related('user')
+        .order_by('conversation_id', 'position')
+    )
+    summaries = {conversation_id: (0, []) for conversation_id in conversation_ids}
+    for row in rows:
+        _, preview = summaries[row.conversation_id]
+        if row.user_id != user_id and len(preview) < size:
+            preview.append(row.user)
+        summaries[row.conversation_id] = (row.total, preview)
+    return summaries
@@ -0,0 +1,108 @@
+# backend/api/evaluation_batcher.py
+import asyncio
+from django.conf import settings
+from .ai_evaluator import get_evaluator
+from .code_runner import run_test_cases
+from .code_precheck import precheck_code
+from .evaluation_cache import evaluation_cache, evaluation_key, challenge_version
+from .game_runner import _spawn
+
+# ====================================================================
+# --- MICRO-LOTES DE EVALUACIÓN (Desafío de Código en Vivo) ---
+# ====================================================================
+# Al cerrar un desafío llegan decenas de entregas en pocos segundos.
+# En vez de una llamada a Gemini por alumno, juntamos las entregas del
+# mismo desafío durante una ventana corta (o hasta llenar el lote) y las
+# evaluamos en UNA sola llamada. Cada consumer espera su propio veredicto.
+
+class CodeEvaluationBatcher:
+
+    def __init__(self, window=0.2, max_batch=16):
+        self.window = window
+        self.max_batch = max_batch
+        self._pending = {}  # (challenge_id, versión) -> lote abierto
+        self._timers = {}
+
+    async def evaluate(self, challenge_id, version, challenge, cache_key, user_code):
+        """ Veredicto {'is_correct': bool} de una entrega; espera a que salga su lote. """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        group = (challenge_id, version)
+        batch = self._pending.setdefault(group, {'challenge': challenge, 'items': []})
+        batch['items'].append((cache_key, user_code, future))
+
+        if len(batch['items']) >= self.max_batch:
+            self._flush(group)
+        elif group not in self._timers:
+            self._timers[group] = loop.call_later(self.window, self._flush, group)
+        return await future
+
+    def _flush(self, group):
+        timer = self._timers.pop(group, None)
+        if timer: timer.cancel()
+        batch = self._pending.pop(group, None)
+        if batch:
+            _spawn(self._run(batch))
+
+    async def _run(self, batch):
+        # Entregas equivalentes (misma clave normalizada) se evalúan una sola vez
+        codes = {}
+        for cache_key, user_code, _ in batch['items']:
+            codes.setdefault(cache_key, user_code)
+        keys = list(codes)
+
+        verdicts = {}
+        try:
+            results = await get_evaluator().evaluate_batch(batch['challenge'], [codes[key] for key in keys])
+            for key, verdict in zip(keys, results):
+                if verdict is not None:
+                    verdicts[key] = verdict
+                    evaluation_cache.set(key, verdict)
+            print(f"[IA LOG] Lote de {len(batch['items'])} entregas ({len(keys)} distintas) evaluado en una llamada.")
+        except Exception as e:
+            print(f"ERROR IA (lote de {len(keys)}): {e}")
+
+        for cache_key, _, future in batch['items']:
+            if not future.done():
+                # Sin veredicto (error o respuesta incompleta): incorrecta, como antes
+                future.set_result(verdicts.get(cache_key, {'is_correct': False}))
+
+
+code_batcher = CodeEvaluationBatcher(
+    window=getattr(settings, 'AI_EVAL_BATCH_WINDOW', 0.2),
+    max_batch=getattr(settings, 'AI_EVAL_BATCH_SIZE', 16),
+)
+
+
+async def evaluate_live_submission(challenge, user_code, test_cases):
+    """
+    Veredicto de una entrega del desafío en vivo: (is_correct, test_result, rejection).
+    Pre-chequeos estáticos -> casos de prueba en el sandbox -> IA (caché y micro-lotes).
+    Lo usan el consumer y el benchmark (manage.py benchmark_live_evaluation).
+    """
+    # 1. Pre-chequeos (microsegundos): sintaxis, tamaño, cuerpo vacío o
+    # código inicial sin cambios. Si falla, ni sandbox ni IA.
+    rejection = precheck_code(user_code, getattr(challenge, 'starter_code', None))
+    if rejection:
+        return False, None, rejection
+
+    # 2. Casos de prueba en el sandbox local (ms, determinista).
+    # El sandbox puede tardar hasta el tiempo límite: fuera del executor de la BD
+    if test_cases:
+        test_result = await asyncio.to_thread(run_test_cases, user_code, test_cases)
+        return test_result['is_correct'], test_result, None
+
+    # 3. Solo si el desafío no tiene casos le preguntamos a la IA.
+    # Misma solución (salvo nombres/comentarios/formato) = mismo veredicto, sin llamar a la IA.
+    # El backend entra en la versión: los veredictos del falso no sirven para Gemini.
+    try:
+        version = challenge_version(challenge.description, challenge.solution, get_evaluator().name)
+        key = evaluation_key('live', challenge.id, version, user_code)
+        verdict = evaluation_cache.get(key)
+        if verdict is None:
+            # Se junta con las demás entregas de la ventana: una llamada por lote
+            verdict = await code_batcher.evaluate(challenge.id, version, challenge, key, user_code)
+        return verdict.get('is_correct', False), None, None
+    except Exception as e:
+        print(f"[ERROR IA] {e}")
+        return False, None, None
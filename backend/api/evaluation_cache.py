@@ -0,0 +1,227 @@
+# backend/api/evaluation_cache.py
+import ast
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from django.core.cache import cache
+from django_redis import get_redis_connection
+
+# ====================================================================
+# --- CACHÉ DE EVALUACIONES (por código normalizado) ---
+# ====================================================================
+# En una clase muchos alumnos envían la misma solución con otros nombres
+# de variables, otros comentarios u otro formato. Normalizamos el código
+# (AST sin comentarios, sin docstrings y con las variables renombradas)
+# y guardamos el veredicto bajo hash(tipo, desafío, versión, código).
+
+CACHE_PREFIX = "eval_cache:"
+NORMALIZATION_VERSION = 2  # Subirlo si cambia normalize_code: las claves viejas dejan de usarse
+STATS_KEY = "eval_cache_stats"
+
+
+# Si el código accede a variables por su nombre en texto, renombrar
+# cambiaría lo que hace: en ese caso no se renombra nada
+_REFLECTIVE_NAMES = {
+    'globals', 'locals', 'vars', 'dir', 'eval', 'exec', 'compile', '__import__',
+    'getattr', 'setattr', 'hasattr', 'delattr',
+}
+_REFLECTIVE_ATTRS = {'__dict__', '__globals__', 'f_locals', 'f_globals'}
+
+
+class _RenameLocals(ast.NodeTransformer):
+    """
+    Renombra a _v0, _v1, ... las variables comunes (nombres que el código
+    asigna y solo se usan como variables). Se quedan los nombres que
+    también aparecen como texto en otro lado, porque cambiarlos cambiaría
+    el programa: funciones y clases, imports, parámetros (se pueden pasar
+    por nombre), atributos de clase, capturas de 'match', 'global' y
+    'nonlocal', y los dunder. Argumentos por nombre ('sep=') y atributos
+    nunca se tocan.
+    """
+
+    def __init__(self, tree):
+        kept = set()
+        assigned = []
+        identifiers = set()
+        reflective = False
+        for node in ast.walk(tree):
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+                kept.add(node.name)
+                identifiers.add(node.name)
+            if isinstance(node, ast.ClassDef):
+                kept.update(_class_body_names(node))
+            elif isinstance(node, ast.alias):
+                kept.add((node.asname or node.name).split('.')[0])
+            elif isinstance(node, ast.Name):
+                identifiers.add(node.id)
+                reflective = reflective or node.id in _REFLECTIVE_NAMES
+                if isinstance(node.ctx, ast.Store):
+                    assigned.append(node.id)
+            elif isinstance(node, ast.Attribute):
+                identifiers.add(node.attr)
+                reflective = reflective or node.attr in _REFLECTIVE_ATTRS
+            elif isinstance(node, ast.arg):
+                kept.add(node.arg)
+            elif isinstance(node, (ast.Global, ast.Nonlocal)):
+                kept.update(node.names)
+            elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+                kept.add(node.name)
+            elif isinstance(node, ast.MatchMapping) and node.rest:
+                kept.add(node.rest)
+            elif isinstance(node, ast.ExceptHandler) and node.name:
+                assigned.append(node.name)
+        identifiers |= kept
+
+        # Un prefijo que no use ningún nombre del código: los nuevos no chocan
+        prefix = '_v'
+        while any(name.startswith(prefix) for name in identifiers):
+            prefix += '_'
+        self.mapping = {}
+        if reflective:
+            return
+        for name in assigned:
+            if name not in kept and not name.startswith('__') and name not in self.mapping:
+                self.mapping[name] = f'{prefix}{len(self.mapping)}'
+
+    def visit_Name(self, node):
+        node.id = self.mapping.get(node.id, node.id)
+        return node
+
+    def visit_arg(self, node):
+        node.annotation = None
+        return node
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            node.name = self.mapping.get(node.name, node.name)
+        self.generic_visit(node)
+        return node
+
+
+def _class_body_names(node):
+    """ Nombres asignados directamente en el cuerpo de una clase (son atributos). """
+    names = set()
+    for statement in node.body:
+        if isinstance(statement, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            continue
+        for child in ast.walk(statement):
+            if isinstance(child, ast.Name) and isinstance(child.ctx, ast.Store):
+                names.add(child.id)
+    return names
+
+
+def _strip_docstrings(tree):
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Module, ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            body = node.body
+            if body and isinstance(body[0], ast.Expr) and isinstance(getattr(body[0], 'value', None), ast.Constant) \
+                    and isinstance(body[0].value.value, str):
+                node.body = body[1:] or [ast.Pass()]
+
+
+def _normalized_tree(code):
+    """ AST sin docstrings y con las variables renombradas, o None si no compila. """
+    try:
+        tree = ast.parse(code)
+    except (SyntaxError, ValueError):
+        return None
+    _strip_docstrings(tree)
+    return _RenameLocals(tree).visit(tree)
+
+
+def normalize_code(code):
+    """
+    Forma canónica del código: dos soluciones que solo difieren en formato,
+    comentarios, docstrings o nombres de variables dan el mismo resultado.
+    Si no compila, se compara el texto sin espacios al final de cada línea.
+    """
+    tree = _normalized_tree(code)
+    if tree is None:
+        return 'raw:' + '\n'.join(line.rstrip() for line in code.strip().splitlines())
+    return ast.dump(tree)
+
+
+def canonical_source(code):
+    """ La forma canónica como código fuente (para tokenizar); si no compila, el texto tal cual. """
+    tree = _normalized_tree(code)
+    return ast.unparse(tree) if tree is not None else code
+
+
+def challenge_version(*parts):
+    """ Cambia si el profesor edita el enunciado o la solución: invalida la caché. """
+    return hashlib.sha1('\x00'.join(str(p or '') for p in parts).encode()).hexdigest()[:12]
+
+
+def code_hash(code):
+    return hashlib.sha256(code.encode()).hexdigest()
+
+
+def evaluation_key(kind, challenge_id, version, code):
+    raw = f"{kind}:{challenge_id}:{version}:n{NORMALIZATION_VERSION}:{normalize_code(code)}"
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class EvaluationCache:
+    """
+    Dos niveles: un LRU en memoria de cada proceso (con TTL) y la caché de
+    Redis compartida (con el mismo TTL). Las métricas se suman en Redis
+    para ver el hit-rate de todos los procesos juntos.
+    """
+
+    def __init__(self, max_entries=512, ttl=6 * 3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (vence_en, valor)
+        self._lock = threading.Lock()
+
+    def _count(self, field):
+        get_redis_connection("default").hincrby(STATS_KEY, field, 1)
+
+    def _remember(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and entry[0] > time.time():
+                self._entries.move_to_end(key)
+            elif entry:
+                del self._entries[key]
+                entry = None
+        if entry:
+            self._count('local_hits')
+            return entry[1]
+
+        value = cache.get(CACHE_PREFIX + key)
+        if value is not None:
+            self._remember(key, value)
+            self._count('shared_hits')
+            return value
+        self._count('misses')
+        return None
+
+    def set(self, key, value):
+        self._remember(key, value)
+        cache.set(CACHE_PREFIX + key, value, self.ttl)
+
+    def stats(self):
+        raw = get_redis_connection("default").hgetall(STATS_KEY)
+        counts = {k.decode(): int(v) for k, v in raw.items()}
+        hits = counts.get('local_hits', 0) + counts.get('shared_hits', 0)
+        misses = counts.get('misses', 0)
+        return {
+            'hits': hits,
+            'local_hits': counts.get('local_hits', 0),
+            'shared_hits': counts.get('shared_hits', 0),
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses), 4) if hits + misses else 0.0,
+            'local_entries': len(self._entries),
+        }
+
+
+evaluation_cache = EvaluationCache()
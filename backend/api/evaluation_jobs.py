@@ -0,0 +1,413 @@
+# backend/api/evaluation_jobs.py
+import re
+import json
+import time
+import uuid
+import threading
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import F
+from .models import CodeChallenge, User
+from .live_game import get_redis, _script, _decode
+from .code_runner import run_test_cases
+from .code_similarity import record_submission, sign_pending, SIGNATURE_QUEUE_KEY
+from .ai_evaluator import get_evaluator, AIEvaluationError
+from .evaluation_cache import evaluation_cache, evaluation_key, challenge_version, code_hash
+
+# ====================================================================
+# --- COLA DE EVALUACIONES (Desafíos de Código de práctica) ---
+# ====================================================================
+# La vista solo encola y responde 202 con el id del trabajo. Un worker
+# (python manage.py run_evaluation_worker) evalúa, da el XP y avisa al
+# alumno por su grupo de WebSocket; también se puede consultar por polling.
+
+# Dos colas: el worker siempre vacía primero la de prioridad alta
+QUEUE_KEYS = {'high': "evaluation_queue:high", 'normal': "evaluation_queue:normal"}
+# Trabajos tomados por algún worker y todavía sin terminar. Cada uno tiene
+# un lease (ZSET id -> vencimiento): si el worker muere, el lease vence y
+# el trabajo vuelve a la cola en lugar de perderse.
+PROCESSING_KEY = "evaluation_queue:processing"
+LEASES_KEY = "evaluation_queue:leases"
+JOB_TTL = 3600
+POINTS_PER_CHALLENGE = 50
+
+# KEYS: [cola_alta, cola_normal, cola_destino, job]
+# ARGV: [profundidad máxima, job_id, ttl, campo1, valor1, ...]
+# Devuelve la posición en la cola, o -1 si está llena (backpressure).
+ENQUEUE_LUA = """
+local depth = redis.call('LLEN', KEYS[1]) + redis.call('LLEN', KEYS[2])
+if depth >= tonumber(ARGV[1]) then
+    return -1
+end
+redis.call('HSET', KEYS[4], unpack(ARGV, 4))
+redis.call('EXPIRE', KEYS[4], ARGV[3])
+redis.call('RPUSH', KEYS[3], ARGV[2])
+return depth
+"""
+
+
+# KEYS: [cola_alta, cola_normal, en_proceso, leases]
+# ARGV: [ahora, lease]
+# Mueve el próximo trabajo (alta primero) a 'en proceso' y le da un lease.
+CLAIM_LUA = """
+local job_id = redis.call('LMOVE', KEYS[1], KEYS[3], 'LEFT', 'RIGHT')
+if not job_id then
+    job_id = redis.call('LMOVE', KEYS[2], KEYS[3], 'LEFT', 'RIGHT')
+end
+if not job_id then
+    return false
+end
+redis.call('ZADD', KEYS[4], tonumber(ARGV[1]) + tonumber(ARGV[2]), job_id)
+return job_id
+"""
+
+# KEYS: [cola_alta, en_proceso, leases]
+# ARGV: [ahora, reintentos máximos, límite, prefijo del job]
+# Devuelve [reencolados, fallidos]. Los que siguen sin terminar vuelven al
+# principio de la cola alta; después de 'reintentos máximos' se dan por
+# fallidos (una entrega que tumba al worker no lo tumba para siempre).
+REQUEUE_EXPIRED_LUA = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[3]))
+local requeued, failed = {}, {}
+for _, job_id in ipairs(expired) do
+    redis.call('ZREM', KEYS[3], job_id)
+    redis.call('LREM', KEYS[2], 1, job_id)
+    local job = ARGV[4] .. job_id
+    local status = redis.call('HGET', job, 'status')
+    if status == 'queued' or status == 'running' then
+        if redis.call('HINCRBY', job, 'retries', 1) > tonumber(ARGV[2]) then
+            redis.call('HSET', job, 'status', 'error', 'finished_at', ARGV[1],
+                       'error', 'El worker se detuvo varias veces evaluando esta solución.')
+            table.insert(failed, job_id)
+        else
+            redis.call('HSET', job, 'status', 'queued')
+            redis.call('LPUSH', KEYS[1], job_id)
+            table.insert(requeued, job_id)
+        end
+    end
+end
+return {requeued, failed}
+"""
+
+
+class QueueFullError(Exception):
+    """ La cola superó EVAL_QUEUE_MAX_DEPTH: el cliente debe reintentar más tarde. """
+
+
+def job_key(job_id):
+    return f"evaluation_job:{job_id}"
+
+
+def awarded_key(job_id):
+    # SET NX: solo la primera evaluación de un trabajo guarda la entrega y da el XP
+    return f"eval_awarded:{job_id}"
+
+
+def enqueue(user_id, challenge_id, code):
+    """
+    Encola una entrega y devuelve (job_id, prioridad, posición).
+    El primer intento de un alumno en un desafío va en la cola alta;
+    los reintentos seguidos van a la normal para que nadie acapare el worker.
+    """
+    r = get_redis()
+    attempts_key = f"evaluation_attempts:{user_id}:{challenge_id}"
+    pipe = r.pipeline()
+    pipe.incr(attempts_key)
+    pipe.expire(attempts_key, JOB_TTL)
+    attempts, _ = pipe.execute()
+    priority = 'high' if attempts == 1 else 'normal'
+
+    job_id = uuid.uuid4().hex
+    fields = {
+        'user_id': user_id, 'challenge_id': challenge_id, 'code': code,
+        'status': 'queued', 'priority': priority, 'created_at': time.time(),
+    }
+    position = _script('enqueue_evaluation', ENQUEUE_LUA)(
+        keys=[QUEUE_KEYS['high'], QUEUE_KEYS['normal'], QUEUE_KEYS[priority], job_key(job_id)],
+        args=[getattr(settings, 'EVAL_QUEUE_MAX_DEPTH', 500), job_id, JOB_TTL,
+              *[str(x) for pair in fields.items() for x in pair]],
+    )
+    if position < 0:
+        raise QueueFullError()
+    return job_id, priority, position
+
+
+def claim_job(lease):
+    """ Toma el próximo trabajo con un lease de 'lease' segundos, o None si no hay. """
+    job_id = _script('claim_evaluation', CLAIM_LUA)(
+        keys=[QUEUE_KEYS['high'], QUEUE_KEYS['normal'], PROCESSING_KEY, LEASES_KEY],
+        args=[time.time(), lease],
+    )
+    return _decode(job_id) if job_id else None
+
+
+def renew_lease(job_id, lease):
+    # XX: si el lease ya venció y el trabajo se reencoló, no lo revive
+    get_redis().zadd(LEASES_KEY, {job_id: time.time() + lease}, xx=True)
+
+
+def release_job(job_id):
+    """ El trabajo terminó (bien o con error): sale de 'en proceso'. """
+    pipe = get_redis().pipeline()
+    pipe.lrem(PROCESSING_KEY, 1, job_id)
+    pipe.zrem(LEASES_KEY, job_id)
+    pipe.execute()
+
+
+def requeue_expired(limit=100):
+    """ Devuelve a la cola los trabajos cuyo worker dejó vencer el lease. """
+    requeued, failed = _script('requeue_expired_evaluations', REQUEUE_EXPIRED_LUA)(
+        keys=[QUEUE_KEYS['high'], PROCESSING_KEY, LEASES_KEY],
+        args=[time.time(), getattr(settings, 'EVAL_JOB_MAX_RETRIES', 2), limit, job_key('')],
+    )
+    return [_decode(j) for j in requeued], [_decode(j) for j in failed]
+
+
+def get_job(job_id):
+    """ Estado público del trabajo (sin el código), o None si no existe o expiró. """
+    raw = get_redis().hgetall(job_key(job_id))
+    if not raw:
+        return None
+    job = {_decode(k): _decode(v) for k, v in raw.items()}
+    return {
+        'job_id': job_id,
+        'user_id': int(job['user_id']),
+        'status': job['status'],
+        'result': json.loads(job['result']) if 'result' in job else None,
+        'partial_review': job.get('partial_review'),
+        'error': job.get('error'),
+    }
+
+
+def _finish(job_id, status, result=None, error=None):
+    mapping = {'status': status, 'finished_at': time.time()}
+    if result is not None:
+        mapping['result'] = json.dumps(result)
+    if error:
+        mapping['error'] = error
+    get_redis().hset(job_key(job_id), mapping=mapping)
+
+
+# ====================================================================
+# --- EVALUACIÓN (lo que antes hacía la vista) ---
+# ====================================================================
+
+def parse_review(text):
+    """
+    Separa la revisión en texto plano (formato de ai_evaluator.REVIEW_PROMPT):
+    {'is_correct': bool | None, 'feedback': str, 'code_review': str}
+    """
+    verdict = re.search(r"VEREDICTO:\s*(IN)?CORRECTO", text, re.IGNORECASE)
+    feedback = re.search(r"FEEDBACK:\s*(.*?)\s*(?:REVISIÓN:|```|$)", text, re.DOTALL)
+    code = re.search(r"```(?:python)?[ \t]*\n(.*?)(?:```|$)", text, re.DOTALL)
+    return {
+        'is_correct': (not verdict.group(1)) if verdict else None,
+        'feedback': feedback.group(1).strip() if feedback else text.strip(),
+        'code_review': code.group(1).rstrip() if code else None,
+    }
+
+
+def evaluate_challenge_submission(user_id, challenge, user_code, on_chunk=None, job_id=None, heartbeat=None):
+    """
+    Casos de prueba (si los hay) deciden la corrección; la IA escribe el
+    feedback, o decide ella si el desafío no tiene casos. Da el XP.
+    La revisión se genera en streaming: 'on_chunk(texto_acumulado, trozo)'
+    recibe cada trozo a medida que llega. 'heartbeat()' se llama entre los
+    pasos lentos (sandbox, caché) para que el worker renueve su lease.
+    Con 'job_id', la entrega y el XP se registran una sola vez por trabajo
+    aunque un reencolado lo evalúe de nuevo.
+    """
+    beat = heartbeat or (lambda: None)
+
+    # 1. Casos de prueba locales
+    test_cases = list(challenge.test_cases.all())
+    beat()
+    test_result = run_test_cases(user_code, test_cases) if test_cases else None
+    beat()
+
+    # 2. Resumen de los casos de prueba para la IA (si los hay, ya deciden la corrección)
+    test_summary = ''
+    if test_result:
+        test_summary = f"El código pasó {test_result['passed']} de {test_result['total']} casos de prueba."
+
+    # 3. Revisión del backend de evaluación (con casos de prueba, si falla seguimos sin feedback)
+    # Misma solución (salvo nombres/comentarios/formato) = misma respuesta de la IA.
+    # El resumen de los casos de prueba y el backend entran en la clave porque cambian la respuesta.
+    evaluator = get_evaluator()
+    version = challenge_version(challenge.description, challenge.solution, test_summary, evaluator.name)
+    key = evaluation_key('practice', challenge.id, version, user_code)
+    ia_data = evaluation_cache.get(key)
+    beat()
+    if ia_data is not None:
+        ia_data = dict(ia_data)
+        # La revisión comentada es sobre el código de otro alumno: no la mostramos
+        if ia_data.pop('code_sha', None) != code_hash(user_code):
+            ia_data['code_review'] = user_code
+    else:
+        try:
+            text = ''
+            for chunk in evaluator.stream_review(challenge, user_code, test_summary):
+                text += chunk
+                if on_chunk: on_chunk(text, chunk)
+            ia_data = parse_review(text)
+            if not test_result and ia_data['is_correct'] is None:
+                raise AIEvaluationError(f"La respuesta no trae VEREDICTO: {text[:200]}")
+            evaluation_cache.set(key, {**ia_data, 'code_sha': code_hash(user_code)})
+        except Exception as e:
+            if not test_result:
+                raise
+            print(f"ADVERTENCIA: La IA no pudo dar feedback. {e}")
+            ia_data = {'feedback': f"Pasaste {test_result['passed']} de {test_result['total']} casos de prueba."}
+
+    is_correct = test_result['is_correct'] if test_result else bool(ia_data.get('is_correct', False))
+    points_awarded = POINTS_PER_CHALLENGE if is_correct else 0
+
+    # Un trabajo reencolado (lease vencido) que ya había llegado hasta acá
+    # no vuelve a guardar la entrega ni a dar el XP: responde lo que dio la vez anterior
+    if job_id and not get_redis().set(awarded_key(job_id), points_awarded, nx=True, ex=JOB_TTL):
+        points_awarded = int(get_redis().get(awarded_key(job_id)) or 0)
+        print(f"[EVAL WORKER] El trabajo {job_id} ya había registrado su entrega: no se repite el XP.")
+    else:
+        # Se guarda con su firma MinHash (detección de soluciones casi iguales)
+        try:
+            record_submission(user_id, user_code, is_correct, challenge_id=challenge.id)
+        except Exception as e:
+            print(f"ADVERTENCIA: No se pudo guardar la entrega. {e}")
+
+        # 4. ¡Otorga los puntos de mascota!
+        if points_awarded:
+            User.objects.filter(id=user_id).update(experience_points=F('experience_points') + points_awarded)
+    new_total_xp = User.objects.filter(id=user_id).values_list('experience_points', flat=True).first()
+
+    return {
+        'is_correct': is_correct,
+        'feedback': ia_data.get('feedback'),
+        'code_review': ia_data.get('code_review'),
+        'test_results': test_result,
+        'points_awarded': points_awarded,
+        'new_total_xp': new_total_xp,
+    }
+
+
+def process_job(job_id, lease=None):
+    raw = get_redis().hgetall(job_key(job_id))
+    if not raw:
+        return  # Expiró mientras esperaba
+    job = {_decode(k): _decode(v) for k, v in raw.items()}
+    if job['status'] in ('done', 'error'):
+        return  # Reencolado tarde: el worker original ya lo terminó
+    user_id = int(job['user_id'])
+    get_redis().hset(job_key(job_id), 'status', 'running')
+
+    channel_layer = get_channel_layer()
+    group = f"user_{user_id}_notifications"
+    seq = 0
+
+    def heartbeat():
+        if lease: renew_lease(job_id, lease)
+
+    def push_chunk(text_so_far, chunk):
+        # El texto parcial queda en el trabajo (polling) y también viaja completo
+        # por WebSocket con un número de secuencia: si el cliente se saltea un
+        # mensaje (React agrupa renders), el siguiente ya trae todo el texto.
+        nonlocal seq
+        seq += 1
+        get_redis().hset(job_key(job_id), 'partial_review', text_so_far)
+        heartbeat()
+        try:
+            async_to_sync(channel_layer.group_send)(
+                group, {'type': 'challenge_review_chunk', 'data': {'job_id': job_id, 'seq': seq, 'text': text_so_far}}
+            )
+        except Exception as e:
+            print(f"ADVERTENCIA: No se pudo enviar el trozo por Channels. Error: {e}")
+
+    try:
+        challenge = CodeChallenge.objects.get(id=job['challenge_id'])
+        result = evaluate_challenge_submission(
+            user_id, challenge, job['code'], on_chunk=push_chunk, job_id=job_id, heartbeat=heartbeat,
+        )
+        _finish(job_id, 'done', result=result)
+        message = {'job_id': job_id, 'status': 'done', 'result': result}
+    except Exception as e:
+        print(f"[EVAL WORKER] ERROR en el trabajo {job_id}: {e}")
+        _finish(job_id, 'error', error=f'Error al evaluar la solución: {e}')
+        message = {'job_id': job_id, 'status': 'error', 'error': f'Error al evaluar la solución: {e}'}
+
+    # Aviso por WebSocket (si no está conectado, el polling lo encuentra igual)
+    try:
+        async_to_sync(channel_layer.group_send)(
+            group, {'type': 'challenge_evaluation_result', 'data': message}
+        )
+    except Exception as e:
+        print(f"ADVERTENCIA: No se pudo notificar por Channels. Error: {e}")
+
+
+class EvaluationWorker:
+    """
+    N hilos que toman trabajos de las dos colas (alta primero) y los pasan
+    a 'en proceso' con un lease; el trabajo sale de ahí recién al terminar.
+    Otro hilo reencola los trabajos con el lease vencido (worker caído) y
+    otro calcula las firmas MinHash de las entregas en vivo (code_similarity).
+    Los hilos pasan casi todo el tiempo esperando a Gemini o al sandbox.
+    """
+
+    def __init__(self, concurrency=4, poll_interval=0.2, lease=None):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = lease or getattr(settings, 'EVAL_JOB_LEASE', 120)
+
+    def _loop(self):
+        while True:
+            try:
+                job_id = claim_job(self.lease)
+                if job_id:
+                    process_job(job_id, lease=self.lease)
+                    release_job(job_id)
+                else:
+                    time.sleep(self.poll_interval)
+            except Exception as e:
+                # Sin release: cuando venza el lease el trabajo vuelve a la cola
+                print(f"[EVAL WORKER] ERROR leyendo la cola: {e}")
+                time.sleep(1)
+            finally:
+                close_old_connections()
+
+    def _reap(self):
+        while True:
+            try:
+                requeued, failed = requeue_expired()
+                if requeued or failed:
+                    print(f"[EVAL WORKER] Leases vencidos: {len(requeued)} reencolados, {len(failed)} fallidos.")
+            except Exception as e:
+                print(f"[EVAL WORKER] ERROR reencolando trabajos: {e}")
+            time.sleep(max(1, self.lease / 4))
+
+    def _sign(self):
+        r = get_redis()
+        while True:
+            try:
+                # El aviso solo despierta al hilo: firma todo lo pendiente,
+                # también lo que quedó sin firmar si un worker se cayó
+                r.blpop([SIGNATURE_QUEUE_KEY], timeout=30)
+                while sign_pending():
+                    pass
+            except Exception as e:
+                print(f"[EVAL WORKER] ERROR calculando firmas: {e}")
+                time.sleep(1)
+            finally:
+                close_old_connections()
+
+    def run(self):
+        print(f"[EVAL WORKER] Iniciado con {self.concurrency} hilos (lease de {self.lease}s).")
+        threads = [
+            threading.Thread(target=self._loop, name=f'eval-worker-{i}', daemon=True)
+            for i in range(self.concurrency)
+        ]
+        threads.append(threading.Thread(target=self._reap, name='eval-reaper', daemon=True))
+        threads.append(threading.Thread(target=self._sign, name='eval-signatures', daemon=True))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
@@ -0,0 +1,417 @@
+# backend/api/game_runner.py
+import time
+import asyncio
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models import F, Max, Case, When, Value, IntegerField
+from .models import User, QuizAttempt, QuizAttemptAnswer, Choice
+from .live_game import LiveGameStore, get_redis, _script, _decode
+
+# ====================================================================
+# --- TIEMPOS DE CADA FASE (segundos) ---
+# ====================================================================
+QUESTION_TIME = 15
+STATS_TIME = 5
+RANKING_TIME = 3
+GET_READY_TIME = 3
+CODE_TIME = 300
+AUTO_END_DELAY = 3
+
+# Máximo de actualizaciones por segundo del histograma que ve el profesor
+HISTOGRAM_MAX_RATE = 4
+
+# Agenda global: ZSET room_group_name -> epoch en que vence su fase actual
+SCHEDULE_KEY = "live_game_schedule"
+
+# Si un runner reclama una sala y muere antes de reprogramarla,
+# otro runner la recupera al vencer este "alquiler". Mientras el paso
+# corre (end_game con guardados lentos, BD lenta) el runner lo renueva
+# cada LEASE_RENEW_EVERY segundos para que nadie más tome la sala.
+LEASE_SECONDS = 30
+LEASE_RENEW_EVERY = LEASE_SECONDS / 3
+
+# KEYS: [schedule]
+# ARGV: [ahora, máximo de salas, vencimiento del alquiler]
+# Reclama las salas vencidas moviéndolas al futuro (alquiler), de forma
+# atómica: dos runners nunca procesan la misma sala a la vez.
+CLAIM_DUE_LUA = """
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, ARGV[2])
+for _, room in ipairs(due) do
+    redis.call('ZADD', KEYS[1], ARGV[3], room)
+end
+return due
+"""
+
+# KEYS: [schedule]
+# ARGV: [sala, vencimiento actual, nuevo vencimiento]
+# Renueva el alquiler solo si la sala sigue con el vencimiento que le dimos:
+# si el paso ya la reprogramó (schedule) o la reclamó otro runner, no la toca.
+RENEW_LEASE_LUA = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score or tonumber(score) ~= tonumber(ARGV[2]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], ARGV[3], ARGV[1])
+return 1
+"""
+
+
+def schedule(room_group_name, delay):
+    """ Programa el siguiente paso de la sala dentro de 'delay' segundos. """
+    get_redis().zadd(SCHEDULE_KEY, {room_group_name: time.time() + delay})
+
+
+def unschedule(room_group_name):
+    get_redis().zrem(SCHEDULE_KEY, room_group_name)
+
+
+def claim_due(limit=100, now=None):
+    """
+    Reclama hasta 'limit' salas vencidas (la más atrasada primero).
+    Devuelve (salas, vencimiento del alquiler).
+    """
+    now = time.time() if now is None else now
+    lease_until = now + LEASE_SECONDS
+    rooms = _script('claim_due', CLAIM_DUE_LUA)(
+        keys=[SCHEDULE_KEY], args=[now, limit, repr(lease_until)]
+    )
+    return [_decode(room) for room in rooms], lease_until
+
+
+def renew_lease(room_group_name, lease_until, now=None):
+    """ Extiende el alquiler de una sala reclamada; el nuevo vencimiento, o None si ya no es nuestra. """
+    new_lease = (time.time() if now is None else now) + LEASE_SECONDS
+    renewed = _script('renew_lease', RENEW_LEASE_LUA)(
+        keys=[SCHEDULE_KEY], args=[room_group_name, repr(lease_until), repr(new_lease)]
+    )
+    return new_lease if renewed else None
+
+
+# Tareas en segundo plano (se guarda la referencia para que no las recolecte el GC)
+_background_tasks = set()
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+    return task
+
+
+# ====================================================================
+# --- PASOS DEL JUEGO (compartidos por el runner y el consumer) ---
+# ====================================================================
+
+@database_sync_to_async
+def award_points(awards):
+    """
+    Suma XP a varios usuarios de una vez. 'awards' es una lista de
+    (user_id, puntos); si un usuario se repite, sus puntos se acumulan.
+    Un solo UPDATE ... CASE y una sola consulta para leer los nuevos totales.
+    Devuelve [{'user_id', 'username', 'points', 'total_xp'}].
+    """
+    points_by_user = {}
+    for user_id, points in awards:
+        points_by_user[int(user_id)] = points_by_user.get(int(user_id), 0) + int(points)
+    points_by_user = {uid: pts for uid, pts in points_by_user.items() if pts}
+    if not points_by_user:
+        return []
+
+    with transaction.atomic():
+        users = User.objects.filter(id__in=points_by_user.keys())
+        users.update(experience_points=F('experience_points') + Case(
+            *[When(id=uid, then=Value(pts)) for uid, pts in points_by_user.items()],
+            default=Value(0),
+            output_field=IntegerField(),
+        ))
+        totals = users.values_list('id', 'username', 'experience_points')
+        return [
+            {'user_id': uid, 'username': username, 'points': points_by_user[uid], 'total_xp': xp}
+            for uid, username, xp in totals
+        ]
+
+
+async def notify_xp(channel_layer, room_group_name, awarded):
+    """ Un 'xp_notification' por usuario premiado (lo que ya escucha el front). """
+    for award in awarded:
+        await channel_layer.group_send(room_group_name, {'type': 'xp_notification', **award})
+
+
+@database_sync_to_async
+def save_quiz_results(quiz_id, results):
+    """
+    Guarda un Quiz en Vivo terminado: un QuizAttempt por alumno (con su
+    porcentaje de aciertos y sus puntos en vivo) y sus respuestas por
+    pregunta, todo en dos bulk_create dentro de una transacción.
+    Las respuestas cuya pregunta u opción ya no existe se descartan (una
+    fila inválida haría fallar la transacción y se perderían todos los intentos).
+    """
+    scores = results['scores']
+    rounds = results['rounds']
+    if not scores or not rounds:
+        return 0
+
+    valid = set(
+        Choice.objects.filter(question_id__in=[r['question_id'] for r in rounds if r['question_id']])
+        .values_list('question_id', 'id')
+    )
+
+    with transaction.atomic():
+        last_attempts = dict(
+            QuizAttempt.objects.filter(quiz_id=quiz_id, user_id__in=scores.keys())
+            .values('user_id')
+            .annotate(last=Max('attempt_number'))
+            .values_list('user_id', 'last')
+        )
+        attempts = []
+        for user_id, points in scores.items():
+            correct = sum(1 for r in rounds if r['choices'].get(user_id) in r['correct_ids'])
+            attempts.append(QuizAttempt(
+                quiz_id=quiz_id,
+                user_id=user_id,
+                score=round(100 * correct / len(rounds), 2),
+                attempt_number=last_attempts.get(user_id, 0) + 1,
+                live_points=points,
+            ))
+        attempts = QuizAttempt.objects.bulk_create(attempts)
+
+        answers = [
+            QuizAttemptAnswer(
+                attempt_id=attempt.id,
+                question_id=r['question_id'],
+                choice_id=r['choices'][attempt.user_id],
+                is_correct=r['choices'][attempt.user_id] in r['correct_ids'],
+            )
+            for attempt in attempts
+            for r in rounds
+            if (r['question_id'], r['choices'].get(attempt.user_id)) in valid
+        ]
+        skipped = sum(len(r['choices']) for r in rounds) - len(answers)
+        if skipped:
+            print(f"ADVERTENCIA: Quiz {quiz_id}: {skipped} respuestas inválidas (opción inexistente o de otra pregunta) no se guardaron.")
+        QuizAttemptAnswer.objects.bulk_create(answers)
+    return len(attempts)
+
+
+async def persist_results(store, quiz_id):
+    try:
+        saved = await save_quiz_results(quiz_id, store.results())
+        print(f"[RUNNER] Quiz {quiz_id}: {saved} intentos guardados en QuizAttempt.")
+    except Exception as e:
+        print(f"[RUNNER] ERROR guardando resultados del quiz {quiz_id}: {e}")
+
+
+async def send_quiz_pack(channel_layer, store, questions):
+    """
+    Reparte todas las preguntas (sin marcar las correctas) durante el
+    "Prepárate", para que el inicio de cada ronda no dependa del tamaño
+    de la pregunta ni del número de alumnos.
+    """
+    await channel_layer.group_send(
+        store.room_group_name,
+        {
+            'type': 'quiz_pack',
+            'data': {'questions': questions, 'total_questions': len(questions)}
+        }
+    )
+
+
+async def send_question(channel_layer, store, meta):
+    index = meta["current_question_index"]
+    deadline = time.time() + QUESTION_TIME
+    store.set_phase('question', deadline)
+    # Los clientes ya tienen el paquete de preguntas (quiz_pack): aquí solo
+    # se "revela" cuál toca y hasta cuándo. Mensaje de pocos bytes.
+    await channel_layer.group_send(
+        store.room_group_name,
+        {
+            'type': 'quiz_question',
+            'data': {
+                'question_index': index,
+                'question_number': index + 1,
+                'total_questions': meta["total_questions"],
+                'timer': QUESTION_TIME,
+                'deadline': deadline,
+            }
+        }
+    )
+    schedule(store.room_group_name, QUESTION_TIME)
+    _spawn(stream_histogram(channel_layer, store, index, deadline))
+
+
+async def stream_histogram(channel_layer, store, index, deadline):
+    """
+    Envía al profesor el conteo de respuestas por opción mientras la
+    pregunta está abierta, como mucho HISTOGRAM_MAX_RATE veces por segundo
+    y solo si cambió. Lee los contadores; nunca recalcula desde las respuestas.
+    """
+    last_counts = None
+    while time.time() < deadline:
+        await asyncio.sleep(1 / HISTOGRAM_MAX_RATE)
+        meta = store.get_meta()
+        if not meta or meta.get('phase') != 'question' or meta["current_question_index"] != index:
+            return
+        counts = store.histogram(index)
+        if counts == last_counts:
+            continue
+        last_counts = counts
+        await channel_layer.group_send(
+            f"{store.room_group_name}_professor",
+            {
+                'type': 'quiz_answer_histogram',
+                'data': {
+                    'question_number': index + 1,
+                    'counts': counts,
+                    'total': sum(counts.values()),
+                }
+            }
+        )
+
+
+async def send_stats(channel_layer, store, meta):
+    index = meta["current_question_index"]
+    stats = {'total': store.answered_count(index), 'counts': store.histogram(index)}
+    store.set_phase('stats')
+    await channel_layer.group_send(
+        store.room_group_name,
+        {'type': 'quiz_stats_update', 'data': {'stats': stats}}
+    )
+    schedule(store.room_group_name, STATS_TIME)
+
+
+async def broadcast_ranking(channel_layer, store):
+    # Los puestos de todos viajan en el evento: cada socket elige el suyo sin ir a Redis
+    update = store.ranking_update()
+    if update is None:
+        return  # El juego terminó: ya salieron (o están saliendo) los resultados finales
+    await channel_layer.group_send(
+        store.room_group_name,
+        {'type': 'quiz_ranking_update', **update}
+    )
+
+
+async def send_ranking(channel_layer, store, meta):
+    store.set_phase('ranking')
+    await broadcast_ranking(channel_layer, store)
+    schedule(store.room_group_name, RANKING_TIME)
+
+
+async def next_round(channel_layer, store, meta):
+    next_index = store.advance()
+    if next_index < meta["total_questions"]:
+        store.set_phase('get_ready')
+        await channel_layer.group_send(store.room_group_name, {'type': 'quiz_get_ready'})
+        schedule(store.room_group_name, GET_READY_TIME)
+    else:
+        await end_game(channel_layer, store)
+
+
+async def end_game(channel_layer, store):
+    meta = store.get_meta()
+    # Solo el primero (runner, STOP_GAME o auto-cierre) cierra el juego
+    if not meta or not store.claim_finish(): return
+    unschedule(store.room_group_name)
+
+    sorted_ranking = store.top()
+
+    # --- CÁLCULO DE ESTADÍSTICAS PARA EL PROFESOR ---
+    # En el desafío de código, quien está en el ranking es porque acertó.
+    stats = {
+        "correct": store.player_count(),
+        "top_3": sorted_ranking[:3] # Enviamos el podio
+    }
+
+    # Dar XP a los ganadores (el ZSET ya trae el user_id de cada puesto)
+    awarded = await award_points(
+        [(player["user_id"], points) for player, points in zip(sorted_ranking, [15, 10, 5])]
+    )
+
+    await channel_layer.group_send(
+        store.room_group_name,
+        {
+            'type': 'quiz_final_results',
+            'data': {
+                'ranking': sorted_ranking,
+                'stats': stats,
+                'is_final': True
+            },
+            'ranks': store.ranks(),
+        }
+    )
+
+    await notify_xp(channel_layer, store.room_group_name, awarded)
+
+    # Guardado en BD fuera del camino crítico: el podio ya salió.
+    # Las claves siguen vivas FINISHED_TTL segundos, tiempo de sobra para leerlas.
+    if meta.get('game_type') == 'quiz':
+        _spawn(persist_results(store, meta['quiz_id']))
+
+    store.expire()
+
+
+# Qué hacer cuando vence cada fase
+PHASE_HANDLERS = {
+    'starting': send_question,
+    'get_ready': send_question,
+    'question': send_stats,
+    'stats': send_ranking,
+    'ranking': next_round,
+    'code': lambda channel_layer, store, meta: end_game(channel_layer, store),
+}
+
+
+# ====================================================================
+# --- RUNNER (proceso dedicado: python manage.py run_live_games) ---
+# ====================================================================
+
+class GameRunner:
+    """
+    Dueño de los tiempos de TODAS las salas con juego activo.
+    No depende de la conexión del profesor: las fases viven en Redis y
+    cualquier runner (en cualquier nodo) puede continuar una sala.
+    """
+
+    def __init__(self, poll_interval=0.2, batch_size=100):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.channel_layer = get_channel_layer()
+
+    async def run(self):
+        print("[RUNNER] Iniciado. Esperando salas...")
+        while True:
+            try:
+                rooms, lease_until = claim_due(self.batch_size)
+                for room in rooms:
+                    _spawn(self.step(room, lease_until))
+            except Exception as e:
+                print(f"[RUNNER] ERROR leyendo la agenda: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def keep_lease(self, room_group_name, lease_until):
+        """ Renueva el alquiler hasta que el paso reprograme la sala (o la pierda). """
+        while lease_until:
+            await asyncio.sleep(LEASE_RENEW_EVERY)
+            lease_until = renew_lease(room_group_name, lease_until)
+
+    async def step(self, room_group_name, lease_until=None):
+        store = LiveGameStore(room_group_name)
+        meta = store.get_meta()
+        if not meta:
+            unschedule(room_group_name)
+            return
+
+        handler = PHASE_HANDLERS.get(meta.get('phase'))
+        if not handler:
+            print(f"[RUNNER] Fase desconocida '{meta.get('phase')}' en {room_group_name}")
+            unschedule(room_group_name)
+            return
+
+        keeper = _spawn(self.keep_lease(room_group_name, lease_until)) if lease_until else None
+        try:
+            await handler(self.channel_layer, store, meta)
+        except Exception as e:
+            # El alquiler sigue vigente: la sala se reintentará al vencer
+            print(f"[RUNNER] ERROR en {room_group_name} (fase {meta.get('phase')}): {e}")
+        finally:
+            if keeper: keeper.cancel()
@@ -0,0 +1,460 @@
+# backend/api/live_game.py
+import json
+import time
+from django_redis import get_redis_connection
+
+# Tiempo de vida de todas las claves de un juego en vivo (1 hora)
+GAME_TTL = 3600
+
+# Tras el cierre, las claves viven un poco más para que cada consumer
+# pueda calcular el puesto de su usuario en los resultados finales
+FINISHED_TTL = 60
+
+# Cuántos jugadores viajan en cada mensaje de ranking (el resto recibe su puesto aparte)
+RANKING_SIZE = 10
+
+# ====================================================================
+# --- SCRIPTS LUA (se ejecutan de forma atómica dentro de Redis) ---
+# ====================================================================
+
+# KEYS: [meta, question_ids, answered, leaderboard, names, histogram, choices, options]
+# ARGV: [user_id, username, is_correct (0/1), offset, always_register (0/1), choice_id ('' = ninguna),
+#        fase esperada, índice esperado, ahora (epoch), question_id ('' = no comprobar)]
+# Devuelve: {añadido (1 / 0 = ya respondió / -1 = rechazada), total_respuestas, puntos}
+# Solo registra si el juego sigue en la fase y la pregunta que vio el
+# consumer, no terminó y la respuesta llegó antes de la fecha límite;
+# 'choice_id', si viene, tiene que ser una de las opciones de la pregunta.
+# Las claves que toca viven lo mismo que meta: una respuesta nunca
+# alarga la vida de un juego.
+RECORD_ANSWER_LUA = """
+local meta = redis.call('HMGET', KEYS[1], 'phase', 'current_question_index', 'deadline', 'finished')
+if not meta[1] or meta[4] or meta[1] ~= ARGV[7] or meta[2] ~= ARGV[8] then
+    return {-1, 0, 0}
+end
+if meta[3] and tonumber(ARGV[9]) >= tonumber(meta[3]) then
+    return {-1, 0, 0}
+end
+if ARGV[10] ~= '' and redis.call('HGET', KEYS[2], ARGV[8]) ~= ARGV[10] then
+    return {-1, 0, 0}
+end
+if ARGV[6] ~= '' and redis.call('SISMEMBER', KEYS[8], ARGV[6]) == 0 then
+    return {-1, 0, 0}
+end
+if redis.call('SADD', KEYS[3], ARGV[1]) == 0 then
+    return {0, redis.call('SCARD', KEYS[3]), 0}
+end
+local ttl = redis.call('PTTL', KEYS[1])
+local touched = {KEYS[3]}
+if ARGV[6] ~= '' then
+    redis.call('HINCRBY', KEYS[6], ARGV[6], 1)
+    redis.call('HSET', KEYS[7], ARGV[1], ARGV[6])
+    table.insert(touched, KEYS[6])
+    table.insert(touched, KEYS[7])
+end
+local count = redis.call('SCARD', KEYS[3])
+local points = 0
+if ARGV[3] == '1' then
+    points = math.max(100, 1000 - (count - tonumber(ARGV[4])) * 50)
+end
+if ARGV[3] == '1' or ARGV[5] == '1' then
+    redis.call('HSETNX', KEYS[5], ARGV[1], ARGV[2])
+    redis.call('ZINCRBY', KEYS[4], points, ARGV[1])
+    table.insert(touched, KEYS[4])
+    table.insert(touched, KEYS[5])
+end
+if ttl > 0 then
+    for _, key in ipairs(touched) do
+        redis.call('PEXPIRE', key, ttl)
+    end
+end
+return {1, count, points}
+"""
+
+# KEYS: [meta]
+# Marca el juego como terminado. Solo el primero que llega recibe 1.
+CLAIM_FINISH_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+return redis.call('HSETNX', KEYS[1], 'finished', '1')
+"""
+
+# KEYS: [last_top, meta, leaderboard, names]
+# ARGV: [n]
+# Lee el ranking, guarda el top n como el último enviado y devuelve
+# {top_anterior, nueva_versión, top, puestos} (JSON), todo en el mismo paso:
+# el top, los puestos de cada jugador y la versión no pueden quedar
+# desfasados por otra respuesta en el medio.
+# Si el juego ya no existe o terminó devuelve nil: HINCRBY sobre un meta
+# borrado lo recrearía sin TTL (y saldría un ranking después del final).
+SWAP_TOP_LUA = """
+if redis.call('EXISTS', KEYS[2]) == 0 or redis.call('HEXISTS', KEYS[2], 'finished') == 1 then
+    return false
+end
+local rows = redis.call('ZREVRANGE', KEYS[3], 0, -1, 'WITHSCORES')
+local n = math.min(tonumber(ARGV[1]), #rows / 2)
+local top_json, ranks_json = '[]', '{}'
+if #rows > 0 then
+    local ids, ranks = {}, {}
+    for i = 1, #rows, 2 do
+        local rank = (i + 1) / 2
+        ranks[rows[i]] = {rank = rank, score = math.floor(tonumber(rows[i + 1]))}
+        if rank <= n then
+            table.insert(ids, rows[i])
+        end
+    end
+    local names = redis.call('HMGET', KEYS[4], unpack(ids))
+    local top = {}
+    for i, uid in ipairs(ids) do
+        top[i] = {user_id = tonumber(uid), username = names[i] or '', score = ranks[uid].score}
+    end
+    top_json, ranks_json = cjson.encode(top), cjson.encode(ranks)
+end
+local prev = redis.call('GET', KEYS[1])
+redis.call('SET', KEYS[1], top_json, 'PX', math.max(redis.call('PTTL', KEYS[2]), 1))
+local version = redis.call('HINCRBY', KEYS[2], 'ranking_version', 1)
+return {prev or '', version, top_json, ranks_json}
+"""
+
+_scripts = {}
+
+
+def get_redis():
+    return get_redis_connection("default")
+
+
+def _script(name, source):
+    if name not in _scripts:
+        _scripts[name] = get_redis().register_script(source)
+    return _scripts[name]
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+class LiveGameStore:
+    """
+    Estado de un juego en vivo (Quiz o Desafío de Código) repartido en
+    estructuras de Redis, en lugar de un único dict que se lee y se
+    reescribe completo en cada respuesta.
+
+    Claves (prefijo = live_game_<room_group_name>):
+      - <prefijo>:meta        HASH  tipo de juego, quiz_id, índice actual, total,
+                                  fase y fecha límite de la fase
+      - <prefijo>:questions   HASH  índice -> JSON de la pregunta
+      - <prefijo>:question_ids HASH índice -> id de la pregunta (validar respuestas)
+      - <prefijo>:answered:N  SET   user_ids que ya respondieron la pregunta N
+      - <prefijo>:key:N       SET   ids de las opciones correctas de la pregunta N
+      - <prefijo>:options:N   SET   ids de todas las opciones de la pregunta N
+      - <prefijo>:hist:N      HASH  choice_id -> cuántos la eligieron en la pregunta N
+      - <prefijo>:choices:N   HASH  user_id -> choice_id elegido en la pregunta N
+      - <prefijo>:leaderboard ZSET  user_id -> puntaje (ranking ordenado)
+      - <prefijo>:names       HASH  user_id -> username
+      - <prefijo>:last_top    STR   JSON del último top enviado (para deltas)
+    """
+
+    def __init__(self, room_group_name):
+        self.room_group_name = room_group_name
+        self.key = f"live_game_{room_group_name}"
+        self.meta_key = f"{self.key}:meta"
+        self.questions_key = f"{self.key}:questions"
+        self.question_ids_key = f"{self.key}:question_ids"
+        self.leaderboard_key = f"{self.key}:leaderboard"
+        self.names_key = f"{self.key}:names"
+        self.last_top_key = f"{self.key}:last_top"
+
+    def answered_key(self, index):
+        return f"{self.key}:answered:{index}"
+
+    def answer_key(self, index):
+        return f"{self.key}:key:{index}"
+
+    def options_key(self, index):
+        return f"{self.key}:options:{index}"
+
+    def histogram_key(self, index):
+        return f"{self.key}:hist:{index}"
+
+    def choices_key(self, index):
+        return f"{self.key}:choices:{index}"
+
+    # --- Ciclo de vida ---
+
+    def start(self, game_type, quiz_id, questions, answer_key=None, phase='starting'):
+        """
+        Crea (o reemplaza) el juego de la sala.
+        'answer_key' es una lista (una entrada por pregunta) con los ids de
+        las opciones correctas; se precompila al iniciar para calificar sin
+        consultar la base de datos durante la ronda.
+        """
+        self.delete()
+        pipe = get_redis().pipeline()
+        pipe.hset(self.meta_key, mapping={
+            'game_type': game_type,
+            'quiz_id': str(quiz_id),
+            'current_question_index': 0,
+            'total_questions': len(questions),
+            'phase': phase,
+        })
+        pipe.hset(self.questions_key, mapping={
+            str(i): json.dumps(q) for i, q in enumerate(questions)
+        })
+        pipe.hset(self.question_ids_key, mapping={
+            str(i): str(q.get('id', '')) for i, q in enumerate(questions)
+        })
+        pipe.expire(self.meta_key, GAME_TTL)
+        pipe.expire(self.questions_key, GAME_TTL)
+        pipe.expire(self.question_ids_key, GAME_TTL)
+        for i, q in enumerate(questions):
+            option_ids = [str(c['id']) for c in q.get('choices') or []]
+            if option_ids:
+                pipe.sadd(self.options_key(i), *option_ids)
+                pipe.expire(self.options_key(i), GAME_TTL)
+        for i, correct_ids in enumerate(answer_key or []):
+            if correct_ids:
+                pipe.sadd(self.answer_key(i), *[str(c) for c in correct_ids])
+                pipe.expire(self.answer_key(i), GAME_TTL)
+        pipe.execute()
+
+    def _all_keys(self, r):
+        total = int(r.hget(self.meta_key, 'total_questions') or 0)
+        keys = [
+            self.meta_key, self.questions_key, self.question_ids_key,
+            self.leaderboard_key, self.names_key, self.last_top_key,
+        ]
+        for i in range(max(total, 1)):
+            keys += [
+                self.answered_key(i), self.answer_key(i), self.options_key(i),
+                self.histogram_key(i), self.choices_key(i),
+            ]
+        return keys
+
+    def delete(self):
+        r = get_redis()
+        r.delete(*self._all_keys(r))
+
+    def expire(self, seconds=FINISHED_TTL):
+        """ Deja que Redis borre el juego terminado pasado un tiempo. """
+        r = get_redis()
+        pipe = r.pipeline()
+        for key in self._all_keys(r):
+            pipe.expire(key, seconds)
+        pipe.execute()
+
+    def claim_finish(self):
+        """ True solo para el primer llamador (evita doble end_game). """
+        return bool(_script('claim_finish', CLAIM_FINISH_LUA)(keys=[self.meta_key]))
+
+    # --- Lecturas ---
+
+    def get_meta(self):
+        """ Metadatos del juego activo, o None si no hay juego (o ya terminó). """
+        raw = get_redis().hgetall(self.meta_key)
+        if not raw or b'finished' in raw:
+            return None
+        meta = {_decode(k): _decode(v) for k, v in raw.items()}
+        meta['current_question_index'] = int(meta.get('current_question_index', 0))
+        meta['total_questions'] = int(meta.get('total_questions', 0))
+        if 'deadline' in meta:
+            meta['deadline'] = float(meta['deadline'])
+        return meta
+
+    def get_question(self, index):
+        raw = get_redis().hget(self.questions_key, str(index))
+        return json.loads(raw) if raw else None
+
+    def snapshot(self, user_id=None):
+        """
+        Foto compacta del juego para un socket que (re)conecta: fase,
+        pregunta actual, fecha límite, preguntas y, si se pasa un usuario,
+        su puesto y si ya respondió. Dos viajes a Redis. None si no hay juego.
+        """
+        meta = self.get_meta()
+        if not meta:
+            return None
+        index = meta['current_question_index']
+        pipe = get_redis().pipeline()
+        pipe.hgetall(self.questions_key)
+        if user_id is not None:
+            pipe.zrevrank(self.leaderboard_key, str(user_id))
+            pipe.zscore(self.leaderboard_key, str(user_id))
+            pipe.sismember(self.answered_key(index), str(user_id))
+        questions, *mine = pipe.execute()
+
+        snapshot = {
+            'game_type': meta.get('game_type'),
+            'phase': meta.get('phase'),
+            'question_index': index,
+            'question_number': index + 1,
+            'total_questions': meta['total_questions'],
+            'deadline': meta.get('deadline') if meta.get('phase') in ('question', 'code') else None,
+            'questions': [json.loads(questions[k]) for k in sorted(questions, key=int)],
+        }
+        if user_id is not None:
+            rank, score, answered = mine
+            snapshot['me'] = {'rank': rank + 1, 'score': int(score)} if rank is not None else None
+            snapshot['answered'] = bool(answered)
+        return snapshot
+
+    def has_answered(self, index, user_id):
+        return bool(get_redis().sismember(self.answered_key(index), str(user_id)))
+
+    def histogram(self, index):
+        """ Respuestas por opción de la pregunta N (solo lectura de contadores). """
+        raw = get_redis().hgetall(self.histogram_key(index))
+        return {_decode(k): int(v) for k, v in raw.items()}
+
+    def is_correct(self, index, choice_id):
+        """ Califica contra la clave precompilada (un SISMEMBER, sin BD). """
+        return bool(get_redis().sismember(self.answer_key(index), str(choice_id)))
+
+    def answered_count(self, index):
+        return get_redis().scard(self.answered_key(index))
+
+    def top(self, n=RANKING_SIZE):
+        """ Los n primeros del ranking: O(log N + n) sobre el ZSET. """
+        r = get_redis()
+        rows = r.zrevrange(self.leaderboard_key, 0, n - 1, withscores=True)
+        if not rows:
+            return []
+        names = r.hmget(self.names_key, [uid for uid, _ in rows])
+        return [
+            {
+                'user_id': int(_decode(uid)),
+                'username': _decode(name) or '',
+                'score': int(score),
+            }
+            for (uid, score), name in zip(rows, names)
+        ]
+
+    def ranks(self):
+        """
+        Puesto (1 = primero) y puntaje de cada jugador, por user_id (texto):
+        {'7': {'rank': 1, 'score': 950}, ...}. Lo calcula el runner una vez
+        por broadcast; cada socket solo elige el suyo.
+        """
+        rows = get_redis().zrevrange(self.leaderboard_key, 0, -1, withscores=True)
+        return {
+            _decode(uid): {'rank': i + 1, 'score': int(score)}
+            for i, (uid, score) in enumerate(rows)
+        }
+
+    def player_count(self):
+        return get_redis().zcard(self.leaderboard_key)
+
+    def ranking_update(self, n=RANKING_SIZE):
+        """
+        Arma el evento 'quiz_ranking_update': {'data', 'top', 'ranks'}.
+        'data' es lo que ve el cliente, con número de versión: si hay un top
+        anterior, solo viajan las filas que cambiaron (modo 'delta').
+        'top' (el top completo, para quien no tenga la versión base) y
+        'ranks' (ver ranks()) los usa el consumer sin volver a Redis.
+        None si el juego ya no está activo.
+        """
+        swapped = _script('swap_top', SWAP_TOP_LUA)(
+            keys=[self.last_top_key, self.meta_key, self.leaderboard_key, self.names_key],
+            args=[n],
+        )
+        if not swapped:
+            return None
+        prev_raw, version, top_json, ranks_json = swapped
+        top = json.loads(top_json)
+        ranks = json.loads(ranks_json)
+        version = int(version)
+        if not prev_raw:
+            data = {'mode': 'full', 'version': version, 'ranking': top, 'is_final': False}
+            return {'data': data, 'top': top, 'ranks': ranks}
+
+        prev = json.loads(prev_raw)
+        changes = [
+            {**row, 'rank': i + 1}
+            for i, row in enumerate(top)
+            if i >= len(prev) or prev[i] != row
+        ]
+        data = {
+            'mode': 'delta',
+            'version': version,
+            'base_version': version - 1,
+            'changes': changes,
+            'size': len(top),
+            'is_final': False,
+        }
+        return {'data': data, 'top': top, 'ranks': ranks}
+
+    def results(self):
+        """
+        Foto completa del juego para guardarlo en la BD al terminar:
+        puntajes de todos los jugadores y, por pregunta, su id, la clave
+        de respuestas y la opción elegida por cada usuario.
+        """
+        r = get_redis()
+        total = int(r.hget(self.meta_key, 'total_questions') or 0)
+        pipe = r.pipeline()
+        pipe.zrange(self.leaderboard_key, 0, -1, withscores=True)
+        pipe.hgetall(self.questions_key)
+        for i in range(total):
+            pipe.smembers(self.answer_key(i))
+            pipe.hgetall(self.choices_key(i))
+        scores, questions, *per_question = pipe.execute()
+
+        rounds = []
+        for i in range(total):
+            correct_ids, choices = per_question[2 * i], per_question[2 * i + 1]
+            raw_question = questions.get(str(i).encode())
+            question = json.loads(raw_question) if raw_question else {}
+            rounds.append({
+                'question_id': question.get('id'),
+                'correct_ids': {int(c) for c in correct_ids},
+                # El script ya valida las opciones; por si acaso, lo que no es un id se descarta
+                'choices': {
+                    int(uid): int(cid) for uid, cid in choices.items()
+                    if uid.isdigit() and cid.isdigit()
+                },
+            })
+        return {
+            'scores': {int(_decode(uid)): int(score) for uid, score in scores},
+            'rounds': rounds,
+        }
+
+    # --- Escrituras atómicas ---
+
+    def record_answer(self, index, user_id, username, is_correct, offset=1, always_register=True,
+                      choice_id=None, phase='question', question_id=None, now=None):
+        """
+        Registra la respuesta de un usuario en una sola operación atómica.
+        Devuelve (añadido, total_respuestas, puntos). Si el usuario ya había
+        respondido, 'añadido' es False y no se modifica nada.
+        Si se indica 'choice_id', también incrementa el contador de esa opción.
+        También es False (y no se toca nada) si el juego ya no está en la
+        fase 'phase' y la pregunta 'index', terminó, 'now' (por defecto,
+        ahora) pasó la fecha límite, 'question_id' no es el de la pregunta
+        o 'choice_id' no es una de sus opciones.
+        """
+        added, count, points = _script('record_answer', RECORD_ANSWER_LUA)(
+            keys=[
+                self.meta_key, self.question_ids_key,
+                self.answered_key(index), self.leaderboard_key,
+                self.names_key, self.histogram_key(index), self.choices_key(index),
+                self.options_key(index),
+            ],
+            args=[
+                str(user_id), username, int(bool(is_correct)), offset,
+                int(bool(always_register)),
+                '' if choice_id is None else str(choice_id),
+                phase, index, time.time() if now is None else now,
+                '' if question_id is None else str(question_id),
+            ],
+        )
+        return added == 1, int(count), int(points)
+
+    def set_phase(self, phase, deadline=None):
+        """ Guarda la fase actual del juego (y su fecha límite, epoch en segundos). """
+        mapping = {'phase': phase}
+        if deadline is not None:
+            mapping['deadline'] = deadline
+        get_redis().hset(self.meta_key, mapping=mapping)
+
+    def advance(self):
+        """ Avanza a la siguiente pregunta y devuelve el nuevo índice. """
+        return get_redis().hincrby(self.meta_key, 'current_question_index', 1)
@@ -0,0 +1,123 @@
+import math
+import time
+import uuid
+import random
+import asyncio
+from collections import deque
+from types import SimpleNamespace
+from channels.layers import get_channel_layer
+from django.core.management.base import BaseCommand
+from api import game_runner
+from api.live_game import LiveGameStore
+from api.ai_evaluator import build_evaluator, set_evaluator
+from api.evaluation_batcher import evaluate_live_submission
+
+SOLUTION = "def doble(n):\n    resultado = n * 2\n    return resultado\n\nprint(doble(21))\n"
+
+
+def correct_code(i):
+    # Otro nombre de variable local: la normalización la deja igual a la solución
+    # (los parámetros no se renombran: se pueden pasar por nombre)
+    return f"def doble(n):\n    resultado_{i} = n * 2\n    return resultado_{i}\n\nprint(doble(21))\n"
+
+
+def wrong_code(i):
+    return f"def doble(n):\n    return n * 2 + {i + 1}\n\nprint(doble(21))\n"
+
+
+def percentile(values, p):
+    """ Percentil por rango más cercano (values no vacío). """
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class Command(BaseCommand):
+    help = (
+        "Reproduce N entregas sintéticas en un Desafío de Código en vivo y mide "
+        "la latencia de evaluación y de broadcast del ranking (p50/p95/p99)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--submissions', type=int, default=200,
+                            help="Cantidad de entregas sintéticas.")
+        parser.add_argument('--spread', type=float, default=2.0,
+                            help="Segundos en los que llegan todas las entregas.")
+        parser.add_argument('--correct-ratio', type=float, default=0.5,
+                            help="Fracción de entregas correctas.")
+        parser.add_argument('--backend', default='fake', choices=['fake', 'sandbox', 'gemini'],
+                            help="Backend de evaluación a medir.")
+        parser.add_argument('--latency', type=float, default=None,
+                            help="Latencia simulada del backend falso (segundos).")
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        backend = build_evaluator(options['backend'], latency=options['latency'])
+        set_evaluator(backend)
+        evaluation, broadcast = asyncio.run(self.replay(options))
+
+        label = backend.name + (f" (latencia {backend.latency}s)" if backend.name == 'fake' else "")
+        self.stdout.write(
+            f"Backend: {label} · {options['submissions']} entregas en {options['spread']}s · "
+            f"{len(broadcast)} broadcasts de ranking"
+        )
+        self.stdout.write(f"{'':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'máx':>10}")
+        for name, values in (('Evaluación', evaluation), ('Broadcast', broadcast)):
+            if not values:
+                self.stdout.write(f"{name:<12}{'-':>10}")
+                continue
+            row = [percentile(values, p) for p in (50, 95, 99)] + [max(values)]
+            self.stdout.write(f"{name:<12}" + "".join(f"{v * 1000:>8.1f}ms" for v in row))
+
+    async def replay(self, options):
+        channel_layer = get_channel_layer()
+        rng = random.Random(options['seed'])
+
+        # Sala y desafío de usar y tirar: la descripción única evita la caché de otras corridas
+        room = f"benchmark_{uuid.uuid4().hex[:8]}"
+        challenge = SimpleNamespace(id=0, description=f"Duplicar un número ({room})",
+                                    solution=SOLUTION, starter_code="def doble(n):\n    pass\n")
+        store = LiveGameStore(room)
+        store.start("code", "code_benchmark", [{'id': 0, 'description': challenge.description}])
+        store.set_phase('code', time.time() + game_runner.CODE_TIME)
+
+        # Un "alumno" escuchando la sala: mide cuándo le llega cada ranking
+        listener = await channel_layer.new_channel()
+        await channel_layer.group_add(room, listener)
+        sent, evaluation, broadcast = deque(), [], []
+
+        async def listen():
+            while True:
+                message = await channel_layer.receive(listener)
+                if message.get('type') == 'quiz_ranking_update' and sent:
+                    broadcast.append(time.perf_counter() - sent.popleft())
+
+        async def submit(i, code, delay):
+            await asyncio.sleep(delay)
+            start = time.perf_counter()
+            is_correct, _, _ = await evaluate_live_submission(challenge, code, [])
+            evaluation.append(time.perf_counter() - start)
+            added, _, _ = store.record_answer(0, i, f"alumno_{i}", is_correct, offset=0,
+                                               always_register=False, phase='code')
+            if added and is_correct:
+                sent.append(time.perf_counter())
+                await game_runner.broadcast_ranking(channel_layer, store)
+
+        listen_task = asyncio.create_task(listen())
+        try:
+            await asyncio.gather(*[
+                submit(
+                    i,
+                    correct_code(i) if rng.random() < options['correct_ratio'] else wrong_code(i),
+                    rng.uniform(0, options['spread']),
+                )
+                for i in range(options['submissions'])
+            ])
+            # Esperamos a que lleguen los últimos broadcasts (máx. 5 s)
+            deadline = time.perf_counter() + 5
+            while sent and time.perf_counter() < deadline:
+                await asyncio.sleep(0.01)
+        finally:
+            listen_task.cancel()
+            await channel_layer.group_discard(room, listener)
+            store.delete()
+        return evaluation, broadcast
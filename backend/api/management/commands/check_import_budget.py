@@ -0,0 +1,117 @@
+import os
+import sys
+import statistics
+import subprocess
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Módulos que solo se deben cargar al evaluar con Gemini (ver ai_evaluator.GeminiClient)
+HEAVY_MODULES = ('google.generativeai', 'grpc')
+
+# Lo que carga un worker de daphne: las URLs HTTP y las rutas de WebSocket
+DEFAULT_MODULES = ('api.urls', 'api.routing')
+
+# Línea base medida en local (mediana de 5 procesos, Python 3.11, con Gemini
+# cargado de forma diferida). El presupuesto deja un margen sobre ella: una
+# corrida varía ±5-10 % de una a otra y eso no debe romper la verificación.
+BASELINE_MS = 540
+BASELINE_RSS_MB = 93
+# Antes de la carga diferida (views.py y consumers.py importaban google.generativeai
+# al arrancar), medido igual. La salida compara contra estos números para
+# mostrar cuánto se ahorró.
+BEFORE_LAZY_MS = 1154
+BEFORE_LAZY_RSS_MB = 137
+BEFORE_LAZY_MODULES = 2018
+HEADROOM = 0.5  # +50 % de tiempo
+RSS_HEADROOM = 0.25  # +25 % de memoria
+
+
+def parse_importtime(stderr):
+    """ [(nombre, self_us, cumulative_us, nivel)] de la salida de 'python -X importtime'. """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        level = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), level))
+    return rows
+
+
+def change(now, before):
+    """ Diferencia relativa con la medición anterior, ej. '-53 %'. """
+    return f"{(now - before) / before:+.0%}".replace('%', ' %')
+
+
+class Command(BaseCommand):
+    help = (
+        "Arranca varios procesos nuevos con 'python -X importtime', carga Django y "
+        "los módulos de la app, y falla si la mediana supera el presupuesto de "
+        "tiempo o memoria (línea base + margen) o si carga módulos pesados "
+        "(google.generativeai/grpc) en el arranque."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5,
+                            help="Procesos a medir; se compara la mediana.")
+        parser.add_argument('--budget-ms', type=float, default=round(BASELINE_MS * (1 + HEADROOM)),
+                            help="Tiempo total de imports permitido (ms, mediana).")
+        parser.add_argument('--max-rss-mb', type=float, default=round(BASELINE_RSS_MB * (1 + RSS_HEADROOM)),
+                            help="Memoria máxima (RSS) permitida al terminar de importar (MB, mediana).")
+        parser.add_argument('--modules', nargs='+', default=list(DEFAULT_MODULES),
+                            help="Módulos a importar después de django.setup().")
+        parser.add_argument('--top', type=int, default=10,
+                            help="Cuántos imports de primer nivel mostrar (por tiempo acumulado).")
+
+    def measure(self, script):
+        """ Un proceso nuevo: (filas de importtime, RSS en MB). """
+        proc = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', script],
+            capture_output=True, text=True, cwd=settings.BASE_DIR,
+            env={**os.environ, 'DJANGO_SETTINGS_MODULE': settings.SETTINGS_MODULE},
+        )
+        if proc.returncode != 0:
+            raise CommandError(f"No se pudo importar la app:\n{proc.stderr[-2000:]}")
+        return parse_importtime(proc.stderr), int(proc.stdout.strip()) / 1024  # Linux: ru_maxrss en KB
+
+    def handle(self, *args, **options):
+        script = (
+            "import django; django.setup()\n"
+            + "".join(f"import {module}\n" for module in options['modules'])
+            + "import resource, sys; sys.stdout.write(str(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss))\n"
+        )
+        runs = [self.measure(script) for _ in range(max(1, options['runs']))]
+        times = [sum(self_us for _, self_us, _, _ in rows) / 1000 for rows, _ in runs]
+        total_ms = statistics.median(times)
+        rss_mb = statistics.median(rss for _, rss in runs)
+        # Para el detalle, la corrida más cercana a la mediana
+        rows = min(zip(times, (rows for rows, _ in runs)), key=lambda run: abs(run[0] - total_ms))[1]
+        loaded = {name for name, _, _, _ in rows}
+        heavy = [module for module in HEAVY_MODULES if module in loaded]
+
+        self.stdout.write(
+            f"Imports: {total_ms:.1f} ms (mediana de {len(runs)}; mín {min(times):.1f}, máx {max(times):.1f}) "
+            f"| antes de la carga diferida {BEFORE_LAZY_MS} ms ({change(total_ms, BEFORE_LAZY_MS)}) "
+            f"| línea base {BASELINE_MS} ms | presupuesto {options['budget_ms']:.0f} ms"
+        )
+        self.stdout.write(
+            f"Memoria: {rss_mb:.1f} MB | antes {BEFORE_LAZY_RSS_MB} MB ({change(rss_mb, BEFORE_LAZY_RSS_MB)}) "
+            f"| línea base {BASELINE_RSS_MB} MB | máximo {options['max_rss_mb']:.0f} MB"
+        )
+        self.stdout.write(
+            f"Módulos cargados: {len(loaded)} | antes {BEFORE_LAZY_MODULES} ({change(len(loaded), BEFORE_LAZY_MODULES)})"
+        )
+        top_level = sorted((r for r in rows if r[3] == 0), key=lambda r: r[2], reverse=True)
+        for name, _, cumulative_us, _ in top_level[:options['top']]:
+            self.stdout.write(f"  {cumulative_us / 1000:>8.1f} ms  {name}")
+
+        errors = []
+        if heavy:
+            errors.append(f"Se cargan en el arranque: {', '.join(heavy)} (deben cargarse al evaluar)")
+        if total_ms > options['budget_ms']:
+            errors.append(f"Los imports tardan {total_ms:.1f} ms (presupuesto {options['budget_ms']:.0f} ms)")
+        if rss_mb > options['max_rss_mb']:
+            errors.append(f"La memoria llega a {rss_mb:.1f} MB (máximo {options['max_rss_mb']:.0f} MB)")
+        if errors:
+            raise CommandError("\n".join(errors))
+        self.stdout.write(self.style.SUCCESS("Dentro del presupuesto de arranque."))
@@ -0,0 +1,34 @@
+import time
+from django.core.management.base import BaseCommand
+from api.live_game import get_redis, _decode
+from api.unread_counters import rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        "Recalcula desde la BD los contadores de no leídos de Redis de los "
+        "usuarios ya inicializados (corrige desvíos por escrituras fallidas)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=int, default=0,
+                            help="Si es > 0, repite cada N segundos en vez de una sola pasada.")
+
+    def handle(self, *args, **options):
+        while True:
+            start = time.perf_counter()
+            fixed = total = 0
+            for key in get_redis().scan_iter(match='unread_total:*', count=500):
+                user_id = int(_decode(key).split(':', 1)[1])
+                before = get_redis().get(key)
+                counts = rebuild(user_id)
+                total += 1
+                if before is None or int(before) != sum(counts.values()):
+                    fixed += 1
+            self.stdout.write(
+                f"[UNREAD] {total} usuarios revisados, {fixed} corregidos "
+                f"en {time.perf_counter() - start:.2f}s"
+            )
+            if options['interval'] <= 0:
+                break
+            time.sleep(options['interval'])
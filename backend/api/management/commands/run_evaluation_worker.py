@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from api.evaluation_jobs import EvaluationWorker
+
+
+class Command(BaseCommand):
+    help = "Ejecuta el worker de la cola de evaluaciones de Desafíos de Código."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Evaluaciones en paralelo (hilos).")
+        parser.add_argument('--poll-interval', type=float, default=0.2,
+                            help="Segundos que un hilo sin trabajo espera antes de volver a mirar la cola.")
+        parser.add_argument('--lease', type=int, default=None,
+                            help="Segundos sin noticias de un trabajo antes de reencolarlo (por defecto EVAL_JOB_LEASE).")
+
+    def handle(self, *args, **options):
+        EvaluationWorker(
+            concurrency=options['concurrency'],
+            poll_interval=options['poll_interval'],
+            lease=options['lease'],
+        ).run()
@@ -0,0 +1,20 @@
+import asyncio
+from django.core.management.base import BaseCommand
+from api.game_runner import GameRunner
+
+
+class Command(BaseCommand):
+    help = "Ejecuta el runner de juegos en vivo (Quiz y Desafíos de Código)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=0.2,
+                            help="Segundos entre lecturas de la agenda de Redis.")
+        parser.add_argument('--batch-size', type=int, default=100,
+                            help="Máximo de salas reclamadas por lectura.")
+
+    def handle(self, *args, **options):
+        runner = GameRunner(
+            poll_interval=options['poll_interval'],
+            batch_size=options['batch_size'],
+        )
+        asyncio.run(runner.run())
@@ -0,0 +1,158 @@
+# backend/api/message_ids.py
+import os
+import time
+import uuid
+import atexit
+import random
+import threading
+from datetime import datetime, timezone
+from django.conf import settings
+from .live_game import _script
+
+# ====================================================================
+# --- IDS DE MENSAJES ORDENADOS POR TIEMPO ---
+# ====================================================================
+# El id de un mensaje se genera en el servidor antes de guardarlo, así el
+# chat lo puede transmitir de inmediato y escribirlo después en lote.
+# Formato (53 bits, cabe exacto en un Number de JavaScript):
+#   milisegundos desde EPOCH_MS (40 bits) | proceso (5 bits) | secuencia (8 bits)
+# Ordenar por id es ordenar por momento de creación.
+# El número de proceso es un lease en Redis (message_id_worker:<n>), así
+# que crear un Message necesita Redis al menos una vez por lease.
+
+EPOCH_MS = 1704067200000  # 2024-01-01 UTC
+WORKER_BITS = 5
+SEQUENCE_BITS = 8
+WORKER_KEY = "message_id_worker"
+MAX_WORKERS = 1 << WORKER_BITS
+
+# KEYS: [] (las claves se arman con el prefijo: el número no se conoce de antemano)
+# ARGV: [prefijo, token, lease_ms, primer número a probar, MAX_WORKERS]
+# Toma el primer número libre (SET NX con vencimiento) y lo devuelve, o -1
+# si los MAX_WORKERS están ocupados.
+CLAIM_WORKER_LUA = """
+local total = tonumber(ARGV[5])
+for i = 0, total - 1 do
+    local worker = (tonumber(ARGV[4]) + i) % total
+    if redis.call('SET', ARGV[1] .. worker, ARGV[2], 'NX', 'PX', ARGV[3]) then
+        return worker
+    end
+end
+return -1
+"""
+
+# KEYS: [número]
+# ARGV: [token, lease_ms]
+# Renueva el lease solo si sigue siendo nuestro (nadie lo tomó al vencer).
+RENEW_WORKER_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS: [número]
+# ARGV: [token, gracia_ms]
+# Al salir no se borra: vence en unos segundos, por si el reloj del
+# próximo dueño va un poco atrasado respecto del nuestro.
+RELEASE_WORKER_LUA = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+RELEASE_GRACE_MS = 5000
+
+
+class WorkerIdUnavailable(Exception):
+    """ Los MAX_WORKERS números de proceso están tomados: no se pueden generar ids únicos. """
+
+
+_lock = threading.Lock()
+_worker = None
+_token = None
+_pid = None
+_renew_at = 0.0  # time.monotonic() en que hay que renovar el lease
+_last_ms = 0
+_sequence = 0
+
+
+def _lease_seconds():
+    return getattr(settings, 'MESSAGE_ID_WORKER_LEASE', 60)
+
+
+def _worker_key(worker):
+    return f"{WORKER_KEY}:{worker}"
+
+
+def _worker_id():
+    """
+    Número de este proceso (0..MAX_WORKERS-1), alquilado en Redis: dos
+    procesos vivos nunca tienen el mismo. Pasado un tercio del lease, el
+    próximo id lo renueva en Redis antes de usarlo; si venció (proceso
+    dormido) y otro lo tomó, se alquila otro número.
+    Solo habla con Redis al tomar o renovar el número, no en cada id.
+    """
+    global _worker, _token, _pid, _renew_at
+    now = time.monotonic()
+    if _pid != os.getpid():
+        _worker = None  # Proceso hijo (fork): el número es del padre
+    if _worker is not None and now < _renew_at:
+        return _worker
+
+    lease = _lease_seconds()
+    lease_ms = int(lease * 1000)
+    if _worker is not None and _script('renew_message_worker', RENEW_WORKER_LUA)(
+        keys=[_worker_key(_worker)], args=[_token, lease_ms]
+    ):
+        _renew_at = now + lease / 3
+        return _worker
+    if _worker is not None:
+        print(f"ADVERTENCIA: Se perdió el número de proceso {_worker} para ids de mensajes; se toma otro.")
+
+    token = uuid.uuid4().hex
+    worker = _script('claim_message_worker', CLAIM_WORKER_LUA)(
+        args=[f"{WORKER_KEY}:", token, lease_ms, random.randrange(MAX_WORKERS), MAX_WORKERS]
+    )
+    if worker < 0:
+        _worker = None
+        raise WorkerIdUnavailable(f"Hay {MAX_WORKERS} procesos generando ids de mensajes.")
+    if _pid is None:
+        atexit.register(_release_worker)
+    _worker, _token, _pid = worker, token, os.getpid()
+    _renew_at = now + lease / 3
+    return _worker
+
+
+def _release_worker():
+    # Al salir, el número queda libre sin esperar a que venza el lease entero
+    if _worker is not None and _pid == os.getpid():
+        try:
+            _script('release_message_worker', RELEASE_WORKER_LUA)(
+                keys=[_worker_key(_worker)], args=[_token, RELEASE_GRACE_MS]
+            )
+        except Exception:
+            pass
+
+
+def new_message_id():
+    global _last_ms, _sequence
+    with _lock:
+        worker = _worker_id()
+        now = max(int(time.time() * 1000) - EPOCH_MS, _last_ms)  # Si el reloj retrocede, seguimos
+        if now == _last_ms:
+            _sequence = (_sequence + 1) % (1 << SEQUENCE_BITS)
+            if _sequence == 0:
+                # 256 mensajes en el mismo milisegundo: esperamos al siguiente
+                while now <= _last_ms:
+                    now = int(time.time() * 1000) - EPOCH_MS
+        else:
+            _sequence = 0
+        _last_ms = now
+        return (now << (WORKER_BITS + SEQUENCE_BITS)) | (worker << SEQUENCE_BITS) | _sequence
+
+
+def message_id_datetime(message_id):
+    """ Momento de creación (UTC, con precisión de ms) codificado en el id. """
+    ms = (message_id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc)
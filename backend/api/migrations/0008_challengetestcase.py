@@ -0,0 +1,33 @@
+# Generated by Django 4.2.26 on 2026-10-18 20:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_quizattempt_live_points_quizattemptanswer'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChallengeTestCase',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('input_data', models.TextField(blank=True, default='', help_text='Lo que el programa recibe por stdin.')),
+                ('expected_output', models.TextField(help_text='Lo que el programa debe imprimir (se ignoran espacios al final).')),
+                ('is_hidden', models.BooleanField(default=True)),
+                ('order', models.PositiveIntegerField(default=0)),
+                ('challenge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='test_cases', to='api.codechallenge')),
+                ('live_challenge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='test_cases', to='api.livecodechallenge')),
+            ],
+            options={
+                'ordering': ['order'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='challengetestcase',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('challenge__isnull', False), ('live_challenge__isnull', True)), models.Q(('challenge__isnull', True), ('live_challenge__isnull', False)), _connector='OR'), name='testcase_belongs_to_one_challenge'),
+        ),
+    ]
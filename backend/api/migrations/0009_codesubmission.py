@@ -0,0 +1,43 @@
+# Generated by Django 4.2.26 on 2026-10-18 20:38
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_challengetestcase'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CodeSubmission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('code', models.TextField()),
+                ('is_correct', models.BooleanField(default=False)),
+                ('minhash', models.JSONField(default=list)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('challenge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='api.codechallenge')),
+                ('live_challenge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='submissions', to='api.livecodechallenge')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='code_submissions', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='CodeSubmissionBand',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.BigIntegerField(db_index=True)),
+                ('submission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='bands', to='api.codesubmission')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='codesubmission',
+            constraint=models.CheckConstraint(check=models.Q(models.Q(('challenge__isnull', False), ('live_challenge__isnull', True)), models.Q(('challenge__isnull', True), ('live_challenge__isnull', False)), _connector='OR'), name='submission_belongs_to_one_challenge'),
+        ),
+    ]
@@ -2,6 +2,7 @@ from django.contrib.auth.models import AbstractUser
 from django.db import models
 from django.conf import settings
 from django.utils import timezone
+from .message_ids import new_message_id
 
 # ====================================================================
 # 1. Modelo de Usuario
@@ -385,6 +386,12 @@ class QuizAttempt(models.Model):
         help_text="Puntaje obtenido (ej: 85.50)"
     )
     attempt_number = models.PositiveIntegerField()
+    # Solo para Quizzes en Vivo: puntos tipo Kahoot (rapidez + acierto)
+    live_points = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Puntos obtenidos en el Quiz en Vivo (si aplica)."
+    )
     date_taken = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -394,6 +401,31 @@ class QuizAttempt(models.Model):
 
     def __str__(self):
         return f'Intento {self.attempt_number} de {self.user.username} en {self.quiz.title}'
+
+# ====================================================================
+# 13.1 NUEVO MODELO: Respuesta de un Intento (QuizAttemptAnswer)
+# ====================================================================
+class QuizAttemptAnswer(models.Model):
+    """
+    La opción que eligió el alumno en una pregunta de un intento.
+    (Se llena en bloque al terminar un Quiz en Vivo.)
+    """
+    attempt = models.ForeignKey(QuizAttempt, on_delete=models.CASCADE, related_name='answers')
+    question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='attempt_answers')
+    choice = models.ForeignKey(
+        Choice,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='attempt_answers'
+    )
+    is_correct = models.BooleanField(default=False)
+
+    class Meta:
+        unique_together = ('attempt', 'question')
+
+    def __str__(self):
+        return f'Respuesta de {self.attempt} a la pregunta {self.question_id}'
     
 # ====================================================================
 # 14. NUEVO MODELO: Recurso (Resource)
@@ -528,6 +560,9 @@ class Message(models.Model):
         ('FILE', 'Archivo'),   # <-- ¡NUEVO! (Para PDFs, ZIPs, etc.)
     )
     
+    # Id generado en el servidor y ordenado por tiempo (message_ids.py): el chat
+    # transmite el mensaje con su id antes de guardarlo
+    id = models.BigIntegerField(primary_key=True, default=new_message_id, editable=False)
     conversation = models.ForeignKey(
         Conversation,
         on_delete=models.CASCADE,
@@ -574,10 +609,15 @@ class Message(models.Model):
         null=True, 
         help_text="Tamaño del archivo en bytes"
     )
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # (No auto_now_add: el chat fija la hora al transmitir y bulk_create la pisaría)
+    timestamp = models.DateTimeField(default=timezone.now, editable=False)
 
     class Meta:
         ordering = ['timestamp'] 
+        indexes = [
+            # Paginación por cursor del historial (MessageCursorPagination)
+            models.Index(fields=['conversation', 'timestamp', 'id'], name='message_conv_time_idx'),
+        ]
 
     def __str__(self):
         return f"Mensaje de {self.sender.username} ({self.timestamp.strftime('%Y-%m-%d %H:%M')})"
@@ -691,4 +731,113 @@ class LiveCodeChallenge(models.Model):
 
     def __str__(self):
         lesson_title = self.lesson.title if self.lesson else "Sin Lección Asignada"
-        return f'Desafío en Vivo: {self.title} (Lección: {lesson_title})'
\ No newline at end of file
+        return f'Desafío en Vivo: {self.title} (Lección: {lesson_title})'
+# ====================================================================
+# 22. NUEVO MODELO: Caso de Prueba de un Desafío (ChallengeTestCase)
+# ====================================================================
+class ChallengeTestCase(models.Model):
+    """
+    Una entrada y su salida esperada para un desafío de código.
+    El código del alumno se ejecuta en el sandbox local (code_runner.py)
+    con 'input_data' como stdin y su stdout se compara con 'expected_output'.
+    Pertenece a un CodeChallenge O a un LiveCodeChallenge.
+    """
+    challenge = models.ForeignKey(
+        CodeChallenge,
+        on_delete=models.CASCADE,
+        related_name='test_cases',
+        null=True,
+        blank=True
+    )
+    live_challenge = models.ForeignKey(
+        LiveCodeChallenge,
+        on_delete=models.CASCADE,
+        related_name='test_cases',
+        null=True,
+        blank=True
+    )
+    input_data = models.TextField(blank=True, default='', help_text="Lo que el programa recibe por stdin.")
+    expected_output = models.TextField(help_text="Lo que el programa debe imprimir (se ignoran espacios al final).")
+    # Los casos ocultos no muestran su entrada/salida al alumno
+    is_hidden = models.BooleanField(default=True)
+    order = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        ordering = ['order']
+        constraints = [
+            models.CheckConstraint(
+                check=(
+                    models.Q(challenge__isnull=False, live_challenge__isnull=True)
+                    | models.Q(challenge__isnull=True, live_challenge__isnull=False)
+                ),
+                name='testcase_belongs_to_one_challenge',
+            ),
+        ]
+
+    def __str__(self):
+        owner = self.challenge or self.live_challenge
+        return f'Caso {self.order} de {owner}'
+
+# ====================================================================
+# 23. NUEVO MODELO: Entrega de un Desafío de Código (CodeSubmission)
+# ====================================================================
+class CodeSubmission(models.Model):
+    """
+    Cada solución evaluada de un alumno (práctica o en vivo), con su firma
+    MinHash para detectar soluciones casi iguales (code_similarity.py).
+    Pertenece a un CodeChallenge O a un LiveCodeChallenge.
+    """
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='code_submissions'
+    )
+    challenge = models.ForeignKey(
+        CodeChallenge,
+        on_delete=models.CASCADE,
+        related_name='submissions',
+        null=True,
+        blank=True
+    )
+    live_challenge = models.ForeignKey(
+        LiveCodeChallenge,
+        on_delete=models.CASCADE,
+        related_name='submissions',
+        null=True,
+        blank=True
+    )
+    code = models.TextField()
+    is_correct = models.BooleanField(default=False)
+    # Lista de enteros (un mínimo por función de hash) sobre los shingles de tokens
+    minhash = models.JSONField(default=list)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        constraints = [
+            models.CheckConstraint(
+                check=(
+                    models.Q(challenge__isnull=False, live_challenge__isnull=True)
+                    | models.Q(challenge__isnull=True, live_challenge__isnull=False)
+                ),
+                name='submission_belongs_to_one_challenge',
+            ),
+        ]
+
+    def __str__(self):
+        return f'Entrega de {self.user} en {self.challenge or self.live_challenge}'
+
+# ====================================================================
+# 24. NUEVO MODELO: Cubeta LSH de una Entrega (CodeSubmissionBand)
+# ====================================================================
+class CodeSubmissionBand(models.Model):
+    """
+    Índice LSH: una fila por banda de la firma MinHash. Dos entregas del
+    mismo desafío que comparten una cubeta son candidatas a casi-duplicado.
+    """
+    submission = models.ForeignKey(CodeSubmission, on_delete=models.CASCADE, related_name='bands')
+    # Hash de (desafío, número de banda, valores de la banda)
+    bucket = models.BigIntegerField(db_index=True)
+
+    def __str__(self):
+        return f'Cubeta {self.bucket} de la entrega {self.submission_id}'
@@ -14,5 +14,10 @@ websocket_urlpatterns = [
         r'^ws/chat/conversation/(?P<conversation_id>\d+)/$', 
         consumers.InboxConsumer.as_asgi() # <-- Usará un nuevo Consumidor
     ),
-    # (En el futuro, aquí pondríamos más rutas, como la de gamificación)
+    # Un solo socket por usuario con suscripciones a lecciones,
+    # conversaciones y notificaciones (ver consumers.UserConsumer)
+    re_path(
+        r'^ws/user/$',
+        consumers.UserConsumer.as_asgi()
+    ),
 ]
\ No newline at end of file
@@ -1,6 +1,7 @@
 # backend/api/serializers.py
 
 from rest_framework import serializers
+from .conversation_members import participant_summaries
 from .models import (
     User, 
     Course, 
@@ -440,11 +441,36 @@ class SimpleMessageSerializer(serializers.ModelSerializer):
 # ====================================================================
 # ACTUALIZADO: Serializer de Lista de Conversaciones (para el sidebar)
 # ====================================================================
+class ParticipantPreviewSerializer(serializers.ModelSerializer):
+    """ Lo justo para un avatar del inbox. """
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'profile_image']
+
+
+class ConversationSummaryListSerializer(serializers.ListSerializer):
+    """
+    Calcula los resúmenes de participantes de toda la página en una sola
+    consulta (conversation_members.py) antes de serializar cada fila.
+    """
+    def to_representation(self, data):
+        conversations = list(data.all() if hasattr(data, 'all') else data)
+        request = self.context.get('request')
+        self.context['participant_summaries'] = participant_summaries(
+            [c.id for c in conversations], request.user.id if request else None
+        )
+        return super().to_representation(conversations)
+
+
 class ConversationListSerializer(serializers.ModelSerializer):
-    participants = UserSerializer(many=True, read_only=True)
+    # Cuántos son y hasta 3 avatares (en un DM, el otro); la lista completa
+    # está en ConversationParticipantListView
+    participant_count = serializers.SerializerMethodField()
+    participants_preview = serializers.SerializerMethodField()
 
+    # No leídos: contadores de Redis que la vista pasa en el contexto (unread_counters.py)
+    unread_count = serializers.SerializerMethodField()
     # Leemos los campos anotados por la vista (agregados con annotate en views)
-    unread_count = serializers.IntegerField(read_only=True)
     last_msg_content = serializers.CharField(read_only=True, default=None, required=False, allow_null=True)
     last_msg_type = serializers.CharField(read_only=True, default=None, required=False, allow_null=True)
     last_msg_file_name = serializers.CharField(read_only=True, default=None, required=False, allow_null=True)
@@ -459,7 +485,8 @@ class ConversationListSerializer(serializers.ModelSerializer):
             'id',
             'name',
             'is_group',
-            'participants',
+            'participant_count',
+            'participants_preview',
             'unread_count',
             'last_msg_content',       # ✅ agregado
             'last_msg_type',          # ✅ agregado
@@ -467,6 +494,29 @@ class ConversationListSerializer(serializers.ModelSerializer):
             'last_message_timestamp',
             'last_message_snippet',   # ✅ lo mantenemos
         ]
+        list_serializer_class = ConversationSummaryListSerializer
+
+    def _participant_summary(self, obj):
+        summaries = self.context.setdefault('participant_summaries', {})
+        if obj.id not in summaries:
+            # Serializando una sola conversación (p. ej. StartDirectMessageView)
+            request = self.context.get('request')
+            summaries.update(participant_summaries([obj.id], request.user.id if request else None))
+        return summaries[obj.id]
+
+    def get_participant_count(self, obj):
+        return self._participant_summary(obj)[0]
+
+    def get_participants_preview(self, obj):
+        return ParticipantPreviewSerializer(
+            self._participant_summary(obj)[1], many=True, context=self.context
+        ).data
+
+    def get_unread_count(self, obj):
+        counts = self.context.get('unread_counts')
+        if counts is None:
+            return getattr(obj, 'unread_count', 0)
+        return counts.get(obj.id, 0)
 
     # --- Método que construye el snippet, igual que en React ---
     def get_last_message_snippet(self, obj):
@@ -1,7 +1,9 @@
 # backend/api/signals.py
+from django.db import transaction
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from .models import Enrollment, Conversation, Course, User, Lesson,Message
+from .unread_counters import count_new_messages
 
 @receiver(post_save, sender=Enrollment)
 def add_user_to_course_chat(sender, instance, created, **kwargs):
@@ -96,6 +98,8 @@ def update_conversation_last_message(sender, instance, created, **kwargs):
     """
     Cuando se crea un nuevo Mensaje,
     actualiza el campo 'last_message' en su Conversación.
+    (Los mensajes del chat en vivo se guardan con bulk_create, que no dispara
+    este signal: chat_writer.save_messages lo actualiza una vez por lote.)
     """
     if created:
         try:
@@ -103,4 +107,20 @@ def update_conversation_last_message(sender, instance, created, **kwargs):
             last_message=instance,
             )
         except Exception as e:
-            print(f"Error en el signal update_conversation_last_message: {e}")
\ No newline at end of file
+            print(f"Error en el signal update_conversation_last_message: {e}")
+
+@receiver(post_save, sender=Message)
+def count_unread_message(sender, instance, created, **kwargs):
+    """
+    Suma el mensaje nuevo a los contadores de no leídos de los demás
+    participantes (los del chat en vivo los suma chat_writer por lote).
+    Recién al confirmar la transacción: con ATOMIC_REQUESTS, un mensaje que
+    se revierte no debe quedar contado.
+    """
+    if created:
+        def count():
+            try:
+                count_new_messages([instance])
+            except Exception as e:
+                print(f"Error en el signal count_unread_message: {e}")
+        transaction.on_commit(count)
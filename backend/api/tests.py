@@ -1,3 +1,1255 @@
-from django.test import TestCase
+import asyncio
+import json
+import os
+import sys
+import time
+import unittest
+from io import StringIO
+from types import SimpleNamespace
+from unittest.mock import patch
+import fakeredis
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+from . import ai_evaluator, evaluation_jobs, game_runner, live_game, message_ids, unread_counters
+from .chat_writer import MessageIdCollision, message_writer, save_messages
+from .consumers import ChatConsumer, UserConsumer
+from .conversation_members import PREVIEW_SIZE, participant_summaries
+from .code_precheck import precheck_code
+from .code_runner import SandboxPool
+from .code_similarity import record_submission, sign_pending
+from .evaluation_batcher import CodeEvaluationBatcher
+from .evaluation_cache import evaluation_cache, evaluation_key, normalize_code
+from .live_game import LiveGameStore
+from .models import (
+    ChallengeTestCase, Choice, CodeChallenge, CodeSubmission, Conversation, Course, Enrollment, Lesson, LiveCodeChallenge, Message, Module,
+    Question, Quiz, QuizAttempt, QuizAttemptAnswer, User,
+)
+from .routing import websocket_urlpatterns
 
-# Create your tests here.
+
+# ====================================================================
+# 1. Sandbox de los desafíos de código (code_runner.py)
+# ====================================================================
+
+@override_settings(CODE_RUNNER_USER='')
+class SandboxEscapeTests(SimpleTestCase):
+    """
+    El audit hook tiene que aguantar solo (sin bajar de usuario): cada
+    intento de escape termina en error y nunca en 'ok' con datos de afuera.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.pool = SandboxPool(size=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.pool.close()
+        super().tearDownClass()
+
+    def run_code(self, code, input_data=''):
+        return self.pool.run(code, input_data, time_limit=5)
+
+    def assertBlocked(self, code):
+        result = self.run_code(code)
+        self.assertEqual(result['status'], 'error', result)
+        self.assertNotIn('root:', result['stdout'])
+        return result
+
+    def test_normal_program_runs(self):
+        result = self.run_code("from collections import namedtuple\nprint(sum(map(int, input().split())))", '1 2')
+        self.assertEqual(result, {'status': 'ok', 'stdout': '3\n', 'error': ''})
+
+    def test_rebinding_harness_globals_does_not_disable_the_hook(self):
+        rebind = (
+            "import sys\n"
+            "main = sys.modules['__main__']\n"
+            "main.BLOCKED = ('zzzz',)\n"
+            "main.READABLE = ('/',)\n"
+        )
+        self.assertBlocked(rebind + "import socket\nsocket.socket()")
+        self.assertBlocked(rebind + "print(open('/etc/passwd').read())")
+        self.assertBlocked(rebind + "import os\nprint(os.listdir('/'))")
+
+    def test_student_main_module_is_fresh(self):
+        result = self.run_code("import sys\nprint(sorted(k for k in vars(sys.modules['__main__']) if not k.startswith('__')))")
+        self.assertEqual(result['stdout'], "['sys']\n")
+
+    def test_patching_builtins_and_os_path_does_not_open_files(self):
+        self.assertBlocked("import builtins\nbuiltins.any = lambda *a: True\nbuiltins.isinstance = lambda *a: True\nprint(open('/etc/passwd').read())")
+        self.assertBlocked("import os, posixpath\nposixpath.realpath = lambda p, **k: '/usr'\nos.fsdecode = lambda p: '/usr'\nprint(open('/etc/passwd').read())")
+
+    def test_path_tricks_are_blocked(self):
+        self.assertBlocked("import sysconfig\nprint(open(sysconfig.get_path('stdlib') + '/../../../../etc/passwd').read())")
+        self.assertBlocked("class P:\n    def __fspath__(self):\n        return '/etc/passwd'\nprint(open(P()).read())")
+        self.assertBlocked("import os\nprint(open('/proc/%d/environ' % os.getppid()).read())")
+
+    def test_routes_to_the_hook_are_blocked(self):
+        self.assertBlocked("import gc\ngc.get_objects()")
+        self.assertBlocked("import sys\nsys.settrace(lambda *a: None)")
+        self.assertBlocked("import ctypes")
+
+    def test_frames_do_not_reach_the_harness(self):
+        result = self.run_code("import sys\nf = sys._getframe()\nwhile f.f_back:\n    f = f.f_back\nprint(sorted(f.f_locals))")
+        self.assertEqual(result['status'], 'ok')
+        self.assertNotIn('job', result['stdout'])
+
+    def test_forged_result_is_rejected(self):
+        result = self.run_code("import os\nos.write(1, b'{\"status\": \"ok\", \"stdout\": \"3\", \"error\": \"\"}')\nos._exit(0)")
+        self.assertNotEqual(result['status'], 'ok')
+
+
+def _world_executable(path):
+    # Todos los directorios hasta el intérprete tienen que ser accesibles para 'nobody'
+    path = os.path.realpath(path)
+    while path != '/':
+        path = os.path.dirname(path)
+        if not os.stat(path).st_mode & 0o001:
+            return False
+    return True
+
+
+@unittest.skipUnless(
+    hasattr(os, 'geteuid') and os.geteuid() == 0 and _world_executable(sys.executable),
+    "Solo corriendo como root con un intérprete accesible para 'nobody'",
+)
+@override_settings(CODE_RUNNER_USER='nobody')
+class SandboxPrivilegeTests(SimpleTestCase):
+
+    def test_runs_as_unprivileged_user_without_new_threads(self):
+        pool = SandboxPool(size=1)
+        try:
+            self.assertNotEqual(pool.run("import os\nprint(os.getuid())")['stdout'], '0\n')
+            self.assertEqual(pool.run("import threading\nthreading.Thread(target=print).start()")['status'], 'error')
+        finally:
+            pool.close()
+
+
+# ====================================================================
+# 2. Claves de la caché de evaluaciones (evaluation_cache.py)
+# ====================================================================
+
+class EvaluationKeyTests(SimpleTestCase):
+
+    def key(self, code):
+        return evaluation_key('practice', 1, 'v1', code)
+
+    def test_formatting_comments_and_variable_names_share_a_key(self):
+        a = "total = 0\nfor v in range(3):\n    total += v\nprint(total)\n"
+        b = "# suma\ns=0\nfor i in range(3):\n  s+=i   # acumula\nprint(s)"
+        self.assertEqual(self.key(a), self.key(b))
+
+    def test_semantically_different_programs_get_different_keys(self):
+        pairs = [
+            # Argumentos por nombre
+            ("sep = '-'\nprint(1, 2, sep=sep)", "end = '-'\nprint(1, 2, end=end)"),
+            # Parámetros (se pueden pasar por nombre)
+            ("def f(a):\n    return a\nprint(f(a=1))", "def f(b):\n    return b\nprint(f(a=1))"),
+            # Atributos de clase
+            ("class C:\n    x = 1\nprint(C.x)", "class C:\n    y = 1\nprint(C.x)"),
+            # Acceso por nombre en texto
+            ("x = 1\nprint(globals()['x'])", "y = 1\nprint(globals()['x'])"),
+            # Capturas de match
+            ("x = 0\nmatch 1:\n    case x:\n        print(x)", "z = 0\nmatch 1:\n    case x:\n        print(z)"),
+            # Nombres que ya parecen renombrados
+            ("x = 1\nprint(_v0)", "x = 1\nprint(x)"),
+            # global
+            ("def g():\n    global x\n    x = 1\ng()\nprint(x)", "def g():\n    global y\n    x = 1\ng()\nprint(y)"),
+        ]
+        for a, b in pairs:
+            with self.subTest(a=a):
+                self.assertNotEqual(self.key(a), self.key(b))
+
+    def test_uncompilable_code_compares_as_text(self):
+        self.assertEqual(normalize_code("print(  \n"), normalize_code("print(\n"))
+        self.assertNotEqual(normalize_code("print(1"), normalize_code("print(2"))
+
+
+# Sin Redis de verdad para Channels ni para la caché (django_redis sobre fakeredis:
+# los consumers usan cache.sadd/srem para la presencia)
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+LOCAL_CACHE = {'default': {
+    'BACKEND': 'django_redis.cache.RedisCache',
+    'LOCATION': 'redis://fakeredis:6379/0',
+    'OPTIONS': {
+        'CLIENT_CLASS': 'django_redis.client.DefaultClient',
+        'CONNECTION_POOL_KWARGS': {'connection_class': fakeredis.FakeConnection},
+    },
+}}
+
+
+def clear_evaluation_caches():
+    """ Veredictos guardados por otras pruebas: el LRU del proceso y la caché compartida. """
+    evaluation_cache._entries.clear()
+    cache.clear()
+
+
+class FakeRedisMixin:
+    """ Redis en memoria para live_game / evaluation_jobs (los scripts Lua incluidos). """
+
+    def setUp(self):
+        super().setUp()
+        self.redis = fakeredis.FakeRedis()
+        for target in ('api.live_game.get_redis_connection', 'api.evaluation_cache.get_redis_connection'):
+            patcher = patch(target, return_value=self.redis)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        # Los scripts registrados quedan atados al cliente con el que se crearon
+        live_game._scripts.clear()
+        self.addCleanup(live_game._scripts.clear)
+
+
+# ====================================================================
+# 3. Cola de evaluaciones (evaluation_jobs.py)
+# ====================================================================
+
+class EvaluationQueueTests(FakeRedisMixin, SimpleTestCase):
+
+    def test_high_priority_is_claimed_first(self):
+        normal, _, _ = evaluation_jobs.enqueue(1, 7, 'print(1)')
+        evaluation_jobs.enqueue(2, 7, 'print(2)')
+        evaluation_jobs.enqueue(1, 7, 'print(3)')  # reintento -> normal
+        high = self.redis.lindex(evaluation_jobs.QUEUE_KEYS['high'], 1).decode()
+        self.assertEqual(evaluation_jobs.claim_job(60), normal)
+        self.assertEqual(evaluation_jobs.claim_job(60), high)
+
+    def test_job_of_a_dead_worker_is_requeued(self):
+        job_id, _, _ = evaluation_jobs.enqueue(1, 7, 'print(1)')
+        self.assertEqual(evaluation_jobs.claim_job(lease=-1), job_id)  # el worker "muere" sin release
+        self.assertIsNone(evaluation_jobs.claim_job(60))
+
+        self.assertEqual(evaluation_jobs.requeue_expired(), ([job_id], []))
+        self.assertEqual(evaluation_jobs.get_job(job_id)['status'], 'queued')
+        self.assertEqual(evaluation_jobs.claim_job(60), job_id)
+        evaluation_jobs.release_job(job_id)
+        self.assertEqual(self.redis.llen(evaluation_jobs.PROCESSING_KEY), 0)
+        self.assertEqual(evaluation_jobs.requeue_expired(), ([], []))
+
+    @override_settings(EVAL_JOB_MAX_RETRIES=1)
+    def test_job_that_keeps_killing_the_worker_fails(self):
+        job_id, _, _ = evaluation_jobs.enqueue(1, 7, 'print(1)')
+        for expected in (([job_id], []), ([], [job_id])):
+            evaluation_jobs.claim_job(lease=-1)
+            self.assertEqual(evaluation_jobs.requeue_expired(), expected)
+        self.assertEqual(evaluation_jobs.get_job(job_id)['status'], 'error')
+        self.assertIsNone(evaluation_jobs.claim_job(60))
+
+    def test_finished_job_is_not_requeued(self):
+        job_id, _, _ = evaluation_jobs.enqueue(1, 7, 'print(1)')
+        evaluation_jobs.claim_job(lease=-1)
+        evaluation_jobs._finish(job_id, 'done', result={})
+        self.assertEqual(evaluation_jobs.requeue_expired(), ([], []))
+        self.assertEqual(self.redis.zcard(evaluation_jobs.LEASES_KEY), 0)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, CACHES=LOCAL_CACHE)
+class EvaluationJobTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        clear_evaluation_caches()
+        self.ana = User.objects.create(username='ana')
+        course = Course.objects.create(title='Python', description='', professor=User.objects.create(username='profe'))
+        lesson = Lesson.objects.create(module=Module.objects.create(course=course, title='M1'), title='L1')
+        self.challenge = CodeChallenge.objects.create(
+            lesson=lesson, title='Hola', description='', starter_code='', solution="print('hola')",
+        )
+        previous = ai_evaluator._evaluator
+        ai_evaluator.set_evaluator(ai_evaluator.FakeBackend(latency=0))
+        self.addCleanup(ai_evaluator.set_evaluator, previous)
+
+    def test_requeued_job_does_not_award_twice(self):
+        job_id, _, _ = evaluation_jobs.enqueue(self.ana.id, self.challenge.id, "print('hola')")
+        evaluation_jobs.claim_job(lease=-1)
+        evaluation_jobs.process_job(job_id)
+        # El lease venció antes del release: otro worker lo vuelve a evaluar
+        self.redis.hset(evaluation_jobs.job_key(job_id), 'status', 'running')
+        self.assertEqual(evaluation_jobs.requeue_expired(), ([job_id], []))
+        self.assertEqual(evaluation_jobs.claim_job(60), job_id)
+        evaluation_jobs.process_job(job_id, lease=60)
+
+        self.ana.refresh_from_db()
+        self.assertEqual(self.ana.experience_points, evaluation_jobs.POINTS_PER_CHALLENGE)
+        self.assertEqual(CodeSubmission.objects.filter(user=self.ana).count(), 1)
+        job = evaluation_jobs.get_job(job_id)
+        self.assertEqual(job['status'], 'done')
+        self.assertEqual(job['result']['points_awarded'], evaluation_jobs.POINTS_PER_CHALLENGE)
+
+    def test_review_streams_cumulative_text_with_increasing_seq(self):
+        sent = []
+
+        class Layer:
+            async def group_send(self, group, message):
+                sent.append((group, message['type'], message['data']))
+
+        job_id, _, _ = evaluation_jobs.enqueue(self.ana.id, self.challenge.id, "print('hola')")
+        with patch('api.evaluation_jobs.get_channel_layer', return_value=Layer()):
+            evaluation_jobs.process_job(job_id)
+
+        group = f'user_{self.ana.id}_notifications'
+        chunks = [data for g, kind, data in sent if g == group and kind == 'challenge_review_chunk']
+        self.assertGreater(len(chunks), 1)
+        self.assertEqual([c['seq'] for c in chunks], list(range(1, len(chunks) + 1)))
+        # Cada trozo trae todo el texto hasta ahí: perder uno no deja huecos
+        for before, after in zip(chunks, chunks[1:]):
+            self.assertTrue(after['text'].startswith(before['text']))
+        self.assertIn('VEREDICTO: CORRECTO', chunks[-1]['text'])
+        self.assertEqual(self.redis.hget(evaluation_jobs.job_key(job_id), 'partial_review').decode(), chunks[-1]['text'])
+        # El resultado sale después del último trozo
+        self.assertEqual(sent[-1][1], 'challenge_evaluation_result')
+        self.assertEqual(sent[-1][2]['status'], 'done')
+
+    def test_lease_is_renewed_without_streamed_chunks(self):
+        ChallengeTestCase.objects.create(challenge=self.challenge, input_data='', expected_output='hola')
+        job_id, _, _ = evaluation_jobs.enqueue(self.ana.id, self.challenge.id, "print('hola')")
+        evaluation_jobs.claim_job(lease=-1)
+        with patch('api.evaluation_jobs.run_test_cases', return_value={'passed': 1, 'total': 1, 'is_correct': True}), \
+             patch.object(ai_evaluator.FakeBackend, 'stream_review', return_value=iter(())):
+            evaluation_jobs.process_job(job_id, lease=60)
+        # Sin trozos de la IA, el sandbox y la caché igual renovaron el lease
+        self.assertGreater(self.redis.zscore(evaluation_jobs.LEASES_KEY, job_id), time.time())
+
+
+# ====================================================================
+# 4. Juegos en vivo (live_game.py)
+# ====================================================================
+
+class RecordAnswerGuardTests(FakeRedisMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.game = LiveGameStore('test_room')
+        questions = [
+            {'id': 11, 'choices': [{'id': 1}, {'id': 2}]},
+            {'id': 12, 'choices': [{'id': 3}, {'id': 4}]},
+        ]
+        self.game.start('quiz', 5, questions, [[1], [3]])
+        self.game.set_phase('question', time.time() + 15)
+
+    def answer(self, index=0, user_id=1, **kwargs):
+        kwargs.setdefault('question_id', 11 if index == 0 else 12)
+        kwargs.setdefault('choice_id', 1 if index == 0 else 3)
+        added, _, _ = self.game.record_answer(index, user_id, 'ana', True, **kwargs)
+        return added
+
+    def test_answer_in_time_counts_once(self):
+        self.assertTrue(self.answer())
+        self.assertFalse(self.answer())
+        self.assertEqual(self.game.histogram(0), {'1': 1})
+
+    def test_answer_outside_the_question_phase_is_rejected(self):
+        self.game.set_phase('stats')
+        self.assertFalse(self.answer())
+        self.assertEqual(self.game.player_count(), 0)
+
+    def test_answer_after_the_deadline_is_rejected(self):
+        self.assertFalse(self.answer(now=time.time() + 16))
+        self.assertEqual(self.game.answered_count(0), 0)
+
+    def test_answer_for_another_question_is_rejected(self):
+        self.assertFalse(self.answer(question_id=12))
+        self.game.advance()
+        self.assertFalse(self.answer(index=0))  # índice viejo
+        self.assertTrue(self.answer(index=1))
+
+    def test_answer_with_a_choice_of_another_question_is_rejected(self):
+        for choice_id in (3, 'abc', 99):
+            self.assertFalse(self.game.record_answer(0, 1, 'ana', False, choice_id=choice_id, question_id=11)[0])
+        self.assertEqual(self.game.histogram(0), {})
+
+    @patch('api.game_runner.HISTOGRAM_MAX_RATE', 20)
+    def test_histogram_is_coalesced_and_sent_only_when_it_changes(self):
+        sent = []
+
+        class Layer:
+            async def group_send(self, group, message):
+                sent.append((group, message['data']['counts'], time.monotonic()))
+
+        async def scenario():
+            deadline = time.time() + 2
+            stream = asyncio.create_task(game_runner.stream_histogram(Layer(), self.game, 0, deadline))
+            for user_id in (1, 2, 3):  # una ráfaga dentro del mismo intervalo
+                self.answer(user_id=user_id)
+            await asyncio.sleep(0.2)  # sin respuestas nuevas: nada que enviar
+            self.answer(user_id=4, choice_id=2)
+            await asyncio.sleep(0.1)
+            self.game.set_phase('stats')  # la pregunta se cerró antes del plazo
+            await asyncio.wait_for(stream, 1)
+
+        async_to_sync(scenario)()
+        self.assertEqual([(group, counts) for group, counts, _ in sent], [
+            ('test_room_professor', {'1': 3}),
+            ('test_room_professor', {'1': 3, '2': 1}),
+        ])
+        self.assertGreaterEqual(sent[1][2] - sent[0][2], 1 / 20)
+
+    def test_answer_to_a_finished_or_missing_game_is_rejected(self):
+        self.game.claim_finish()
+        self.assertFalse(self.answer())
+        self.game.delete()
+        self.assertFalse(self.answer())
+        self.assertFalse(self.redis.exists(self.game.meta_key))
+
+    def test_ranking_update_sends_only_the_rows_that_changed(self):
+        self.assertEqual(self.game.ranking_update()['data'], {'mode': 'full', 'version': 1, 'ranking': [], 'is_final': False})
+        self.assertTrue(self.answer(user_id=1))
+        self.assertTrue(self.answer(user_id=2))
+        update = self.game.ranking_update()['data']
+        self.assertEqual(update['changes'], [
+            {'user_id': 1, 'username': 'ana', 'score': 1000, 'rank': 1},
+            {'user_id': 2, 'username': 'ana', 'score': 950, 'rank': 2},
+        ])
+        self.assertEqual((update['version'], update['base_version']), (2, 1))
+        self.assertEqual(self.game.ranking_update()['data']['changes'], [])
+        self.assertEqual(json.loads(self.redis.get(self.game.last_top_key)), self.game.top())
+
+    def test_ranking_update_carries_every_players_rank(self):
+        self.assertTrue(self.answer(user_id=1))
+        self.assertTrue(self.answer(user_id=2))
+        update = self.game.ranking_update(n=1)
+        self.assertEqual([row['user_id'] for row in update['top']], [1])
+        self.assertEqual(update['ranks'], {'1': {'rank': 1, 'score': 1000}, '2': {'rank': 2, 'score': 950}})
+        self.assertEqual(update['ranks'], self.game.ranks())
+
+    def test_sockets_pick_their_rank_without_redis(self):
+        self.assertTrue(self.answer(user_id=1))
+        first = self.game.ranking_update()
+        self.assertTrue(self.answer(index=0, user_id=2))
+        second = self.game.ranking_update()
+
+        consumer = ChatConsumer()
+        consumer.user, consumer.ranking_version, consumer.game_over = User(id=2, role='STUDENT'), None, False
+        sent = []
+
+        async def send(text_data):
+            sent.append(json.loads(text_data))
+        consumer.send = send
+        with patch('api.live_game.get_redis_connection', side_effect=AssertionError('Redis desde el socket')):
+            async_to_sync(consumer.quiz_ranking_update)({'type': 'quiz_ranking_update', **first})
+            async_to_sync(consumer.quiz_ranking_update)({'type': 'quiz_ranking_update', **second})
+        self.assertEqual(sent[0]['data']['me'], None)
+        self.assertEqual(sent[1]['data']['mode'], 'delta')
+        self.assertEqual(sent[1]['data']['me'], {'rank': 2, 'score': 950})
+        self.assertNotIn('ranks', sent[1])
+
+    def test_ranking_update_after_the_end_does_not_recreate_the_game(self):
+        self.assertTrue(self.answer())
+        self.assertEqual(self.game.ranking_update()['data']['version'], 1)
+        self.game.claim_finish()
+        self.assertIsNone(self.game.ranking_update())
+        self.game.delete()
+        self.assertIsNone(self.game.ranking_update())
+        self.assertFalse(self.redis.exists(self.game.meta_key))
+
+    def test_code_result_that_arrives_after_the_end_is_dropped(self):
+        code = LiveGameStore('test_code_room')
+        code.start('code', 'code_1', [{'id': 1}])
+        code.set_phase('code', time.time() + 300)
+        received_at = time.time()
+        # ...la evaluación tarda y mientras tanto el juego se cierra
+        code.claim_finish()
+        code.expire()
+        added, _, _ = code.record_answer(0, 1, 'ana', True, offset=0, always_register=False,
+                                         phase='code', now=received_at)
+        self.assertFalse(added)
+        self.assertIsNone(code.ranking_update())
+        self.assertTrue(0 < self.redis.ttl(code.meta_key) <= live_game.FINISHED_TTL)
+
+    def test_answers_do_not_extend_the_game(self):
+        self.redis.expire(self.game.meta_key, 30)
+        self.assertTrue(self.answer())
+        for key in (self.game.answered_key(0), self.game.leaderboard_key, self.game.histogram_key(0)):
+            self.assertTrue(0 < self.redis.ttl(key) <= 30, key)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, CACHES=LOCAL_CACHE)
+class LiveGameSnapshotTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.professor = User.objects.create(username='profe', role='PROFESSOR')
+        self.ana = User.objects.create(username='ana')
+        course = Course.objects.create(title='Python', description='', professor=self.professor)
+        self.lesson = Lesson.objects.create(module=Module.objects.create(course=course, title='M1'), title='L1')
+        Enrollment.objects.create(user=self.ana, course=course)
+        self.game = LiveGameStore(f'chat_lesson_{self.lesson.id}')
+        self.questions = [
+            {'id': 11, 'text': '¿Uno?', 'choices': [{'id': 1}, {'id': 2}]},
+            {'id': 12, 'text': '¿Dos?', 'choices': [{'id': 3}, {'id': 4}]},
+        ]
+
+    def first_message(self, user):
+        async def scenario():
+            socket = WebsocketCommunicator(URLRouter(websocket_urlpatterns), f'/ws/chat/lesson/{self.lesson.id}/')
+            socket.scope['user'] = user
+            connected, _ = await socket.connect()
+            self.assertTrue(connected)
+            message = await socket.receive_json_from() if not await socket.receive_nothing(0.2) else None
+            await socket.disconnect()
+            return message
+        return async_to_sync(scenario)()
+
+    def test_socket_joining_mid_question_gets_one_snapshot(self):
+        self.game.start('quiz', 5, self.questions, [[1], [3]])
+        self.game.advance()
+        deadline = time.time() + 10
+        self.game.set_phase('question', deadline)
+        self.game.record_answer(1, self.ana.id, 'ana', True, choice_id=3, question_id=12)
+
+        message = self.first_message(self.ana)
+        self.assertEqual(message['type'], 'quiz_snapshot')
+        snapshot = message['data']
+        self.assertEqual(
+            {k: snapshot[k] for k in ('game_type', 'phase', 'question_index', 'question_number', 'total_questions', 'timer')},
+            {'game_type': 'quiz', 'phase': 'question', 'question_index': 1, 'question_number': 2,
+             'total_questions': 2, 'timer': game_runner.QUESTION_TIME},
+        )
+        self.assertAlmostEqual(snapshot['deadline'], deadline, places=3)
+        self.assertLessEqual(snapshot['now'], deadline)
+        self.assertEqual(snapshot['questions'], self.questions)
+        self.assertEqual(snapshot['me']['rank'], 1)
+        self.assertTrue(snapshot['answered'])
+
+    def test_professor_snapshot_has_no_player_fields(self):
+        self.game.start('quiz', 5, self.questions, [[1], [3]])
+        self.game.set_phase('ranking')
+        snapshot = self.first_message(self.professor)['data']
+        self.assertEqual((snapshot['phase'], snapshot['deadline'], snapshot['timer']), ('ranking', None, None))
+        self.assertNotIn('me', snapshot)
+        self.assertNotIn('answered', snapshot)
+
+    def test_no_game_no_snapshot(self):
+        self.assertIsNone(self.first_message(self.ana))
+
+
+class SaveQuizResultsTests(TestCase):
+
+    def test_invalid_answers_are_skipped_without_losing_attempts(self):
+        quiz = Quiz.objects.create(title='Vivo', quiz_type='LIVE')
+        question = Question.objects.create(quiz=quiz, text='¿2 + 2?')
+        right = Choice.objects.create(question=question, text='4', is_correct=True)
+        other = Question.objects.create(quiz=quiz, text='¿3 + 3?')
+        foreign = Choice.objects.create(question=other, text='6', is_correct=True)
+        ana = User.objects.create(username='ana')
+        beto = User.objects.create(username='beto')
+
+        results = {
+            'scores': {ana.id: 1000, beto.id: 0},
+            'rounds': [{
+                'question_id': question.id,
+                'correct_ids': {right.id},
+                # beto: opción de otra pregunta; ninguna de las dos puede romper el guardado
+                'choices': {ana.id: right.id, beto.id: foreign.id},
+            }],
+        }
+        self.assertEqual(async_to_sync(game_runner.save_quiz_results)(quiz.id, results), 2)
+        self.assertEqual(QuizAttempt.objects.filter(quiz=quiz).count(), 2)
+        self.assertEqual(list(QuizAttemptAnswer.objects.values_list('attempt__user', 'choice')), [(ana.id, right.id)])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS)
+class GameRunnerTests(FakeRedisMixin, TestCase):
+
+    ROOM = 'chat_lesson_1'
+
+    def schedule_at(self, **rooms):
+        self.redis.zadd(game_runner.SCHEDULE_KEY, rooms)
+
+    def test_claim_due_takes_the_most_overdue_rooms_first(self):
+        self.schedule_at(b=90, a=80, c=95, later=200)
+        rooms, lease_until = game_runner.claim_due(limit=2, now=100)
+        self.assertEqual(rooms, ['a', 'b'])
+        self.assertEqual(lease_until, 100 + game_runner.LEASE_SECONDS)
+        self.assertEqual(game_runner.claim_due(now=100)[0], ['c'])
+        # Reclamadas: nadie más las toma hasta que vence el alquiler
+        self.assertEqual(game_runner.claim_due(now=101)[0], [])
+        self.assertEqual(game_runner.claim_due(now=lease_until + 1)[0], ['a', 'b', 'c'])
+
+    def test_lease_is_renewed_only_while_the_room_is_ours(self):
+        self.schedule_at(**{self.ROOM: 0})
+        _, lease_until = game_runner.claim_due(now=100)
+        renewed = game_runner.renew_lease(self.ROOM, lease_until, now=120)
+        self.assertEqual(renewed, 120 + game_runner.LEASE_SECONDS)
+        self.assertIsNone(game_runner.renew_lease(self.ROOM, lease_until, now=121))  # ya no es ese alquiler
+        game_runner.schedule(self.ROOM, 5)  # el paso reprogramó la sala
+        self.assertIsNone(game_runner.renew_lease(self.ROOM, renewed, now=122))
+        self.assertLess(self.redis.zscore(game_runner.SCHEDULE_KEY, self.ROOM), time.time() + 6)
+
+    @patch('api.game_runner.LEASE_RENEW_EVERY', 0.02)
+    def test_slow_step_keeps_its_room(self):
+        LiveGameStore(self.ROOM).start('quiz', 1, [{'id': 1}], phase='question')
+        self.schedule_at(**{self.ROOM: 0})
+        # Un alquiler que vence a los 50 ms, y un paso que tarda 200 ms
+        rooms, lease_until = game_runner.claim_due(now=time.time() - game_runner.LEASE_SECONDS + 0.05)
+        stolen = []
+
+        async def slow_step(channel_layer, store, meta):
+            await asyncio.sleep(0.2)
+            stolen.extend(game_runner.claim_due()[0])
+            game_runner.schedule(store.room_group_name, 60)
+
+        with patch.dict(game_runner.PHASE_HANDLERS, {'question': slow_step}):
+            async_to_sync(game_runner.GameRunner().step)(self.ROOM, lease_until)
+        self.assertEqual(rooms, [self.ROOM])
+        self.assertEqual(stolen, [])
+        self.assertGreater(self.redis.zscore(game_runner.SCHEDULE_KEY, self.ROOM), time.time() + 50)
+
+    def test_step_walks_the_quiz_phases(self):
+        store = LiveGameStore(self.ROOM)
+        store.start('quiz', 1, [{'id': 1, 'choices': [{'id': 1}]}, {'id': 2, 'choices': [{'id': 2}]}], [[1], [2]])
+        runner = game_runner.GameRunner()
+        steps = []
+
+        async def walk():
+            layer = runner.channel_layer
+            channel = await layer.new_channel()
+            await layer.group_add(self.ROOM, channel)
+            for _ in range(6):
+                await runner.step(self.ROOM)
+                meta = store.get_meta()
+                events = []
+                while True:
+                    try:
+                        events.append((await asyncio.wait_for(layer.receive(channel), 0.05))['type'])
+                    except asyncio.TimeoutError:
+                        break
+                steps.append((meta and (meta['phase'], meta['current_question_index']), events))
+
+        with patch('api.game_runner.stream_histogram', new=lambda *args: asyncio.sleep(0)):
+            async_to_sync(walk)()
+        self.assertEqual(steps, [
+            (('question', 0), ['quiz_question']),
+            (('stats', 0), ['quiz_stats_update']),
+            (('ranking', 0), ['quiz_ranking_update']),
+            (('get_ready', 1), ['quiz_get_ready']),
+            (('question', 1), ['quiz_question']),
+            (('stats', 1), ['quiz_stats_update']),
+        ])
+        due = self.redis.zscore(game_runner.SCHEDULE_KEY, self.ROOM)
+        self.assertAlmostEqual(due, time.time() + game_runner.STATS_TIME, delta=1)
+
+        # Después del ranking de la última pregunta: resultados finales y fuera de la agenda
+        async def finish():
+            layer = runner.channel_layer
+            channel = await layer.new_channel()
+            await layer.group_add(self.ROOM, channel)
+            await runner.step(self.ROOM)
+            await runner.step(self.ROOM)
+            return [(await layer.receive(channel))['type'] for _ in range(2)]
+
+        self.assertEqual(async_to_sync(finish)(), ['quiz_ranking_update', 'quiz_final_results'])
+        self.assertIsNone(store.get_meta())
+        self.assertIsNone(self.redis.zscore(game_runner.SCHEDULE_KEY, self.ROOM))
+
+
+class AwardPointsTests(TestCase):
+
+    def setUp(self):
+        self.ana = User.objects.create(username='ana', experience_points=10)
+        self.beto = User.objects.create(username='beto')
+
+    def test_points_of_a_repeated_user_are_merged_in_one_update(self):
+        # UPDATE ... CASE y la lectura de los totales (más el savepoint de transaction.atomic)
+        with self.assertNumQueries(4):
+            awarded = async_to_sync(game_runner.award_points)(
+                [(self.ana.id, 15), (self.beto.id, 10), (str(self.ana.id), 5), (999_999, 50)]
+            )
+        self.assertEqual(sorted(awarded, key=lambda a: a['user_id']), [
+            {'user_id': self.ana.id, 'username': 'ana', 'points': 20, 'total_xp': 30},
+            {'user_id': self.beto.id, 'username': 'beto', 'points': 10, 'total_xp': 10},
+        ])
+        # El id desconocido no rompe nada ni aparece en el resultado
+        self.assertEqual(dict(User.objects.values_list('username', 'experience_points')), {'ana': 30, 'beto': 10})
+
+    def test_nothing_to_award_makes_no_query(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(async_to_sync(game_runner.award_points)([]), [])
+            self.assertEqual(async_to_sync(game_runner.award_points)([(self.ana.id, 0)]), [])
+
+
+# ====================================================================
+# 5. Ids de los mensajes del chat (message_ids.py / chat_writer.py)
+# ====================================================================
+
+class MessageIdTests(FakeRedisMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        state = ('_worker', '_token', '_pid', '_renew_at')
+        saved = {name: getattr(message_ids, name) for name in state}
+        self.addCleanup(lambda: [setattr(message_ids, k, v) for k, v in saved.items()])
+        message_ids._worker = None
+
+    def worker_of_process(self, pid):
+        with patch('api.message_ids.os.getpid', return_value=pid):
+            return message_ids._worker_id()
+
+    def test_live_processes_never_share_a_worker_number(self):
+        workers = [self.worker_of_process(1000 + i) for i in range(message_ids.MAX_WORKERS)]
+        self.assertEqual(sorted(workers), list(range(message_ids.MAX_WORKERS)))
+        # Antes, el número 33 volvía a ser el 1 (INCR % 32); ahora no hay número libre
+        with self.assertRaises(message_ids.WorkerIdUnavailable):
+            self.worker_of_process(2000)
+
+    def test_worker_number_is_renewed_and_replaced_if_lost(self):
+        worker = self.worker_of_process(1000)
+        self.assertEqual(self.worker_of_process(1000), worker)
+        # El lease venció mientras el proceso dormía y otro tomó el número
+        self.redis.set(message_ids._worker_key(worker), 'otro')
+        message_ids._renew_at = 0
+        self.assertNotEqual(self.worker_of_process(1000), worker)
+
+    def test_ids_are_unique_and_increasing(self):
+        with patch('api.message_ids.os.getpid', return_value=1000):
+            ids = [message_ids.new_message_id() for _ in range(2000)]
+        self.assertEqual(len(set(ids)), len(ids))
+        self.assertEqual(ids, sorted(ids))
+
+
+class SaveMessagesTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ana = User.objects.create(username='ana')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.ana)
+
+    def message(self, message_id, content):
+        return Message(id=message_id, conversation=self.conversation, sender=self.ana,
+                       message_type='TEXT', content=content,
+                       timestamp=message_ids.message_id_datetime(message_id))
+
+    def test_retried_batch_does_not_duplicate(self):
+        save_messages([self.message(10_000_000, 'hola')])
+        save_messages([self.message(10_000_000, 'hola')])
+        self.assertEqual(Message.objects.count(), 1)
+
+    def test_colliding_id_fails_loudly_and_keeps_the_original(self):
+        save_messages([self.message(10_000_000, 'hola')])
+        with self.assertRaises(MessageIdCollision) as raised:
+            save_messages([self.message(10_000_000, 'otro mensaje'), self.message(10_000_001, 'chau')])
+        self.assertEqual(raised.exception.message_ids, [10_000_000])
+        # Nunca se guarda con un id distinto del que ya recibieron los clientes
+        self.assertEqual(dict(Message.objects.values_list('id', 'content')), {10_000_000: 'hola', 10_000_001: 'chau'})
+        self.conversation.refresh_from_db()
+        self.assertEqual(self.conversation.last_message_id, 10_000_001)
+
+
+# ====================================================================
+# 6. Pre-chequeo de las entregas (code_precheck.py)
+# ====================================================================
+
+@override_settings(CODE_MAX_LINES=3)
+class PrecheckLineLimitTests(SimpleTestCase):
+
+    def test_exactly_max_lines_is_allowed(self):
+        for code in ("a = 1\nb = 2\nprint(a + b)", "a = 1\nb = 2\nprint(a + b)\n"):
+            self.assertIsNone(precheck_code(code))
+        self.assertEqual(precheck_code("a = 1\nb = 2\nc = 3\nprint(a)")['reason'], 'too_large')
+
+
+# ====================================================================
+# 7. Soluciones casi iguales (code_similarity.py)
+# ====================================================================
+
+class SimilarityTests(FakeRedisMixin, TestCase):
+
+    CODE = "n = int(input())\nfor i in range(n):\n    print(i * 2)\n"
+
+    def setUp(self):
+        super().setUp()
+        self.professor = User.objects.create(username='profe', role='PROFESSOR')
+        self.other_professor = User.objects.create(username='otro', role='PROFESSOR')
+        course = Course.objects.create(title='Python', description='', professor=self.professor)
+        lesson = Lesson.objects.create(module=Module.objects.create(course=course, title='M1'), title='L1')
+        self.challenge = CodeChallenge.objects.create(lesson=lesson, title='Doble', description='', starter_code='', solution='')
+        self.live = LiveCodeChallenge.objects.create(lesson=lesson, title='Doble', description='', solution='')
+        self.ana = User.objects.create(username='ana')
+        self.beto = User.objects.create(username='beto')
+        self.client = APIClient()
+
+    def get(self, user, name, **kwargs):
+        self.client.force_authenticate(user)
+        return self.client.get(reverse(name, kwargs=kwargs))
+
+    def test_only_the_course_professor_sees_the_reports(self):
+        submission = record_submission(self.ana.id, self.CODE, True, challenge_id=self.challenge.id)
+        self.assertEqual(self.get(self.professor, 'challenge_similarity_report', challenge_id=self.challenge.id).status_code, 200)
+        self.assertEqual(self.get(self.other_professor, 'challenge_similarity_report', challenge_id=self.challenge.id).status_code, 403)
+        self.assertEqual(self.get(self.other_professor, 'live_challenge_similarity_report', challenge_id=self.live.id).status_code, 403)
+        self.assertEqual(self.get(self.other_professor, 'similar_code_submissions', submission_id=submission.id).status_code, 404)
+        self.assertEqual(self.get(self.ana, 'similar_code_submissions', submission_id=submission.id).status_code, 403)
+
+    def test_live_signatures_are_computed_by_the_worker(self):
+        first = record_submission(self.ana.id, self.CODE, True, live_challenge_id=self.live.id, defer_signature=True)
+        second = record_submission(self.beto.id, self.CODE, True, live_challenge_id=self.live.id, defer_signature=True)
+        self.assertEqual(first.minhash, [])
+        self.assertTrue(self.get(self.professor, 'similar_code_submissions', submission_id=first.id).data['pending'])
+
+        self.assertEqual(sign_pending(), 2)
+        self.assertEqual(sign_pending(), 0)
+        response = self.get(self.professor, 'similar_code_submissions', submission_id=first.id)
+        self.assertFalse(response.data['pending'])
+        self.assertEqual([m['id'] for m in response.data['similar']], [second.id])
+
+
+# ====================================================================
+# 8. Inbox: historial paginado y no leídos (views.py / unread_counters.py)
+# ====================================================================
+
+class ParticipantSummaryTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.users = [User.objects.create(username=f'u{i:02d}') for i in range(7)]
+        self.me = self.users[0]
+        self.course_chat = Conversation.objects.create(name='Python', is_group=True)
+        self.course_chat.participants.add(*self.users)
+        self.dm = Conversation.objects.create()
+        self.dm.participants.add(self.me, self.users[5])
+        self.client = APIClient()
+        self.client.force_authenticate(self.me)
+
+    def test_summaries_of_a_whole_page_take_one_query(self):
+        with self.assertNumQueries(1):
+            summaries = participant_summaries([self.course_chat.id, self.dm.id], self.me.id)
+        total, preview = summaries[self.course_chat.id]
+        self.assertEqual(total, 7)
+        # Hasta PREVIEW_SIZE, sin el usuario actual
+        self.assertEqual([u.id for u in preview], [u.id for u in self.users[1:1 + PREVIEW_SIZE]])
+        total, preview = summaries[self.dm.id]
+        self.assertEqual((total, [u.id for u in preview]), (2, [self.users[5].id]))
+
+    def test_inbox_sends_count_and_preview_instead_of_every_participant(self):
+        [chat] = self.client.get(reverse('group-chat-list')).json()
+        self.assertEqual(chat['participant_count'], 7)
+        self.assertEqual([p['username'] for p in chat['participants_preview']], ['u01', 'u02', 'u03'])
+        self.assertNotIn('participants', chat)
+
+    def test_full_member_list_is_paginated_for_members_only(self):
+        url = reverse('conversation-participants', kwargs={'conversation_id': self.course_chat.id})
+        first = self.client.get(url + '?page_size=4').json()
+        self.assertEqual(first['count'], 7)
+        self.assertEqual([u['username'] for u in first['results']], ['u00', 'u01', 'u02', 'u03'])
+        second = self.client.get(first['next']).json()
+        self.assertEqual([u['username'] for u in second['results']], ['u04', 'u05', 'u06'])
+        self.assertIsNone(second['next'])
+
+        outsider = APIClient()
+        outsider.force_authenticate(User.objects.create(username='otro'))
+        self.assertEqual(outsider.get(url).status_code, 403)
+
+
+class MessageCursorPaginationTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ana = User.objects.create(username='ana')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.ana)
+        # Todos en el mismo instante: el orden y el cursor dependen del id
+        now = timezone.now()
+        self.ids = [
+            Message.objects.create(id=10_000 + i, conversation=self.conversation, sender=self.ana,
+                                   message_type='TEXT', content=f'm{i}', timestamp=now).id
+            for i in range(7)
+        ]
+        self.client = APIClient()
+        self.client.force_authenticate(self.ana)
+
+    def walk(self, url, direction):
+        seen = []
+        while url:
+            data = self.client.get(url).json()
+            seen.append([m['id'] for m in data['results']])
+            url = data[direction]
+        return seen
+
+    def test_pages_over_equal_timestamps_skip_and_repeat_nothing(self):
+        url = reverse('message-list-create', kwargs={'conversation_id': self.conversation.id}) + '?page_size=3'
+        pages = self.walk(url, 'next')
+        self.assertEqual(pages, [[10_006, 10_005, 10_004], [10_003, 10_002, 10_001], [10_000]])
+
+        # Y de vuelta hacia los más nuevos desde la última página
+        oldest = self.client.get(url).json()
+        oldest = self.client.get(self.client.get(oldest['next']).json()['next']).json()
+        self.assertEqual(self.walk(oldest['previous'], 'previous'), [[10_003, 10_002, 10_001], [10_006, 10_005, 10_004]])
+
+
+class UnreadCounterTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.ana = User.objects.create(username='ana')
+        self.beto = User.objects.create(username='beto')
+        self.conversation = Conversation.objects.create()
+        self.conversation.participants.add(self.ana, self.beto)
+
+    def send(self, sender, n=1):
+        # Los contadores se actualizan al confirmar la transacción (on_commit)
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(n):
+                Message.objects.create(conversation=self.conversation, sender=sender, message_type='TEXT', content=str(i))
+
+    def test_counters_follow_new_messages_and_reads(self):
+        self.assertEqual(unread_counters.get_unread_total(self.beto.id), 0)  # lo inicializa desde la BD
+        self.send(self.ana, 3)
+        self.send(self.beto)
+        self.assertEqual(unread_counters.get_unread_counts(self.beto.id), {self.conversation.id: 3})
+        self.assertEqual(unread_counters.get_unread_total(self.beto.id), 3)
+
+        client = APIClient()
+        client.force_authenticate(self.beto)
+        client.post(reverse('mark-as-read', kwargs={'conversation_id': self.conversation.id}))
+        self.assertEqual(client.get(reverse('unread-total')).json(), {'total': 0})
+
+    def test_rolled_back_message_is_not_counted(self):
+        unread_counters.get_unread_total(self.beto.id)
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    Message.objects.create(conversation=self.conversation, sender=self.ana, message_type='TEXT', content='x')
+                    raise RuntimeError('la vista falla después de guardar')
+            except RuntimeError:
+                pass
+        self.assertEqual(unread_counters.get_unread_total(self.beto.id), 0)
+        self.send(self.ana)
+        self.assertEqual(unread_counters.get_unread_total(self.beto.id), 1)
+
+    def test_reconcile_fixes_counters_that_drifted(self):
+        unread_counters.get_unread_total(self.beto.id)
+        self.send(self.ana, 2)
+        # Un incremento que se perdió y un total desfasado
+        self.redis.hset(unread_counters.counts_key(self.beto.id), self.conversation.id, 1)
+        self.redis.set(unread_counters.total_key(self.beto.id), 7)
+
+        out = StringIO()
+        call_command('reconcile_unread_counters', stdout=out)
+        self.assertIn('1 usuarios revisados, 1 corregidos', out.getvalue())
+        self.assertEqual(unread_counters.get_unread_counts(self.beto.id), {self.conversation.id: 2})
+        self.assertEqual(unread_counters.get_unread_total(self.beto.id), 2)
+
+
+# ====================================================================
+# 9. Socket único por usuario (consumers.UserConsumer / TopicSession)
+# ====================================================================
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, CACHES=LOCAL_CACHE)
+class UserSocketTests(FakeRedisMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+        self.ana = User.objects.create(username='ana')
+        self.beto = User.objects.create(username='beto')
+        course = Course.objects.create(title='Python', description='', professor=User.objects.create(username='profe', role='PROFESSOR'))
+        self.lesson = Lesson.objects.create(module=Module.objects.create(course=course, title='M1'), title='L1')
+        Enrollment.objects.create(user=self.ana, course=course)
+        self.dm = Conversation.objects.create()
+        self.dm.participants.add(self.ana, self.beto)
+        self.foreign = Conversation.objects.create()
+        self.foreign.participants.add(self.beto)
+
+    async def connect(self, user):
+        socket = WebsocketCommunicator(UserConsumer.as_asgi(), '/ws/user/')
+        socket.scope['user'] = user
+        connected, _ = await socket.connect()
+        self.assertTrue(connected)
+        return socket
+
+    async def expect(self, socket, **fields):
+        """ El próximo mensaje que tenga esos campos (los eventos de presencia, etc. se saltean). """
+        while True:
+            message = await socket.receive_json_from(timeout=2)
+            if all(message.get(k) == v for k, v in fields.items()):
+                return message
+
+    async def subscribe(self, socket, topic):
+        await socket.send_json_to({'action': 'subscribe', 'topic': topic})
+        return (await self.expect(socket, topic=topic))['status']
+
+    def test_subscribes_to_lessons_and_own_conversations_only(self):
+        async def scenario():
+            ana = await self.connect(self.ana)
+            statuses = [
+                await self.subscribe(ana, f'lesson:{self.lesson.id}'),
+                await self.subscribe(ana, f'conversation:{self.dm.id}'),
+                await self.subscribe(ana, f'conversation:{self.foreign.id}'),
+                await self.subscribe(ana, 'grupo:1'),
+            ]
+            await ana.disconnect()
+            return statuses
+
+        self.assertEqual(async_to_sync(scenario)(), ['subscribed', 'subscribed', 'rejected', 'error'])
+
+    def test_text_through_a_topic_is_broadcast_and_saved(self):
+        lesson = f'lesson:{self.lesson.id}'
+
+        async def scenario():
+            ana = await self.connect(self.ana)
+            await self.subscribe(ana, lesson)
+            await ana.send_json_to({'action': 'send', 'topic': lesson, 'data': {'message_type': 'TEXT', 'content': 'hola'}})
+            while True:
+                event = (await self.expect(ana, topic=lesson))['event']
+                if event['type'] == 'chat_message':
+                    break
+            await message_writer.flush()
+            await ana.disconnect()
+            return event['message']
+
+        message = async_to_sync(scenario)()
+        self.assertEqual(message['content'], 'hola')
+        saved = Message.objects.get(id=message['id'])
+        self.assertEqual((saved.content, saved.sender), ('hola', self.ana))
+        self.assertEqual(saved.conversation, Lesson.objects.get(id=self.lesson.id).chat_conversation)
+
+    def test_typing_is_relayed_to_the_other_participant(self):
+        dm = f'conversation:{self.dm.id}'
+
+        async def scenario():
+            ana, beto = await self.connect(self.ana), await self.connect(self.beto)
+            await self.subscribe(ana, dm)
+            await self.subscribe(beto, dm)
+            await ana.send_json_to({'action': 'send', 'topic': dm, 'data': {'type': 'typing', 'is_typing': True}})
+            typing = await self.expect(beto, topic=dm)
+            await ana.disconnect()
+            await beto.disconnect()
+            return typing
+
+        self.assertEqual(async_to_sync(scenario)(), {
+            'topic': dm, 'event': {'type': 'typing_event', 'user': 'ana', 'is_typing': True},
+        })
+
+    def test_unsubscribe_and_disconnect_leave_every_group(self):
+        lesson, dm = f'lesson:{self.lesson.id}', f'conversation:{self.dm.id}'
+        lesson_group = f'chat_lesson_{self.lesson.id}'
+        layer = get_channel_layer()
+
+        async def scenario():
+            ana = await self.connect(self.ana)
+            await self.subscribe(ana, lesson)
+            await self.subscribe(ana, dm)
+            await ana.send_json_to({'action': 'unsubscribe', 'topic': lesson})
+            unsubscribed = (await self.expect(ana, topic=lesson, status='unsubscribed'))['status']
+            await ana.send_json_to({'action': 'send', 'topic': lesson, 'data': {'message_type': 'TEXT', 'content': 'x'}})
+            after = (await self.expect(ana, topic=lesson))['status']
+            # El consumer interno deja el grupo al procesar su desconexión
+            for _ in range(50):
+                if not layer.groups.get(lesson_group):
+                    break
+                await asyncio.sleep(0.01)
+            lesson_members = len(layer.groups.get(lesson_group, {}))
+            await ana.disconnect()
+            return unsubscribed, after, lesson_members
+
+        self.assertEqual(async_to_sync(scenario)(), ('unsubscribed', 'error', 0))
+        # Al cerrar el socket se desconectan los temas que quedaban
+        self.assertFalse(any(layer.groups.values()))
+        self.assertEqual(cache.smembers(f'connected_users_{lesson_group}'), set())
+        self.assertFalse(Message.objects.exists())
+
+
+# ====================================================================
+# 10. Evaluación con IA: lotes, backends y cliente (evaluation_batcher.py / ai_evaluator.py)
+# ====================================================================
+
+class RecordingBackend(ai_evaluator.EvaluatorBackend):
+    """ Anota cada lote que recibe; correcto si el código imprime 'ok'. """
+    name = 'recording'
+
+    def __init__(self):
+        self.batches = []
+
+    async def evaluate_batch(self, challenge, codes):
+        self.batches.append(list(codes))
+        return [{'is_correct': "'ok'" in code} for code in codes]
+
+
+@override_settings(CACHES=LOCAL_CACHE)
+class CodeEvaluationBatcherTests(FakeRedisMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        clear_evaluation_caches()
+        self.backend = RecordingBackend()
+        previous = ai_evaluator._evaluator
+        ai_evaluator.set_evaluator(self.backend)
+        self.addCleanup(ai_evaluator.set_evaluator, previous)
+
+    def submit(self, batcher, codes):
+        async def scenario():
+            started = time.monotonic()
+            verdicts = await asyncio.gather(*[
+                batcher.evaluate(1, 'v1', None, evaluation_key('live', 1, 'v1', code), code) for code in codes
+            ])
+            return verdicts, time.monotonic() - started
+        return async_to_sync(scenario)()
+
+    def test_full_batch_goes_out_without_waiting_for_the_window(self):
+        batcher = CodeEvaluationBatcher(window=10, max_batch=3)
+        codes = ["print('ok')", "print('no')", "# igual\nprint( 'ok' )"]
+        verdicts, elapsed = self.submit(batcher, codes)
+        self.assertLess(elapsed, 1)
+        self.assertEqual([v['is_correct'] for v in verdicts], [True, False, True])
+        # Una llamada; las dos entregas equivalentes se evalúan una sola vez
+        self.assertEqual(self.backend.batches, [["print('ok')", "print('no')"]])
+
+    def test_partial_batch_goes_out_when_the_window_closes(self):
+        batcher = CodeEvaluationBatcher(window=0.1, max_batch=16)
+        verdicts, elapsed = self.submit(batcher, ["print('ok')", "print('no')"])
+        self.assertGreaterEqual(elapsed, 0.1)
+        self.assertEqual([v['is_correct'] for v in verdicts], [True, False])
+        self.assertEqual(len(self.backend.batches), 1)
+
+    def test_failed_batch_answers_incorrect_to_everyone(self):
+        async def broken(challenge, codes):
+            raise ai_evaluator.AIEvaluationError('sin respuesta')
+        self.backend.evaluate_batch = broken
+        verdicts, _ = self.submit(CodeEvaluationBatcher(window=0.01), ["print('ok')"])
+        self.assertEqual(verdicts, [{'is_correct': False}])
+
+
+class EvaluatorBackendTests(SimpleTestCase):
+
+    CHALLENGE = SimpleNamespace(id=1, description='Imprimir 42', solution='print(40 + 2)')
+
+    def test_backend_is_chosen_by_name_or_setting(self):
+        with patch('api.ai_evaluator.GeminiClient') as client:
+            with override_settings(AI_EVAL_BACKEND='gemini', AI_EVAL_MAX_CONCURRENCY=3, AI_EVAL_TIMEOUT=7):
+                self.assertIsInstance(ai_evaluator.build_evaluator(), ai_evaluator.GeminiBackend)
+            client.assert_called_once_with(max_concurrency=3, timeout=7)
+        self.assertIsInstance(ai_evaluator.build_evaluator('sandbox'), ai_evaluator.SandboxBackend)
+        with override_settings(AI_EVAL_FAKE_LATENCY=0.3):
+            self.assertEqual(ai_evaluator.build_evaluator('fake').latency, 0.3)
+            self.assertEqual(ai_evaluator.build_evaluator('fake', latency=0).latency, 0)
+        with self.assertRaises(ValueError):
+            ai_evaluator.build_evaluator('otro')
+
+    def test_fake_backend_is_deterministic(self):
+        backend = ai_evaluator.FakeBackend(latency=0)
+        codes = ['# igual\nprint(40+2)', 'print(42)']
+        verdicts = async_to_sync(backend.evaluate_batch)(self.CHALLENGE, codes)
+        self.assertEqual(verdicts, [{'is_correct': True}, {'is_correct': False}])
+        review = evaluation_jobs.parse_review(''.join(backend.stream_review(self.CHALLENGE, codes[1])))
+        self.assertFalse(review['is_correct'])
+        self.assertEqual(review['code_review'], 'print(42)')
+
+    @override_settings(CODE_RUNNER_USER='')
+    def test_sandbox_backend_compares_outputs_with_the_solution(self):
+        pool = SandboxPool(size=1)
+        self.addCleanup(pool.close)
+        backend = ai_evaluator.SandboxBackend()
+        with patch('api.ai_evaluator.get_pool', return_value=pool):
+            verdicts = async_to_sync(backend.evaluate_batch)(self.CHALLENGE, ['print(42)', 'print(41)', 'print(1/0)'])
+            review = evaluation_jobs.parse_review(''.join(backend.stream_review(self.CHALLENGE, 'print(1/0)')))
+        self.assertEqual([v['is_correct'] for v in verdicts], [True, False, False])
+        self.assertFalse(review['is_correct'])
+        self.assertIn('error', review['feedback'])
+
+
+class FakeGenAI:
+    """ Sustituto de google.generativeai: cada llamada tarda 'delay' y anota la concurrencia. """
+
+    def __init__(self, delay=0.0, chunks=('a', 'b'), stall_after=None):
+        self.delay, self.chunks, self.stall_after = delay, chunks, stall_after
+        self.active = self.peak = 0
+        genai = self
+
+        class GenerativeModel:
+            def __init__(self, model_name):
+                self.model_name = model_name
+
+            async def generate_content_async(self, prompt, stream=False):
+                if stream:
+                    return genai.stream()
+                genai.active += 1
+                genai.peak = max(genai.peak, genai.active)
+                try:
+                    await asyncio.sleep(genai.delay)
+                finally:
+                    genai.active -= 1
+                return SimpleNamespace(text=f'{self.model_name}: {prompt}')
+
+        self.GenerativeModel = GenerativeModel
+
+    def configure(self, api_key):
+        pass
+
+    async def stream(self):
+        for i, chunk in enumerate(self.chunks):
+            if i == self.stall_after:
+                await asyncio.sleep(60)
+            yield SimpleNamespace(text=chunk)
+
+
+class GeminiClientTests(SimpleTestCase):
+
+    def gemini(self, genai, **kwargs):
+        with patch.dict(sys.modules, {'google.generativeai': genai}):
+            client = ai_evaluator.GeminiClient(**kwargs)
+        self.addCleanup(self.stop, client._loop)
+        return client
+
+    def stop(self, loop):
+        """ Cancela lo que quedó pendiente (un stream trabado) y detiene el loop del cliente. """
+        async def cancel_pending():
+            pending = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        asyncio.run_coroutine_threadsafe(cancel_pending(), loop).result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+
+    def test_semaphore_bounds_concurrent_calls(self):
+        genai = FakeGenAI(delay=0.05)
+        client = self.gemini(genai, max_concurrency=2, timeout=5)
+
+        async def burst():
+            return await asyncio.gather(*[client.generate(str(i), 'm') for i in range(6)])
+
+        self.assertEqual(async_to_sync(burst)(), [f'm: {i}' for i in range(6)])
+        self.assertEqual(genai.peak, 2)
+
+    def test_slow_call_times_out(self):
+        client = self.gemini(FakeGenAI(delay=1), timeout=0.05)
+        with self.assertRaisesMessage(ai_evaluator.AIEvaluationError, 'no respondió en 0.05s'):
+            async_to_sync(client.generate)('hola')
+
+    def test_stream_yields_chunks_and_times_out_when_it_stalls(self):
+        self.assertEqual(list(self.gemini(FakeGenAI(), timeout=1).stream_sync('hola')), ['a', 'b'])
+        chunks = []
+        with self.assertRaisesMessage(ai_evaluator.AIEvaluationError, 'dejó de responder por 0.05s'):
+            for chunk in self.gemini(FakeGenAI(stall_after=1), timeout=0.05).stream_sync('hola'):
+                chunks.append(chunk)
+        self.assertEqual(chunks, ['a'])
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_LAYERS, CACHES=LOCAL_CACHE)
+class LiveEvaluationBenchmarkTests(FakeRedisMixin, SimpleTestCase):
+
+    def test_benchmark_reports_latency_percentiles(self):
+        clear_evaluation_caches()
+        previous = ai_evaluator._evaluator
+        self.addCleanup(ai_evaluator.set_evaluator, previous)
+        out = StringIO()
+        call_command('benchmark_live_evaluation', submissions=20, spread=0.05, latency=0.0, stdout=out)
+        report = out.getvalue()
+        self.assertIn('Backend: fake (latencia 0.0s) · 20 entregas', report)
+        evaluation_row = next(line for line in report.splitlines() if line.startswith('Evaluación'))
+        self.assertEqual(evaluation_row.count('ms'), 4)  # p50, p95, p99 y máximo
+        # Las correctas (la solución con otro nombre de variable) entran al ranking
+        self.assertNotIn(' 0 broadcasts', report)
+        broadcast_row = next(line for line in report.splitlines() if line.startswith('Broadcast'))
+        self.assertEqual(broadcast_row.count('ms'), 4)
+        # La sala de usar y tirar no queda en Redis
+        self.assertEqual(self.redis.keys('*benchmark_*'), [])
@@ -0,0 +1,132 @@
+# backend/api/unread_counters.py
+from collections import Counter, defaultdict
+from datetime import datetime, timezone as dt_timezone
+from django.db.models import Count, OuterRef, Q, Subquery
+from django.db.models.functions import Coalesce
+from .models import Conversation, ReadReceipt
+from .live_game import get_redis, _script, _decode
+
+# ====================================================================
+# --- CONTADORES DE NO LEÍDOS (por usuario y conversación) ---
+# ====================================================================
+# En vez de contar los mensajes de cada conversación en cada carga del
+# inbox, cada mensaje nuevo suma 1 al contador de los demás participantes
+# y MarkAsReadView lo pone en 0. En Redis:
+#   unread:<user_id>        hash conversación -> no leídos
+#   unread_total:<user_id>  suma de todo el hash (el badge, O(1))
+# Si un usuario no tiene 'unread_total' (Redis nuevo o vaciado) se
+# reconstruye desde la BD al leerlo; 'reconcile_unread_counters' corrige
+# periódicamente cualquier desvío.
+
+MIN_DATETIME = datetime.min.replace(tzinfo=dt_timezone.utc)
+
+# KEYS: [unread:u1, unread_total:u1, unread:u2, unread_total:u2, ...]
+# ARGV: [conversation_id, n1, n2, ...]
+# Solo suma a los usuarios ya inicializados: el resto se reconstruye al leer.
+INCREMENT_LUA = """
+for i = 1, #KEYS, 2 do
+    if redis.call('EXISTS', KEYS[i + 1]) == 1 then
+        local n = ARGV[(i + 1) / 2 + 1]
+        redis.call('HINCRBY', KEYS[i], ARGV[1], n)
+        redis.call('INCRBY', KEYS[i + 1], n)
+    end
+end
+return 1
+"""
+
+# KEYS: [unread:u, unread_total:u]  ARGV: [conversation_id]
+RESET_LUA = """
+local n = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+redis.call('HDEL', KEYS[1], ARGV[1])
+if n > 0 and redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('DECRBY', KEYS[2], n)
+end
+return n
+"""
+
+
+def counts_key(user_id):
+    return f"unread:{user_id}"
+
+
+def total_key(user_id):
+    return f"unread_total:{user_id}"
+
+
+def unread_from_db(user_id):
+    """ {conversation_id: no leídos} calculado desde la BD (la consulta cara de antes). """
+    last_read = ReadReceipt.objects.filter(
+        conversation=OuterRef('pk'), user_id=user_id
+    ).values('last_read_timestamp')[:1]
+    rows = Conversation.objects.filter(participants=user_id).annotate(
+        last_read_time=Subquery(last_read)
+    ).annotate(
+        unread=Count('messages', filter=
+            Q(messages__timestamp__gt=Coalesce('last_read_time', MIN_DATETIME))
+            & ~Q(messages__sender_id=user_id)
+        )
+    ).values_list('id', 'unread')
+    return {conversation_id: unread for conversation_id, unread in rows if unread}
+
+
+def rebuild(user_id):
+    """ Reescribe los contadores del usuario desde la BD y los devuelve. """
+    counts = unread_from_db(user_id)
+    pipe = get_redis().pipeline()
+    pipe.delete(counts_key(user_id))
+    if counts:
+        pipe.hset(counts_key(user_id), mapping=counts)
+    pipe.set(total_key(user_id), sum(counts.values()))
+    pipe.execute()
+    return counts
+
+
+def get_unread_counts(user_id):
+    """ {conversation_id: no leídos} para el inbox (una lectura de Redis). """
+    pipe = get_redis().pipeline()
+    pipe.exists(total_key(user_id))
+    pipe.hgetall(counts_key(user_id))
+    initialized, raw = pipe.execute()
+    if not initialized:
+        return rebuild(user_id)
+    return {int(_decode(k)): int(v) for k, v in raw.items() if int(v) > 0}
+
+
+def get_unread_total(user_id):
+    total = get_redis().get(total_key(user_id))
+    if total is None:
+        return sum(rebuild(user_id).values())
+    return max(0, int(total))
+
+
+def reset_unread(user_id, conversation_id):
+    _script('unread_reset', RESET_LUA)(
+        keys=[counts_key(user_id), total_key(user_id)], args=[conversation_id]
+    )
+
+
+def count_new_messages(messages):
+    """ Suma cada mensaje nuevo a los no leídos de los participantes que no lo enviaron. """
+    senders = defaultdict(Counter)  # conversación -> remitente -> mensajes
+    for message in messages:
+        senders[message.conversation_id][message.sender_id] += 1
+
+    participants = defaultdict(list)
+    for conversation_id, user_id in Conversation.participants.through.objects.filter(
+        conversation_id__in=senders.keys()
+    ).values_list('conversation_id', 'user_id'):
+        participants[conversation_id].append(user_id)
+
+    script = _script('unread_increment', INCREMENT_LUA)
+    pipe = get_redis().pipeline()
+    for conversation_id, by_sender in senders.items():
+        total = sum(by_sender.values())
+        keys, args = [], [conversation_id]
+        for user_id in participants[conversation_id]:
+            unread = total - by_sender.get(user_id, 0)
+            if unread:
+                keys += [counts_key(user_id), total_key(user_id)]
+                args.append(unread)
+        if keys:
+            script(keys=keys, args=args, client=pipe)
+    pipe.execute()
@@ -28,8 +28,10 @@ from .views import (
     GradebookView,
     DirectMessageListView,
     LessonChatListView,
+    unread_total,
     MarkAsReadView,
     ReadReceiptListView,
+    ConversationParticipantListView,
     get_practice_world_data,
     create_live_quiz,
     get_course_students,     # <-- ¡NUEVA!
@@ -38,6 +40,10 @@ from .views import (
     get_course_quizzes,
     get_lesson_challenges,       # <-- ¡AÑADE ESTA!
     submit_challenge_solution,
+    evaluation_cache_stats,
+    evaluation_job_status,
+    challenge_similarity_report,
+    similar_code_submissions,
     create_live_code_challenge,
     get_lesson_live_quizzes,    # <-- ¡AÑADE ESTA!
     get_lesson_live_challenges, # <-- ¡ASEGÚRATE DE QUE ESTA LÍNEA EXISTA!
@@ -93,12 +99,19 @@ urlpatterns = [
     path('courses/<int:course_id>/grades/', GradebookView.as_view(), name='gradebook-list'),
     path('inbox/lesson_chats/', LessonChatListView.as_view(), name='lesson-chat-list'),
     path('inbox/conversations/<int:conversation_id>/mark_as_read/', MarkAsReadView.as_view(), name='mark-as-read'),
+    path('inbox/unread_total/', unread_total, name='unread-total'),
     path('inbox/conversations/<int:conversation_id>/read_receipts/', ReadReceiptListView.as_view(), name='read-receipt-list'),
+    path('inbox/conversations/<int:conversation_id>/participants/', ConversationParticipantListView.as_view(), name='conversation-participants'),
     path('course/<int:course_id>/students/', get_course_students, name='get_course_students'),
     path('users/<int:user_id>/add-xp/', add_experience_points, name='add_experience_points'),
     path('course/<int:course_id>/quizzes/', get_course_quizzes, name='get_course_quizzes'), 
     path('lesson/<int:lesson_id>/challenges/', get_lesson_challenges, name='get_lesson_challenges'),
     path('challenge/<int:challenge_id>/submit/', submit_challenge_solution, name='submit_challenge_solution'),
+    path('evaluation_jobs/<str:job_id>/', evaluation_job_status, name='evaluation_job_status'),
+    path('challenges/evaluation_cache/stats/', evaluation_cache_stats, name='evaluation_cache_stats'),
+    path('challenge/<int:challenge_id>/similarity/', challenge_similarity_report, name='challenge_similarity_report'),
+    path('live_challenge/<int:challenge_id>/similarity/', challenge_similarity_report, {'live': True}, name='live_challenge_similarity_report'),
+    path('code_submissions/<int:submission_id>/similar/', similar_code_submissions, name='similar_code_submissions'),
     path('course/<int:course_id>/practice_world/', get_practice_world_data, name='get_practice_world_data'),
     path('lesson/<int:lesson_id>/create_live_quiz/', create_live_quiz, name='create_live_quiz'),
     path('lesson/<int:lesson_id>/create_live_challenge/', create_live_code_challenge, name='create_live_code_challenge'),
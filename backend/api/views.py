@@ -18,16 +18,18 @@ from django.db.models.functions import Coalesce
 from django.core.exceptions import PermissionDenied
 import requests
 from django.db import transaction
-from rest_framework.pagination import PageNumberPagination
-import google.generativeai as genai
-from django.conf import settings
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.exceptions import NotFound
+from rest_framework.utils.urls import replace_query_param, remove_query_param
+import base64
 from rest_framework.exceptions import ValidationError
-try:
-    genai.configure(api_key=settings.GEMINI_API_KEY)
-except Exception as e:
-    print(f"ADVERTENCIA: No se pudo configurar la API de Gemini. {e}")
 # Imports de Modelos y Serializers de tu app
-from .models import Course, Enrollment, Lesson, LessonCompletion, Assignment, Submission, Quiz, User,Conversation, Message,LessonNote,ReadReceipt,CodeChallenge,Module,LiveCodeChallenge,Resource,Grade
+from .models import Course, Enrollment, Lesson, LessonCompletion, Assignment, Submission, Quiz, User,Conversation, Message,LessonNote,ReadReceipt,CodeChallenge,Module,LiveCodeChallenge,Resource,Grade,CodeSubmission
+from .evaluation_cache import evaluation_cache
+from .code_similarity import cluster_report, find_similar, DEFAULT_THRESHOLD
+from .unread_counters import get_unread_counts, get_unread_total, reset_unread
+from .evaluation_jobs import enqueue, get_job, QueueFullError
+from .code_precheck import precheck_code
 from .serializers import CourseSerializer, CourseDetailSerializer, UserSerializer, EnrollmentSerializer, LessonSerializer, LessonCompletionSerializer, AssignmentSerializer, SubmissionSerializer, QuizSerializer,ConversationListSerializer,MessageSerializer, MessageCreateSerializer, LessonNoteSerializer, GradedItemSerializer,ReadReceiptSerializer,StudentListSerializer, Question, Choice,CodeChallengeSerializer,ModuleSerializer,ModuleChallengeSerializer,LiveCodeChallengeSerializer,ResourceSerializer
 
 # ====================================================================
@@ -486,6 +488,75 @@ class MessagePagination(PageNumberPagination):
     page_size_query_param = 'page_size'
     max_page_size = 100
 
+class MessageCursorPagination(BasePagination):
+    """
+    Paginación por cursor (keyset) sobre (timestamp, id), del más nuevo al
+    más viejo. '?before=<cursor>' trae los anteriores y '?after=<cursor>' los
+    posteriores. Sin COUNT ni OFFSET: cada página cuesta lo mismo aunque el
+    chat tenga años de historia (usa el índice message_conv_time_idx).
+    """
+    page_size = 30
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+    @staticmethod
+    def encode_cursor(message):
+        raw = f"{message.timestamp.isoformat()}|{message.id}"
+        return base64.urlsafe_b64encode(raw.encode()).decode()
+
+    @staticmethod
+    def decode_cursor(cursor):
+        try:
+            timestamp, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+            timestamp = datetime.fromisoformat(timestamp)
+            return timestamp, int(message_id)
+        except (ValueError, UnicodeDecodeError):
+            raise NotFound('Cursor inválido.')
+
+    def get_page_size(self, request):
+        try:
+            return max(1, min(int(request.query_params.get(self.page_size_query_param, self.page_size)), self.max_page_size))
+        except ValueError:
+            return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        size = self.get_page_size(request)
+        before = request.query_params.get('before')
+        after = request.query_params.get('after')
+
+        if after:
+            # Los posteriores al cursor: se leen en orden ascendente y se dan vuelta
+            timestamp, message_id = self.decode_cursor(after)
+            rows = list(
+                queryset.filter(timestamp__gte=timestamp)
+                .filter(Q(timestamp__gt=timestamp) | Q(id__gt=message_id))
+                .order_by('timestamp', 'id')[:size + 1]
+            )
+            self.has_newer, self.has_older = len(rows) > size, True
+            self.page = rows[:size][::-1]
+            return self.page
+
+        if before:
+            timestamp, message_id = self.decode_cursor(before)
+            queryset = (
+                queryset.filter(timestamp__lte=timestamp)
+                .filter(Q(timestamp__lt=timestamp) | Q(id__lt=message_id))
+            )
+        rows = list(queryset.order_by('-timestamp', '-id')[:size + 1])
+        self.has_older, self.has_newer = len(rows) > size, bool(before)
+        self.page = rows[:size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        url = self.request.build_absolute_uri()
+        next_url = previous_url = None
+        if self.page and self.has_older:
+            next_url = replace_query_param(remove_query_param(url, 'after'), 'before', self.encode_cursor(self.page[-1]))
+        if self.page and self.has_newer:
+            previous_url = replace_query_param(remove_query_param(url, 'before'), 'after', self.encode_cursor(self.page[0]))
+        return Response({'next': next_url, 'previous': previous_url, 'results': data})
+
 class MessageListView(generics.ListCreateAPIView):
     """
     GET: Devuelve todos los mensajes de una conversación específica (¡AHORA PAGINADO!)
@@ -494,13 +565,22 @@ class MessageListView(generics.ListCreateAPIView):
     permission_classes = [IsAuthenticated]
     
     # --- ¡CAMBIO 1: AÑADIDO! ---
-    pagination_class = MessagePagination
+    pagination_class = MessageCursorPagination
+
+    @property
+    def paginator(self):
+        # '?page=N' sigue funcionando (con COUNT y OFFSET) para clientes viejos
+        if not hasattr(self, '_paginator'):
+            legacy = 'page' in self.request.query_params
+            self._paginator = MessagePagination() if legacy else MessageCursorPagination()
+        return self._paginator
     
     # --- (El resto de tus métodos) ---
     def get_conversation(self):
         conversation_id = self.kwargs['conversation_id']
         conversation = get_object_or_404(Conversation, id=conversation_id)
-        if not self.request.user in conversation.participants.all():
+        # exists(): no cargamos a todos los participantes de un chat de curso
+        if not conversation.participants.filter(id=self.request.user.id).exists():
             raise PermissionDenied("No tienes permiso para ver esta conversación.")
         return conversation
 
@@ -511,9 +591,8 @@ class MessageListView(generics.ListCreateAPIView):
 
     def get_queryset(self):
         conversation = self.get_conversation()
-        # Mantenemos el orden ASC (timestamp)
-        # Page 1 = Más antiguos, Last Page = Más nuevos
-        return conversation.messages.all().order_by('-timestamp')
+        # Del más nuevo al más viejo; el remitente viene en la misma consulta
+        return conversation.messages.select_related('sender').order_by('-timestamp', '-id')
 
     # --- ¡CAMBIO 2: MÉTODO 'list' ACTUALIZADO! ---
     # (Reemplaza el 'list' que te di antes por este)
@@ -531,7 +610,7 @@ class MessageListView(generics.ListCreateAPIView):
         if page is not None:
             # ¡LA LÍNEA CLAVE! Pasamos el contexto al serializador
             serializer = self.get_serializer(page, many=True, context=self.get_serializer_context())
-            # Devolvemos la respuesta paginada (con count, next, etc.)
+            # Devolvemos la respuesta paginada (next/previous; count solo con ?page=)
             return self.get_paginated_response(serializer.data)
 
         # Fallback (si no hay paginación)
@@ -738,17 +817,10 @@ class GroupChatListView(generics.ListAPIView):
             conversation=OuterRef('pk')
         ).order_by('-timestamp')
 
-        last_read_subquery = ReadReceipt.objects.filter(
-            conversation=OuterRef('pk'),
-            user=user
-        ).values('last_read_timestamp')[:1]
-
         return user.conversations.filter(
             is_group=True,
             lesson_chat__isnull=True
         ).annotate(
-            last_read_time=Subquery(last_read_subquery),
-
             # --- ¡INICIO DE LA CORRECCIÓN! ---
             # Anotamos todos los campos que necesitamos para el snippet
             last_msg_content=Subquery(last_message_subquery.values('content')[:1]),
@@ -757,19 +829,12 @@ class GroupChatListView(generics.ListAPIView):
             last_msg_timestamp=Subquery(last_message_subquery.values('timestamp')[:1])
             # --- FIN DE LA CORRECCIÓN! ---
 
-        ).annotate(
-            unread_count=Count('messages', filter=
-                Q(messages__timestamp__gt=Coalesce(
-                    'last_read_time',
-                    datetime.min.replace(tzinfo=dt_timezone.utc)
-                )) & 
-                ~Q(messages__sender=user)
-            )
         ).order_by(
             Coalesce('last_msg_timestamp', datetime.min.replace(tzinfo=dt_timezone.utc)).desc()
         )
     def get_serializer_context(self):
-        return {'request': self.request}
+        # No leídos: contadores de Redis (unread_counters.py), sin COUNT sobre los mensajes
+        return {'request': self.request, 'unread_counts': get_unread_counts(self.request.user.id)}
 
 class DirectMessageListView(generics.ListAPIView):
     """
@@ -786,16 +851,9 @@ class DirectMessageListView(generics.ListAPIView):
             conversation=OuterRef('pk')
         ).order_by('-timestamp')
 
-        last_read_subquery = ReadReceipt.objects.filter(
-            conversation=OuterRef('pk'),
-            user=user
-        ).values('last_read_timestamp')[:1]
-
         return user.conversations.filter(
             is_group=False
         ).annotate(
-            last_read_time=Subquery(last_read_subquery),
-
             # --- ¡INICIO DE LA CORRECCIÓN! ---
             last_msg_content=Subquery(last_message_subquery.values('content')[:1]),
             last_msg_type=Subquery(last_message_subquery.values('message_type')[:1]),
@@ -803,14 +861,6 @@ class DirectMessageListView(generics.ListAPIView):
             last_msg_timestamp=Subquery(last_message_subquery.values('timestamp')[:1])
             # --- FIN DE LA CORRECCIÓN! ---
 
-        ).annotate(
-            unread_count=Count('messages', filter=
-                Q(messages__timestamp__gt=Coalesce(
-                    'last_read_time',
-                    datetime.min.replace(tzinfo=dt_timezone.utc)
-                )) & 
-                ~Q(messages__sender=user)
-            )
         ).order_by(
             Coalesce('last_msg_timestamp', datetime.min.replace(tzinfo=dt_timezone.utc)).desc()
         )
@@ -818,7 +868,8 @@ class DirectMessageListView(generics.ListAPIView):
     def get_serializer_context(self):
         # Este método es importante para que el serializer
         # pueda acceder al 'request.user'
-        return {'request': self.request}
+        # No leídos: contadores de Redis (unread_counters.py), sin COUNT sobre los mensajes
+        return {'request': self.request, 'unread_counts': get_unread_counts(self.request.user.id)}
 
 class MarkAsReadView(APIView):
     """
@@ -840,8 +891,16 @@ class MarkAsReadView(APIView):
             conversation=conversation,
             defaults={'last_read_timestamp': timezone.now()}
         )
+        reset_unread(user.id, conversation.id)
         
         return Response(status=status.HTTP_200_OK)
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def unread_total(request):
+    """ Total de mensajes no leídos del usuario (badge del inbox), en O(1). """
+    return Response({'total': get_unread_total(request.user.id)})
     
 
 class LessonChatListView(generics.ListAPIView):
@@ -859,11 +918,6 @@ class LessonChatListView(generics.ListAPIView):
             conversation=OuterRef('pk')
         ).order_by('-timestamp')
 
-        last_read_subquery = ReadReceipt.objects.filter(
-            conversation=OuterRef('pk'),
-            user=user
-        ).values('last_read_timestamp')[:1]
-
         queryset = user.conversations.filter(
             is_group=True,
             lesson_chat__isnull=False
@@ -878,8 +932,6 @@ class LessonChatListView(generics.ListAPIView):
             queryset = queryset.filter(lesson_chat__module_id=module_id)
 
         return queryset.annotate(
-            last_read_time=Subquery(last_read_subquery),
-
             # --- ¡INICIO DE LA CORRECCIÓN! ---
             last_msg_content=Subquery(last_message_subquery.values('content')[:1]),
             last_msg_type=Subquery(last_message_subquery.values('message_type')[:1]),
@@ -887,20 +939,13 @@ class LessonChatListView(generics.ListAPIView):
             last_msg_timestamp=Subquery(last_message_subquery.values('timestamp')[:1])
             # --- FIN DE LA CORRECCIÓN! ---
 
-        ).annotate(
-            unread_count=Count('messages', filter=
-                Q(messages__timestamp__gt=Coalesce(
-                    'last_read_time',
-                    datetime.min.replace(tzinfo=dt_timezone.utc)
-                )) & 
-                ~Q(messages__sender=user)
-            )
         ).order_by(
             Coalesce('last_msg_timestamp', datetime.min.replace(tzinfo=dt_timezone.utc)).desc()
         )
 
     def get_serializer_context(self):
-        return {'request': self.request}
+        # No leídos: contadores de Redis (unread_counters.py), sin COUNT sobre los mensajes
+        return {'request': self.request, 'unread_counts': get_unread_counts(self.request.user.id)}
     
 
 class ReadReceiptListView(generics.ListAPIView):
@@ -917,6 +962,29 @@ class ReadReceiptListView(generics.ListAPIView):
         # Devuelve todos los recibos, EXCEPTO el del propio usuario
         return conversation.read_receipts.exclude(user=self.request.user).select_related('user')
 
+class ParticipantPagination(PageNumberPagination):
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+
+
+class ConversationParticipantListView(generics.ListAPIView):
+    """
+    Lista completa (paginada) de los participantes de una conversación.
+    El inbox solo trae el resumen (ConversationListSerializer.participants_preview).
+    """
+    serializer_class = UserSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = ParticipantPagination
+
+    def get_queryset(self):
+        conversation = get_object_or_404(Conversation, id=self.kwargs.get('conversation_id'))
+
+        if not conversation.participants.filter(id=self.request.user.id).exists():
+            raise PermissionDenied("No eres parte de esta conversación.")
+
+        return conversation.participants.order_by('username', 'id')
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated]) # Deberías crear un permiso IsProfessor
 def get_course_students(request, course_id):
@@ -1088,83 +1156,125 @@ def get_lesson_challenges(request, lesson_id):
 @permission_classes([IsAuthenticated])
 def submit_challenge_solution(request, challenge_id):
     """
-    Recibe la solución de un alumno, la evalúa con IA y devuelve feedback.
+    Encola la solución de un alumno y responde 202 con el id del trabajo
+    (o 200 con el resultado si los pre-chequeos estáticos ya la rechazan).
+    El worker la evalúa (casos de prueba + IA), da el XP y avisa por
+    WebSocket; el resultado también se consulta en evaluation_jobs/<id>/.
     """
+    challenge = CodeChallenge.objects.filter(id=challenge_id).only('starter_code').first()
+    if not challenge:
+        return Response({'error': 'Desafío no encontrado'}, status=404)
+
+    user_code = request.data.get('code', '')
+    if not user_code:
+        return Response({'error': 'No se envió código.'}, status=400)
+
+    # Sintaxis, tamaño, cuerpo vacío o código inicial sin cambios: respondemos ya,
+    # sin encolar ni ejecutar nada
+    rejection = precheck_code(user_code, challenge.starter_code)
+    if rejection:
+        return Response({
+            'status': 'done',
+            'result': {
+                'is_correct': False,
+                'feedback': rejection['feedback'],
+                'code_review': user_code,
+                'test_results': None,
+                'points_awarded': 0,
+                'new_total_xp': request.user.experience_points,
+                'precheck': rejection['reason'],
+            }
+        })
+
     try:
-        challenge = CodeChallenge.objects.get(id=challenge_id)
-        user_code = request.data.get('code', '')
-
-        if not user_code:
-            return Response({'error': 'No se envió código.'}, status=400)
-
-        # --- ¡AQUÍ ESTÁ LA MAGIA DE LA IA! ---
-
-        # 1. Prepara el "prompt" para la IA
-        # (Este es el prompt que te sugerí que usarías, ¡ahora lo estamos implementando!)
-        prompt = f"""
-        Eres un tutor de programación experto. Un alumno ha enviado una solución
-        para un desafío de código.
-
-        EL PROBLEMA:
-        {challenge.description}
-
-        LA SOLUCIÓN DEL ALUMNO:
-        ```python
-        {user_code}
-        ```
-
-        LA SOLUCIÓN ÓPTIMA (para tu referencia):
-        ```python
-        {challenge.solution}
-        ```
-
-        Por favor, evalúa la solución del alumno y responde en formato JSON
-        con la siguiente estructura:
-        {{
-          "is_correct": [true o false, basado en si el código resuelve el problema],
-          "feedback": [Un comentario breve y amable sobre el código del alumno],
-          "code_review": [El código original del alumno, pero con comentarios 
-                          inline (ej. # ¡Buen trabajo!) explicando los errores 
-                          o mejoras. Si es perfecto, solo pon un comentario 
-                          positivo.]
-        }}
-        """
+        job_id, priority, position = enqueue(request.user.id, challenge_id, user_code)
+    except QueueFullError:
+        response = Response({'error': 'Hay demasiadas evaluaciones en espera. Intenta en unos segundos.'}, status=503)
+        response['Retry-After'] = '5'
+        return response
 
-        # 2. Llama a la API de Gemini
-        model = genai.GenerativeModel('gemini-pro')
-        response = model.generate_content(prompt)
+    return Response({
+        'job_id': job_id,
+        'status': 'queued',
+        'priority': priority,
+        'position': position,
+    }, status=202)
 
-        # Limpia la respuesta de la IA (quitando los ```json ... ```)
-        json_response = response.text.strip().replace("```json", "").replace("```", "")
-        ia_data = json.loads(json_response)
 
-        points_awarded = 0
-        if ia_data.get('is_correct', False):
-            points_awarded = 50 # (O los puntos que quieras)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def evaluation_job_status(request, job_id):
+    """ Estado de una evaluación encolada (para el polling del frontend). """
+    job = get_job(job_id)
+    if not job or job['user_id'] != request.user.id:
+        return Response({'error': 'Evaluación no encontrada'}, status=404)
+    return Response(job)
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def evaluation_cache_stats(request):
+    """
+    Métricas de la caché de evaluaciones (hits, misses y hit-rate de todos
+    los procesos). Solo para profesores.
+    """
+    if not request.user.role == 'PROFESSOR':
+        return Response({'error': 'No tienes permiso'}, status=403)
+    return Response(evaluation_cache.stats())
 
-            # ¡Otorga los puntos de mascota!
-            user = request.user
-            user.experience_points = F('experience_points') + points_awarded
-            user.save(update_fields=['experience_points'])
-            user.refresh_from_db()
 
-            # (Opcional: Envía un WebSocket para que la mascota se actualice)
-            # ... (lógica de channel_layer.group_send) ...
+def _similarity_threshold(request):
+    try:
+        return min(1.0, max(0.0, float(request.query_params.get('threshold', DEFAULT_THRESHOLD))))
+    except ValueError:
+        return DEFAULT_THRESHOLD
 
-        # 3. Devuelve la respuesta de la IA al frontend
-        return Response({
-            'is_correct': ia_data.get('is_correct'),
-            'feedback': ia_data.get('feedback'),
-            'code_review': ia_data.get('code_review'),
-            'points_awarded': points_awarded,
-            'new_total_xp': request.user.experience_points
-        })
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def challenge_similarity_report(request, challenge_id, live=False):
+    """
+    Grupos de soluciones casi iguales de un desafío (de práctica o en vivo),
+    con ?threshold= opcional (0 a 1). Solo para el profesor del curso.
+    """
+    model = LiveCodeChallenge if live else CodeChallenge
+    if not request.user.role == 'PROFESSOR' or not model.objects.filter(
+        id=challenge_id, lesson__module__course__professor=request.user
+    ).exists():
+        return Response({'error': 'No tienes permiso'}, status=403)
+    threshold = _similarity_threshold(request)
+    if live:
+        return Response(cluster_report(live_challenge_id=challenge_id, threshold=threshold))
+    return Response(cluster_report(challenge_id=challenge_id, threshold=threshold))
 
-    except CodeChallenge.DoesNotExist:
-        return Response({'error': 'Desafío no encontrado'}, status=404)
-    except Exception as e:
-        print(f"ERROR EN LA EVALUACIÓN DE IA: {e}")
-        return Response({'error': f'Error al evaluar la solución: {e}'}, status=500)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def similar_code_submissions(request, submission_id):
+    """ Entregas de otros alumnos casi iguales a esta (?threshold= opcional). Solo para el profesor del curso. """
+    if not request.user.role == 'PROFESSOR':
+        return Response({'error': 'No tienes permiso'}, status=403)
+    submission = get_object_or_404(
+        CodeSubmission.objects.filter(
+            Q(challenge__lesson__module__course__professor=request.user)
+            | Q(live_challenge__lesson__module__course__professor=request.user)
+        ),
+        id=submission_id,
+    )
+    matches = find_similar(submission, _similarity_threshold(request))
+    return Response({
+        'submission_id': submission.id,
+        # La firma de las entregas en vivo la calcula el worker: mientras tanto no hay comparación
+        'pending': not submission.minhash,
+        'similar': [
+            {
+                'id': other.id,
+                'user_id': other.user_id,
+                'username': other.user.username,
+                'is_correct': other.is_correct,
+                'created_at': other.created_at,
+                'similarity': round(score, 3),
+            }
+            for other, score in matches
+        ],
+    })
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
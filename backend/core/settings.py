@@ -233,6 +233,27 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # API Keys
 GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY')
+AI_EVAL_MAX_CONCURRENCY = int(os.environ.get('AI_EVAL_MAX_CONCURRENCY', 8))  # llamadas simultáneas a Gemini
+AI_EVAL_TIMEOUT = 20  # segundos por llamada
+AI_EVAL_BATCH_WINDOW = 0.2  # segundos que se juntan entregas del mismo desafío en vivo
+AI_EVAL_BATCH_SIZE = 16     # entregas por lote (si se llena, sale antes)
+AI_EVAL_BACKEND = os.environ.get('AI_EVAL_BACKEND', 'gemini')  # gemini | sandbox (sin IA) | fake (pruebas)
+AI_EVAL_FAKE_LATENCY = float(os.environ.get('AI_EVAL_FAKE_LATENCY', 0.5))  # segundos que simula el backend falso
+EVAL_QUEUE_MAX_DEPTH = 500  # evaluaciones de práctica en espera antes de responder 503
+EVAL_JOB_LEASE = 120  # segundos sin noticias de una evaluación antes de reencolarla (worker caído)
+EVAL_JOB_MAX_RETRIES = 2  # veces que se reencola una evaluación perdida antes de darla por fallida
+CHAT_WRITE_INTERVAL = 0.05  # segundos entre lotes de mensajes del chat (write-behind)
+CHAT_WRITE_BATCH = 200      # mensajes por lote (si se llena, sale antes)
+MESSAGE_ID_WORKER_LEASE = 60  # segundos de vida del número de proceso de los ids de mensajes (se renueva al usarlo)
+WS_MAX_TOPICS = 50          # suscripciones por socket en /ws/user/
+
+# Sandbox local para los casos de prueba de los desafíos de código
+CODE_RUNNER_POOL_SIZE = int(os.environ.get('CODE_RUNNER_POOL_SIZE', 4))  # intérpretes listos de antemano
+CODE_RUNNER_TIME_LIMIT = 2    # segundos por caso
+CODE_RUNNER_MEMORY_MB = 256   # memoria por caso
+CODE_MAX_CHARS = 20000        # tamaño máximo de una entrega (pre-chequeo)
+CODE_MAX_LINES = 500
+CODE_RUNNER_USER = os.environ.get('CODE_RUNNER_USER', 'nobody')  # usuario del sandbox si el servidor corre como root ('' = no cambiar)
 
 CSRF_TRUSTED_ORIGINS = [
     'https://lms-project-production-39d6.up.railway.app',
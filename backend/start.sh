@@ -0,0 +1,41 @@
+#!/bin/sh
+# Arranque del contenedor (Dockerfile). PROCESS_TYPE elige qué corre:
+#   web     -> daphne (HTTP + WebSockets)
+#   worker  -> python manage.py run_live_games (avanza las fases de los
+#              quizzes y desafíos en vivo; sin él se quedan en la 1ª pregunta)
+#   evaluator -> python manage.py run_evaluation_worker (cola de evaluaciones
+#              de los desafíos de práctica; sin él quedan 'queued' para siempre)
+#   all     -> (por defecto) todo en un mismo contenedor: los procesos de
+#              fondo se reinician si se caen y daphne queda en primer plano
+# Con docker-compose cada proceso es un servicio aparte (ver docker-compose.yml).
+
+PORT="${PORT:-8000}"
+
+run_forever() {
+    while true; do
+        "$@"
+        echo "[START] '$*' terminó con código $?, reiniciando en 2s..."
+        sleep 2
+    done
+}
+
+case "${PROCESS_TYPE:-all}" in
+    web)
+        exec daphne -b 0.0.0.0 -p "$PORT" core.asgi:application
+        ;;
+    worker)
+        exec python manage.py run_live_games
+        ;;
+    evaluator)
+        exec python manage.py run_evaluation_worker
+        ;;
+    all)
+        run_forever python manage.py run_live_games &
+        run_forever python manage.py run_evaluation_worker &
+        exec daphne -b 0.0.0.0 -p "$PORT" core.asgi:application
+        ;;
+    *)
+        echo "[START] PROCESS_TYPE desconocido: '$PROCESS_TYPE' (web | worker | evaluator | all)"
+        exit 1
+        ;;
+esac
@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import axiosInstance from '../api/axios';
 import { useAuth } from '../context/AuthContext';
 import { 
@@ -32,7 +32,7 @@ const getScrollbarStyles = (theme) => ({
   '&::-webkit-scrollbar-thumb:hover': { backgroundColor: theme.palette.primary.dark }
 });
 
-const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned }) => {
+const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned, evaluationPush, reviewStream }) => {
   const { authTokens } = useAuth();
   
   // --- ¡ESTADOS CORREGIDOS! ---
@@ -44,6 +44,11 @@ const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned }) => {
   
   const [loading, setLoading] = useState(true);
   const [isEvaluating, setIsEvaluating] = useState(false);
+  // Evaluación encolada que estamos esperando: { jobId, resolve }
+  const pendingJobRef = useRef(null);
+  // Revisión parcial mientras la IA la escribe (WebSocket o, si no, polling)
+  const [pendingJobId, setPendingJobId] = useState(null);
+  const [polledReview, setPolledReview] = useState("");
   
   // --- ¡LÓGICA DE CARGA DE DATOS RESTAURADA! ---
   useEffect(() => {
@@ -70,6 +75,50 @@ const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned }) => {
     fetchChallenges();
   }, [lessonId]); // Se carga cuando la lección cambia
 
+  // Si el resultado llega por WebSocket, no esperamos al próximo polling
+  useEffect(() => {
+    const pending = pendingJobRef.current;
+    if (evaluationPush && pending && evaluationPush.job_id === pending.jobId) {
+      pending.resolve(evaluationPush);
+    }
+  }, [evaluationPush]);
+
+  // El servidor responde 202 con un job_id: consultamos hasta que termine
+  // (cada vez más espaciado) o hasta que llegue el aviso por WebSocket.
+  const waitForEvaluation = (jobId) => new Promise((resolve, reject) => {
+    let delay = 500;
+    let settled = false;
+    const finish = (job) => {
+      if (settled) return;
+      settled = true;
+      pendingJobRef.current = null;
+      setPendingJobId(null);
+      if (job.status === 'done') resolve(job.result);
+      else reject(new Error(job.error || 'Error al evaluar la solución'));
+    };
+    pendingJobRef.current = { jobId, resolve: finish };
+    setPendingJobId(jobId);
+    setPolledReview("");
+
+    const poll = async () => {
+      if (settled) return;
+      try {
+        const { data } = await axiosInstance.get(`/api/evaluation_jobs/${jobId}/`);
+        if (data.status === 'done' || data.status === 'error') return finish(data);
+        if (data.partial_review) setPolledReview(data.partial_review);
+      } catch (err) {
+        if (err.response?.status === 404) return finish({ status: 'error', error: 'La evaluación expiró' });
+      }
+      delay = Math.min(delay * 1.5, 3000);
+      setTimeout(poll, delay);
+    };
+    setTimeout(poll, delay);
+  });
+
+  const streamedReview = pendingJobId && reviewStream?.job_id === pendingJobId
+    ? reviewStream.text
+    : (pendingJobId ? polledReview : "");
+
   // --- Obtener el desafío activo ---
   const activeChallenge = challenges[currentChallengeIndex];
 
@@ -99,7 +148,10 @@ const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned }) => {
         { headers: { 'Authorization': `Bearer ${authTokens.access}` } }
       );
       
-      const result = response.data;
+      // 202: quedó en cola. 200: los pre-chequeos ya la resolvieron (ej. error de sintaxis)
+      const result = response.status === 202
+        ? await waitForEvaluation(response.data.job_id)
+        : response.data.result;
       setFeedback(result);
       
       if (result.is_correct) {
@@ -111,7 +163,7 @@ const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned }) => {
       
     } catch (err) {
       console.error("Error al evaluar el código:", err);
-      onNotify(err.response?.data?.error || "Error al conectar con la IA", 'error');
+      onNotify(err.response?.data?.error || err.message || "Error al conectar con la IA", 'error');
     } finally {
       setIsEvaluating(false);
     }
@@ -187,6 +239,22 @@ const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned }) => {
           {isEvaluating ? <CircularProgress size={24} /> : "Evaluar mi Solución"}
         </Button>
 
+        {/* --- Revisión de la IA mientras se genera --- */}
+        {isEvaluating && streamedReview && (
+          <Paper sx={{ mt: 3, p: 2, bgcolor: 'background.default' }}>
+            <Typography variant="h6" sx={{ fontWeight: 600, mb: 1 }}>
+              La IA está revisando tu código...
+            </Typography>
+            <Typography
+              component="pre"
+              variant="body2"
+              sx={{ m: 0, fontFamily: 'monospace', whiteSpace: 'pre-wrap', wordBreak: 'break-word' }}
+            >
+              {streamedReview}
+            </Typography>
+          </Paper>
+        )}
+
         {/* --- Sección de Feedback de la IA --- */}
         {feedback && (
           <Paper sx={{ mt: 3, p: 2, bgcolor: 'background.default' }}>
@@ -198,17 +266,21 @@ const CodeChallengePanel = ({ theme, lessonId, onNotify, onXpEarned }) => {
               {feedback.is_correct && ` ¡Ganaste ${feedback.points_awarded} XP!`}
             </Alert>
             
-            <Typography variant="body2" sx={{ mb: 1, color: 'text.secondary' }}>
-              Código revisado (con comentarios):
-            </Typography>
-            <SyntaxHighlighter 
-              language="python"
-              style={atomDark} 
-              customStyle={{ margin: 0, padding: '16px', borderRadius: '4px' }}
-              wrapLongLines={true}
-            >
-              {String(feedback.code_review).trim()}
-            </SyntaxHighlighter>
+            {feedback.code_review && (
+              <>
+                <Typography variant="body2" sx={{ mb: 1, color: 'text.secondary' }}>
+                  Código revisado (con comentarios):
+                </Typography>
+                <SyntaxHighlighter 
+                  language="python"
+                  style={atomDark} 
+                  customStyle={{ margin: 0, padding: '16px', borderRadius: '4px' }}
+                  wrapLongLines={true}
+                >
+                  {String(feedback.code_review).trim()}
+                </SyntaxHighlighter>
+              </>
+            )}
           </Paper>
         )}
       </Box>
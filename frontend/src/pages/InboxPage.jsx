@@ -4,7 +4,7 @@ import { useTheme } from '@mui/material/styles';
 import { motion } from "framer-motion";
 import axiosInstance from '../api/axios';
 import { useAuth } from '../context/AuthContext';
-import useWebSocket from 'react-use-websocket';
+import { useTopicSocket } from '../services/userSocket';
 import {
   Box,
   Typography,
@@ -186,21 +186,10 @@ function InboxPage() {
   const typingTimeoutRef = useRef(null); // <-- ¡NUEVO!
 
   // --- Lógica de WebSocket ---
-  // --- CAMBIO: URL DE PRODUCCIÓN (RAILWAY) ---
-  const socketUrl = selectedConvo && authTokens
-    ? `wss://lms-project-production-39d6.up.railway.app/ws/chat/conversation/${selectedConvo.id}/?token=${authTokens?.access}`
-    : null;
-
-  const { lastJsonMessage, sendJsonMessage } = useWebSocket( // <-- ¡Obtenemos sendJsonMessage!
-    socketUrl,
-    {
-      onOpen: () => console.log('WebSocket (Inbox) conectado'),
-      onClose: (e) => console.log('WebSocket (Inbox) desconectado:', e?.reason),
-      onError: (e) => console.error('WebSocket (Inbox) error:', e),
-      shouldReconnect: (closeEvent) => true,
-    },
-    !!socketUrl
-  );
+  // Socket único del usuario, suscrito a la conversación abierta (services/userSocket.js)
+  const { lastJsonMessage, sendJsonMessage } = useTopicSocket([
+    selectedConvo ? `conversation:${selectedConvo.id}` : null,
+  ]);
 
   // ==========================
   // === useEffects / Data ===
@@ -1113,7 +1102,7 @@ function InboxPage() {
                   <AccordionDetails sx={{ p: 0, pt: 0 }}>
                     <List sx={{ p: 1, pt: 0 }}>
                       {dmChats.map(convo => {
-                        const otherParticipant = (convo.participants || []).find(p => p.username !== user?.username);
+                        const otherParticipant = (convo.participants_preview || []).find(p => p.username !== user?.username);
                         if (!otherParticipant) return null;
 
                         return (
@@ -1277,16 +1266,16 @@ function InboxPage() {
               <>
                 <Avatar
                   sx={{ bgcolor: 'primary.main', mr: 2 }}
-                  src={!selectedConvo.is_group ? (selectedConvo.participants || []).find(p => p.username !== user?.username)?.profile_image : undefined}
+                  src={!selectedConvo.is_group ? (selectedConvo.participants_preview || []).find(p => p.username !== user?.username)?.profile_image : undefined}
                 >
-                  {selectedConvo.is_group ? (selectedConvo.name ? selectedConvo.name[0] : '?') : ((selectedConvo.participants || []).find(p => p.username !== user?.username)?.username?.[0] || '?')}
+                  {selectedConvo.is_group ? (selectedConvo.name ? selectedConvo.name[0] : '?') : ((selectedConvo.participants_preview || []).find(p => p.username !== user?.username)?.username?.[0] || '?')}
                 </Avatar>
                 <Box>
                   <Typography variant="h6" sx={{ fontWeight: 600 }}>
-                    {selectedConvo.is_group ? selectedConvo.name : ((selectedConvo.participants || []).find(p => p.username !== user?.username)?.username || 'Usuario')}
+                    {selectedConvo.is_group ? selectedConvo.name : ((selectedConvo.participants_preview || []).find(p => p.username !== user?.username)?.username || 'Usuario')}
                   </Typography>
                   <Typography variant="body2" color="text.secondary">
-                    {selectedConvo.is_group ? `${(selectedConvo.participants || []).length} participantes` : 'Mensaje Directo'}
+                    {selectedConvo.is_group ? `${selectedConvo.participant_count ?? 0} participantes` : 'Mensaje Directo'}
                   </Typography>
                 </Box>
               </>
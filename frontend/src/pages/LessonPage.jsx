@@ -74,7 +74,8 @@ import CodeIcon from '@mui/icons-material/Code';
 import AssignmentTurnedInIcon from '@mui/icons-material/AssignmentTurnedIn';
 
 // --- WebSocket y CodeShare ---
-import useWebSocket, { ReadyState } from 'react-use-websocket';
+import { ReadyState } from 'react-use-websocket';
+import { useTopicSocket } from '../services/userSocket';
 import { Prism as SyntaxHighlighter } from 'react-syntax-highlighter'; 
 import { atomDark } from 'react-syntax-highlighter/dist/esm/styles/prism'; 
 import { useAuth } from '../context/AuthContext'; 
@@ -560,6 +561,20 @@ const ProfessorPanel = ({
                     <Typography variant="body2" color="text.secondary" sx={{ mb: 3 }}>
                        Monitorizando respuestas en tiempo real...
                     </Typography>
+                    {quizStats?.histogram && quizStats?.currentQuestion && (
+                      <Box sx={{ mb: 3, textAlign: 'left' }}>
+                        {quizStats.currentQuestion.choices.map(choice => {
+                          const count = quizStats.histogram.counts[choice.id] || 0;
+                          const pct = quizStats.histogram.total ? (count / quizStats.histogram.total) * 100 : 0;
+                          return (
+                            <Box key={choice.id} sx={{ mb: 1 }}>
+                              <Typography variant="caption">{choice.text} ({count})</Typography>
+                              <LinearProgress variant="determinate" value={pct} sx={{ height: 8, borderRadius: 4 }} />
+                            </Box>
+                          );
+                        })}
+                      </Box>
+                    )}
                     <Button variant="contained" color="error" onClick={handleEndGameParent}>
                         Terminar Quiz
                     </Button>
@@ -960,7 +975,13 @@ function LessonPage() {
   const [timerProgress, setTimerProgress] = useState(100);
   const [selectedChoiceId, setSelectedChoiceId] = useState(null);
   const timerRef = useRef(null);
+  // Paquete de preguntas del quiz (llega una vez, al iniciar o al reconectar)
+  const quizPackRef = useRef([]);
   const [codeSolution, setCodeSolution] = useState("");
+  // Último resultado de evaluación encolada que llegó por WebSocket
+  const [evaluationPush, setEvaluationPush] = useState(null);
+  // Revisión de la IA que va llegando en trozos: { job_id, text }
+  const [reviewStream, setReviewStream] = useState(null);
 
   const [drawerOpen, setDrawerOpen] = useState(false); // <--- ESTADO DEL DRAWER
   const [liveQuizzes, setLiveQuizzes] = useState([]);      // <--- Mover aquí la carga
@@ -1191,28 +1212,21 @@ function LessonPage() {
     }
   };
 
-  const WS_BASE = 'wss://lms-project-production-39d6.up.railway.app';
-
-  // Construcción de la URL
-  const socketUrl = (authTokens && authTokens.access && lesson) 
-    // NOTA LA BARRA '/' ANTES DEL '?' ¡ES CRÍTICA PARA TU REGEX!
-    ? `${WS_BASE}/ws/chat/lesson/${lessonId}/?token=${authTokens.access}`
-    : null;
-
-  const { sendJsonMessage, lastJsonMessage, readyState } = useWebSocket(
-    socketUrl,
-    {
-      onOpen: () => {
-        console.log('🟢 [FRONTEND] Conectado al WebSocket');
-        // Opcional: Anunciar presencia si tu Consumer lo espera
-        sendJsonMessage({ message_type: 'ANNOUNCE_PRESENCE' });
-      },
-      onClose: (e) => console.log('🔴 [FRONTEND] Desconectado', e),
-      shouldReconnect: (closeEvent) => true,
-      retryOnError: true,
-    },
-    !!socketUrl // Solo conecta si la URL es válida
-  );
+  // El ranking llega como top completo ('full') o solo con las filas que
+  // cambiaron respecto a la versión anterior ('delta').
+  const applyRankingUpdate = (prevRanking, data) => {
+    if (data.mode !== 'delta') return data.ranking || [];
+    const next = [...(prevRanking || [])];
+    data.changes.forEach(row => { next[row.rank - 1] = row; });
+    return next.slice(0, data.size);
+  };
+
+  // Socket único del usuario: la sala de esta lección + sus notificaciones
+  // (XP, resultados de evaluaciones). Ver services/userSocket.js
+  const { sendJsonMessage, lastJsonMessage, readyState } = useTopicSocket([
+    lesson ? `lesson:${lessonId}` : null,
+    'notifications',
+  ]);
   useEffect(() => {
     if (lastJsonMessage !== null) {
       
@@ -1233,9 +1247,74 @@ function LessonPage() {
         }
       }
       
+      // --- 2b. Resultado de una evaluación de práctica (cola del servidor) ---
+      else if (lastJsonMessage.type === 'challenge_evaluation_result') {
+        setEvaluationPush(lastJsonMessage.data);
+      }
+      else if (lastJsonMessage.type === 'challenge_review_chunk') {
+        const { job_id, seq, text } = lastJsonMessage.data;
+        // 'text' es la revisión acumulada: si React agrupa mensajes y este efecto
+        // se saltea alguno, el siguiente ya trae todo. Nos quedamos con el más nuevo.
+        setReviewStream(prev => (
+          prev && prev.job_id === job_id && prev.seq >= seq ? prev : { job_id, seq, text }
+        ));
+      }
+
       // --- 3. Lógica de "Pregunta de Quiz" (para Alumno y Profesor) ---
+      else if (lastJsonMessage.type === 'quiz_pack') {
+        quizPackRef.current = lastJsonMessage.data.questions;
+        if (user.role !== 'PROFESSOR') {
+          setQuizGameState({ view: 'get_ready', data: null });
+        }
+      }
+
+      // --- 3a. Foto del juego al (re)conectar: retomamos donde esté ---
+      else if (lastJsonMessage.type === 'quiz_snapshot') {
+        const snap = lastJsonMessage.data;
+        setGameInProgress(snap.game_type === 'quiz' ? 'quiz' : 'challenge');
+        if (snap.game_type === 'quiz') quizPackRef.current = snap.questions;
+
+        // Tiempo restante según el reloj del servidor (evita desfases del cliente)
+        const remaining = snap.deadline ? Math.max(0, snap.deadline - snap.now) : 0;
+        if (timerRef.current) clearInterval(timerRef.current);
+        if (remaining > 0 && snap.timer) {
+          const updatesPerSecond = 10;
+          const stepPercentage = 100 / (snap.timer * updatesPerSecond);
+          setTimerProgress(100 * remaining / snap.timer);
+          timerRef.current = setInterval(() => {
+            setTimerProgress(prev => {
+              if (prev <= 0) {
+                clearInterval(timerRef.current);
+                return 0;
+              }
+              return prev - stepPercentage;
+            });
+          }, 1000 / updatesPerSecond);
+        }
+
+        if (user.role !== 'PROFESSOR') {
+          if (snap.phase === 'question' && remaining > 0 && !snap.answered) {
+            setSelectedChoiceId(null);
+            setQuizGameState({ view: 'question', data: { ...snap, question: snap.questions[snap.question_index] } });
+          } else if (snap.phase === 'code' && remaining > 0 && !snap.answered) {
+            setQuizGameState({ view: 'code_challenge', data: { challenge: snap.questions[0], timer: remaining, language: 'python' } });
+          } else if (snap.phase === 'starting' || snap.phase === 'get_ready') {
+            setQuizGameState({ view: 'get_ready', data: null });
+          } else {
+            setQuizGameState({ view: 'ranking', data: null });
+          }
+        }
+        // El ranking completo llegará en el próximo 'quiz_ranking_update' ('full')
+        setQuizStats(prev => ({ ...prev, me: snap.me }));
+      }
+
       else if (lastJsonMessage.type === 'quiz_question') {
         console.log("¡QUIZ_QUESTION recibido!", lastJsonMessage.data);
+        // La ronda solo trae el índice: la pregunta sale del paquete
+        const questionData = {
+          ...lastJsonMessage.data,
+          question: lastJsonMessage.data.question || quizPackRef.current[lastJsonMessage.data.question_index],
+        };
             
         // Esta lógica es para TODOS (para que el profesor vea el timer, etc.)
         // 1. Limpia el temporizador y la selección
@@ -1261,9 +1340,17 @@ function LessonPage() {
 
         // 3. Muestra la pregunta (SOLO AL ALUMNO)
         if (user.role !== 'PROFESSOR') {
-          setQuizGameState({ view: 'question', data: lastJsonMessage.data });
+          setQuizGameState({ view: 'question', data: questionData });
+        } else {
+          // El profesor guarda la pregunta para etiquetar el histograma en vivo
+          setQuizStats(prev => ({ ...prev, currentQuestion: questionData.question, histogram: null }));
         }
       }
+
+      // --- 4b. Histograma de respuestas en vivo (Solo Profesor) ---
+      else if (lastJsonMessage.type === 'quiz_answer_histogram') {
+        setQuizStats(prev => ({ ...prev, histogram: lastJsonMessage.data }));
+      }
           
       // --- 4. Lógica de "Resultado de Respuesta" (Solo Alumno) ---
       else if (lastJsonMessage.type === 'answer_result') {
@@ -1294,7 +1381,11 @@ function LessonPage() {
         console.log("Ranking recibido:", lastJsonMessage.data);
         
         // Actualizamos SIEMPRE los datos del gráfico/ranking en segundo plano
-        setQuizStats(prev => ({ ...prev, ranking: lastJsonMessage.data.ranking }));
+        setQuizStats(prev => ({
+          ...prev,
+          ranking: applyRankingUpdate(prev?.ranking, lastJsonMessage.data),
+          me: lastJsonMessage.data.me
+        }));
 
         if (user.role !== 'PROFESSOR') {
           setQuizGameState(prevState => {
@@ -1406,7 +1497,10 @@ function LessonPage() {
         message_type: 'ANNOUNCE_PRESENCE'
       });
     }
-  }, [readyState, sendJsonMessage]);
+    // Solo al (re)conectar: si dependiera de cada render, cada 'user_joined'
+    // haría que todos volvieran a anunciarse
+    // eslint-disable-next-line react-hooks/exhaustive-deps
+  }, [readyState]);
   const handleGiveXp = (targetUserId, points) => {
     console.log(`Dando ${points} XP a ${targetUserId}...`);
     sendJsonMessage({
@@ -2161,6 +2255,8 @@ function LessonPage() {
                                   }}
                                   // Pasa la función para actualizar el XP de la mascota
                                   onXpEarned={(newTotalXp) => setCurrentXp(newTotalXp)}
+                                  evaluationPush={evaluationPush}
+                                  reviewStream={reviewStream}
                                 />
                                 </TabPanel>
                                 {/* --- FIN DEL REEMPLAZO --- */}
@@ -2305,6 +2401,15 @@ function LessonPage() {
                     <Typography variant="h6" color="primary">{player.score} pts</Typography>
                   </ListItem>
                 ))}
+
+                {/* Si no estoy en el top, muestro mi puesto al final */}
+                {quizStats && quizStats.me && quizStats.me.rank > (quizStats.ranking || []).length && (
+                  <ListItem sx={{ borderTop: 1, borderColor: 'divider', mt: 1 }}>
+                    <ListItemIcon sx={{fontSize: '1.5rem'}}>{`${quizStats.me.rank}.`}</ListItemIcon>
+                    <ListItemText primary={`${user.username} (tú)`} sx={{ fontWeight: 600 }} />
+                    <Typography variant="h6" color="primary">{quizStats.me.score} pts</Typography>
+                  </ListItem>
+                )}
               </List>
               
               {/* --- ¡BOTÓN AÑADIDO/MODIFICADO! --- */}
@@ -2366,11 +2471,12 @@ function LessonPage() {
               
               {/* Muestra el puesto del alumno si está en el ranking */}
               {(() => {
-                 const myRank = quizGameState.data.ranking.findIndex(p => p.username === user.username);
-                 if (myRank !== -1) {
+                 // El backend solo envía el top 10; mi puesto llega aparte en 'me'
+                 const me = quizGameState.data.me;
+                 if (me) {
                    return (
                      <Alert severity="success" sx={{ mb: 2 }}>
-                       ¡Quedaste en el puesto #{myRank + 1} con {quizGameState.data.ranking[myRank].score} puntos!
+                       ¡Quedaste en el puesto #{me.rank} con {me.score} puntos!
                      </Alert>
                    )
                  }
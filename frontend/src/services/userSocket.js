@@ -0,0 +1,79 @@
+// frontend/src/services/userSocket.js
+
+import { useCallback, useEffect, useMemo, useState } from 'react';
+import useWebSocket, { ReadyState } from 'react-use-websocket';
+import { useAuth } from '../context/AuthContext';
+
+const WS_BASE = 'wss://lms-project-production-39d6.up.railway.app';
+
+// Un solo WebSocket por usuario (/ws/user/) compartido por toda la app
+// ('share'). Cada componente se suscribe a sus temas:
+//   'lesson:<id>', 'conversation:<id>', 'notifications'
+// y recibe solo los eventos de esos temas, con el mismo formato que los
+// sockets de antes (/ws/chat/...).
+export function useTopicSocket(topics) {
+  const { authTokens } = useAuth();
+  const topicList = (topics || []).filter(Boolean);
+  const topicKey = topicList.join(',');
+  const [subscribed, setSubscribed] = useState({});
+
+  const socketUrl = authTokens?.access
+    ? `${WS_BASE}/ws/user/?token=${authTokens.access}`
+    : null;
+
+  const { sendJsonMessage: sendRaw, lastJsonMessage, readyState } = useWebSocket(
+    socketUrl,
+    {
+      share: true,
+      shouldReconnect: () => true,
+      retryOnError: true,
+      // Solo los mensajes de mis temas actualizan 'lastJsonMessage'
+      filter: (message) => {
+        try {
+          return topicList.includes(JSON.parse(message.data).topic);
+        } catch {
+          return false;
+        }
+      },
+    },
+    !!socketUrl && topicList.length > 0
+  );
+
+  // Suscribirse al abrir (y al reconectar); desuscribirse al cambiar de temas
+  useEffect(() => {
+    if (readyState !== ReadyState.OPEN || !topicKey) return;
+    const list = topicKey.split(',');
+    list.forEach(topic => sendRaw({ action: 'subscribe', topic }));
+    return () => {
+      setSubscribed({});
+      // keep=false: si el socket ya se cerró, no hace falta avisar
+      list.forEach(topic => sendRaw({ action: 'unsubscribe', topic }, false));
+    };
+  }, [readyState, topicKey]);
+
+  useEffect(() => {
+    if (!lastJsonMessage?.status) return;
+    const { topic, status, detail } = lastJsonMessage;
+    setSubscribed(prev => ({ ...prev, [topic]: status === 'subscribed' }));
+    if (status === 'rejected' || status === 'error') {
+      console.warn(`WebSocket: tema ${topic} ${status}`, detail || '');
+    }
+  }, [lastJsonMessage]);
+
+  // Los componentes ven el evento tal cual (sin el sobre del tema)
+  const lastEvent = useMemo(() => lastJsonMessage?.event ?? null, [lastJsonMessage]);
+
+  // 'OPEN' recién cuando todos los temas están suscritos
+  const allSubscribed = topicList.length > 0 && topicList.every(topic => subscribed[topic]);
+  const topicReadyState = readyState === ReadyState.OPEN && !allSubscribed
+    ? ReadyState.CONNECTING
+    : readyState;
+
+  // Por defecto, al primer tema (la sala o la conversación). Estable entre
+  // renders: los componentes lo usan como dependencia de sus efectos
+  const sendJsonMessage = useCallback((data, topic = topicKey.split(',')[0]) => {
+    sendRaw({ action: 'send', topic, data });
+  }, [topicKey, sendRaw]);
+
+  return { sendJsonMessage, lastJsonMessage: lastEvent, readyState: topicReadyState };
+}